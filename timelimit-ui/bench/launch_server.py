@@ -0,0 +1,45 @@
+"""Start web_server.py outside the add-on container, with /data replaced by a scratch directory.
+
+Usage: python3 launch_server.py --port 18099 --upstream http://127.0.0.1:18080 --data-dir /tmp/tl-bench
+"""
+
+import argparse
+import json
+import os
+import sys
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rootfs", "usr", "bin")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=18099)
+    parser.add_argument("--upstream", required=True)
+    parser.add_argument("--data-dir", required=True)
+    parser.add_argument("--mode", choices=("threaded", "asyncio"), default="threaded")
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    options_path = os.path.join(args.data_dir, "options.json")
+    with open(options_path, "w") as f:
+        json.dump({"server_url": args.upstream, "logging_mode": "standard", "server_mode": args.mode}, f)
+
+    bin_dir = os.path.abspath(BIN_DIR)
+    sys.path.insert(0, bin_dir)
+    os.chdir(bin_dir)
+    import web_server
+    from static_assets import StaticAssetCache
+    from storage_engine import StorageEngine
+
+    web_server.CONFIG.path = options_path
+    web_server.HTML_PATH = os.path.join(bin_dir, "dashboard.html")
+    web_server.STATIC_ASSETS = StaticAssetCache(bin_dir, "dashboard.html")
+    web_server.STORAGE = StorageEngine(os.path.join(args.data_dir, "timelimit_ui_storage.json"))
+    web_server.EVENTS_PATH = os.path.join(args.data_dir, "timelimit_ui_events.json")
+    web_server.PUSH_OUTBOX.path = os.path.join(args.data_dir, "timelimit_push_outbox.json")
+    web_server.PUSH_OUTBOX.tmp_path = web_server.PUSH_OUTBOX.path + ".tmp"
+    web_server.main(args.port)
+
+
+if __name__ == "__main__":
+    main()
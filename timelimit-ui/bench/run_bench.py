@@ -0,0 +1,324 @@
+"""Benchmark the add-on web server against the stub TimeLimit server.
+
+Starts stub_server.py and launch_server.py as subprocesses, runs the selected scenarios
+with concurrent clients and prints one JSON document (latency percentiles in ms,
+throughput, errors and server RSS) so runs can be compared across versions.
+
+Usage: python3 run_bench.py --clients 16 --duration 10 --output result.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ("proxy", "longpoll", "storage", "bcrypt", "static")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def summarize(latencies_s, errors, elapsed_s):
+    values = sorted(v * 1000 for v in latencies_s)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "rps": round(len(values) / elapsed_s, 1) if elapsed_s else None,
+        "p50_ms": round(percentile(values, 0.50), 2) if values else None,
+        "p95_ms": round(percentile(values, 0.95), 2) if values else None,
+        "p99_ms": round(percentile(values, 0.99), 2) if values else None,
+        "max_ms": round(values[-1], 2) if values else None,
+    }
+
+
+def read_rss_kb(pid):
+    """(VmRSS, VmHWM) of a process in kB from /proc; (None, None) where unavailable."""
+    rss = peak = None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1])
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1])
+    except OSError:
+        pass
+    return rss, peak
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+class Client:
+    """One keep-alive connection to the server under test."""
+
+    def __init__(self, port, timeout=60):
+        self.port = port
+        self.timeout = timeout
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        for attempt in (1, 2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body=body, headers=headers or {})
+                response = self.conn.getresponse()
+                data = response.read()
+                if response.will_close:
+                    self.close()
+                return response.status, data
+            except (http.client.HTTPException, OSError):
+                self.close()
+                if attempt == 2:
+                    raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def run_load(port, clients, duration_s, make_request):
+    """Run make_request(client, worker_index, n) from `clients` threads for duration_s."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration_s
+
+    def worker(index):
+        client = Client(port)
+        local, failed, n = [], 0, 0
+        while time.monotonic() < stop_at:
+            started = time.monotonic()
+            try:
+                ok = make_request(client, index, n)
+            except Exception:
+                ok = False
+            if ok:
+                local.append(time.monotonic() - started)
+            else:
+                failed += 1
+            n += 1
+        client.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, errors[0], time.monotonic() - started)
+
+
+def scenario_proxy(args):
+    body = json.dumps({
+        "deviceAuthToken": "bench-token",
+        "status": {"devices": "0", "users": "0", "apps": {}, "categories": {}, "clientLevel": 6}
+    }).encode()
+    headers = {"Content-Type": "application/json", "Accept-Encoding": "gzip"}
+
+    def pull(client, index, n):
+        status, _ = client.request("POST", "/sync", body, headers)
+        return status == 200
+
+    result = {"pullStatus": run_load(args.port, args.clients, args.duration, pull)}
+
+    def push(client, index, n):
+        payload = json.dumps({"deviceAuthToken": "bench-token", "actions": []}).encode()
+        status, _ = client.request("POST", "/sync/push-actions", payload, headers)
+        return status == 200
+
+    result["pushActions"] = run_load(args.port, args.clients, args.duration / 2, push)
+    return result
+
+
+def scenario_longpoll(args):
+    """N waiters block on /ha-events-longpoll; measure trigger -> delivery latency per waiter."""
+    probe = Client(args.port)
+    # A cursor beyond the journal answers immediately with the current id.
+    _, data = probe.request("GET", "/ha-events-longpoll?since=999999999&timeout=1")
+    cursor = json.loads(data).get("id", 0)
+
+    latencies, errors = [], 0
+    rounds_started = time.monotonic()
+    for _ in range(args.rounds):
+        ready = threading.Barrier(args.waiters + 1)
+        received = []
+        lock = threading.Lock()
+
+        def waiter(since):
+            client = Client(args.port)
+            ready.wait()
+            try:
+                status, _ = client.request("GET", f"/ha-events-longpoll?since={since}&timeout=30")
+                with lock:
+                    received.append((time.monotonic(), status))
+            except Exception:
+                with lock:
+                    received.append((time.monotonic(), 0))
+            client.close()
+
+        threads = [threading.Thread(target=waiter, args=(cursor,)) for _ in range(args.waiters)]
+        for t in threads:
+            t.start()
+        ready.wait()
+        time.sleep(0.5 + args.waiters / 200)  # let every waiter reach the server before the event fires
+        triggered = time.monotonic()
+        probe.request("POST", "/ha-storage", json.dumps({"version": 1, "data": {"bench": str(triggered)}}).encode(),
+                      {"Content-Type": "application/json"})
+        for t in threads:
+            t.join()
+        for at, status in received:
+            if status == 200:
+                latencies.append(at - triggered)
+            else:
+                errors += 1
+        _, data = probe.request("GET", "/ha-events-longpoll?since=999999999&timeout=1")
+        cursor = json.loads(data).get("id", cursor)
+    probe.close()
+    result = summarize(latencies, errors, time.monotonic() - rounds_started)
+    result["waiters"] = args.waiters
+    result["rounds"] = args.rounds
+    return result
+
+
+def scenario_storage(args):
+    def write(client, index, n):
+        ops = [{"op": "add", "path": f"/data/bench_client_{index}", "value": str(n)}]
+        status, _ = client.request("POST", "/ha-storage", json.dumps(ops).encode(), {"Content-Type": "application/json"})
+        return status == 200
+
+    def read(client, index, n):
+        status, _ = client.request("GET", "/ha-storage")
+        return status in (200, 304)
+
+    return {
+        "writes": run_load(args.port, args.clients, args.duration, write),
+        "reads": run_load(args.port, args.clients, args.duration / 2, read),
+    }
+
+
+def scenario_bcrypt(args):
+    salt = "$2a$12$abcdefghijklmnopqrstuu"
+
+    def headers(index):
+        # One forwarded address per worker, so the bcrypt engine sees separate clients to queue fairly.
+        return {"Content-Type": "application/json", "X-Forwarded-For": f"10.0.0.{index + 1}"}
+
+    def regenerate(client, index, n):
+        # A new password every request: a repeated one would be a SecondHashCache hit, not a bcrypt run.
+        body = json.dumps({"password": f"bench-password-{index}-{time.monotonic_ns()}", "secondSalt": salt}).encode()
+        status, _ = client.request("POST", "/regenerate-hash", body, headers(index))
+        return status == 200
+
+    def mixed(client, index, n):
+        # Every fourth request asks for fresh family hashes: two bcrypt runs on the worker pool.
+        if n % 4 == 0:
+            body = json.dumps({"password": f"bench-family-{index}-{time.monotonic_ns()}"}).encode()
+            status, _ = client.request("POST", "/generate-hashes", body, headers(index))
+            return status == 200
+        return regenerate(client, index, n)
+
+    clients = min(args.clients, 4)
+    return {
+        "regenerate": run_load(args.port, clients, args.duration, regenerate),
+        "mixed": run_load(args.port, clients, args.duration, mixed),
+    }
+
+
+def scenario_static(args):
+    paths = ["/", "/ui.js", "/sync.js", "/state.js"]
+
+    def fetch(client, index, n):
+        status, _ = client.request("GET", paths[n % len(paths)], headers={"Accept-Encoding": "gzip"})
+        return status == 200
+
+    return run_load(args.port, args.clients, args.duration, fetch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma separated, from {SCENARIOS}")
+    parser.add_argument("--mode", choices=("threaded", "asyncio"), default="threaded")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per load phase")
+    parser.add_argument("--waiters", type=int, default=100, help="long-poll waiters")
+    parser.add_argument("--rounds", type=int, default=5, help="long-poll event rounds")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="stub upstream latency")
+    parser.add_argument("--payload-kb", type=int, default=64, help="stub pull-status size")
+    parser.add_argument("--port", type=int, default=18099)
+    parser.add_argument("--stub-port", type=int, default=18080)
+    parser.add_argument("--output", help="write the JSON result to this file as well")
+    args = parser.parse_args()
+
+    selected = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in selected if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {unknown}")
+
+    data_dir = tempfile.mkdtemp(prefix="timelimit-bench-")
+    stub = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "stub_server.py"), "--port", str(args.stub_port),
+        "--latency-ms", str(args.latency_ms), "--payload-kb", str(args.payload_kb)
+    ])
+    server = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "launch_server.py"), "--port", str(args.port),
+        "--upstream", f"http://127.0.0.1:{args.stub_port}", "--data-dir", data_dir, "--mode", args.mode
+    ], stderr=subprocess.DEVNULL)
+
+    result = {
+        "meta": {
+            "mode": args.mode, "clients": args.clients, "duration": args.duration,
+            "latencyMs": args.latency_ms, "payloadKb": args.payload_kb,
+            "python": platform.python_version(), "cpus": os.cpu_count(), "startedAt": int(time.time())
+        },
+        "scenarios": {}
+    }
+    try:
+        if not (wait_for_port(args.stub_port) and wait_for_port(args.port)):
+            raise SystemExit("server did not start")
+        result["meta"]["rssStartKb"] = read_rss_kb(server.pid)[0]
+        for name in selected:
+            scenario = globals()[f"scenario_{name}"]
+            data = scenario(args)
+            rss, peak = read_rss_kb(server.pid)
+            result["scenarios"][name] = {"result": data, "rssKb": rss, "peakRssKb": peak}
+    finally:
+        server.terminate()
+        stub.terminate()
+        server.wait(timeout=10)
+        stub.wait(timeout=10)
+
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
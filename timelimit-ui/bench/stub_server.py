@@ -0,0 +1,94 @@
+"""Stub TimeLimit server for benchmarks: canned answers with configurable size and latency.
+
+Usage: python3 stub_server.py --port 18080 --latency-ms 20 --payload-kb 64
+"""
+
+import argparse
+import gzip
+import http.server
+import json
+import socketserver
+import time
+
+
+def build_pull_status(payload_kb):
+    """A pull-status answer of roughly payload_kb kilobytes (many apps, a few categories)."""
+    categories = [f"cat{i}" for i in range(8)]
+    doc = {
+        "apiLevel": 6,
+        "devices": {"version": "d1", "data": [{"deviceId": "dev1", "name": "DashboardControl"}]},
+        "users": {"version": "u1", "data": [{"id": "p1", "type": "parent", "name": "Parent"}]},
+        "categoryBase": [{"categoryId": c, "version": "b1", "title": c} for c in categories],
+        "categoryApp": [{"categoryId": c, "version": "a1", "apps": []} for c in categories],
+        "rules": [{"categoryId": c, "version": "r1", "rules": []} for c in categories],
+        "usedTimes": [{"categoryId": c, "version": "t1", "times": []} for c in categories],
+        "apps": [{"deviceId": "dev1", "version": "v1", "apps": []}],
+    }
+    apps = doc["apps"][0]["apps"]
+    index = 0
+    while len(json.dumps(doc)) < payload_kb * 1024:
+        for _ in range(50):
+            apps.append({"packageName": f"com.example.app{index}", "title": f"Example app {index}", "isLaunchable": True})
+            index += 1
+    return json.dumps(doc).encode()
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    latency_s = 0.0
+    pull_status_body = b"{}"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        if self.latency_s:
+            time.sleep(self.latency_s)
+
+        if self.path.endswith('/sync/pull-status'):
+            body = self.pull_status_body
+        elif self.path.endswith('/sync/push-actions'):
+            body = b'{"shouldDoFullSync": false}'
+        elif self.path.startswith('/parent/') or self.path.startswith('/auth/'):
+            body = json.dumps({"ok": True, "deviceAuthToken": "bench-token", "mailLoginToken": "bench"}).encode()
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        headers = {"Content-Type": "application/json"}
+        if 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        self.send_response(200)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--payload-kb", type=int, default=64)
+    args = parser.parse_args()
+
+    StubHandler.latency_s = args.latency_ms / 1000
+    StubHandler.pull_status_body = build_pull_status(args.payload_kb)
+    with StubServer(("127.0.0.1", args.port), StubHandler) as server:
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,397 @@
 """HTTP client for TimeLimit API calls used by the web server proxy layer."""
 
-import urllib.request
+import gzip
+import http.client
+import select
 import ssl
 import json
-import sys
+import threading
 import time
+import urllib.parse
+
+import log_sink
+import metrics
+from circuit_breaker import CircuitBreaker
+
+# Flow: one keep-alive connection pool per upstream server, shared by all handler threads.
+POOL_MAX_IDLE = 8
+POOL_TIMEOUT = 10
+_SSL_CONTEXT = ssl._create_unverified_context()
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+# Errors that mean a reused keep-alive connection was closed by the server in the meantime.
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+# Read-only upstream calls; only these may be sent again when the connection broke after the request went out.
+_IDEMPOTENT_PATHS = ('/sync/pull-status',)
+
+# Gateway errors count as upstream failures for the circuit breaker; other statuses are answers.
+_FAILURE_STATUSES = (502, 503, 504)
+
+
+class UpstreamConnectionPool:
+    def __init__(self, server_url, max_idle=POOL_MAX_IDLE, timeout=POOL_TIMEOUT):
+        """Initialize an idle-connection pool for one upstream server."""
+        parsed = urllib.parse.urlsplit(server_url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ValueError(f"Invalid server url: {server_url}")
+        self.server_url = server_url
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.base_path = parsed.path.rstrip('/')
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.closed = False
+        self._idle = []
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "handshakes": 0, "discarded": 0, "retries": 0}
+        self.breaker = CircuitBreaker()
+
+    def _new_connection(self):
+        """Create a new (not yet connected) HTTP/1.1 connection to the upstream."""
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=_SSL_CONTEXT)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self):
+        """Return (connection, reused) with an idle connection when available.
+
+        Idle connections the server already closed (readable while no request is out) are dropped.
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    self._stats["misses"] += 1
+                    break
+                conn = self._idle.pop()
+            if conn.sock is not None and select.select([conn.sock], [], [], 0)[0]:
+                with self._lock:
+                    self._stats["discarded"] += 1
+                conn.close()
+                continue
+            with self._lock:
+                self._stats["hits"] += 1
+            return conn, True
+        return self._new_connection(), False
+
+    def release(self, conn, reusable=True):
+        """Hand a connection back to the pool, or close it when it cannot be reused."""
+        with self._lock:
+            if reusable and not self.closed and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+            self._stats["discarded"] += 1
+        conn.close()
+
+    def note_handshake(self):
+        with self._lock:
+            self._stats["handshakes"] += 1
+
+    def note_retry(self):
+        with self._lock:
+            self._stats["retries"] += 1
+
+    def close(self):
+        """Close all idle connections; connections in use are closed on release."""
+        with self._lock:
+            self.closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["idle"] = len(self._idle)
+        data["server"] = self.server_url
+        data["circuit"] = self.breaker.stats()
+        return data
+
+
+def get_connection_pool(server_url):
+    """Return the shared pool for a server url, creating it on first use."""
+    key = server_url.strip().rstrip('/')
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = UpstreamConnectionPool(key)
+            _POOLS[key] = pool
+        return pool
+
+
+def reset_connection_pools(keep_server_url=None):
+    """Drop pools of all servers except the given one (used when the server is switched)."""
+    keep = keep_server_url.strip().rstrip('/') if keep_server_url else None
+    with _POOLS_LOCK:
+        dropped = [pool for key, pool in _POOLS.items() if key != keep]
+        for pool in dropped:
+            del _POOLS[pool.server_url]
+    for pool in dropped:
+        pool.close()
+    return len(dropped)
+
+
+def get_connection_pool_stats():
+    """Return counters for all active pools."""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    return [pool.stats() for pool in pools]
+
+
+def probe_server(server_url, timeout=3.0):
+    """Time one GET on the server root over a new connection; returns (ok, seconds, error).
+
+    A new connection is used on purpose so the handshake counts, as it would after failover.
+    Any answer counts as up except the gateway errors the circuit breaker counts as failures.
+    """
+    pool = UpstreamConnectionPool(server_url, max_idle=0, timeout=timeout)
+    conn = pool._new_connection()
+    started = time.monotonic()
+    try:
+        conn.request('GET', f"{pool.base_path}/", headers={'Connection': 'close'})
+        response = conn.getresponse()
+        response.read()
+        elapsed = time.monotonic() - started
+        if response.status in _FAILURE_STATUSES:
+            return False, elapsed, f"HTTP {response.status}"
+        return True, elapsed, None
+    except Exception as e:
+        return False, time.monotonic() - started, str(e) or e.__class__.__name__
+    finally:
+        conn.close()
+
+# Streamed bodies are copied through a few reusable buffers instead of one bytes object per response.
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_BUFFERS_MAX = 16
+_STREAM_BUFFERS = []
+_STREAM_BUFFERS_LOCK = threading.Lock()
+
+
+def acquire_stream_buffer():
+    with _STREAM_BUFFERS_LOCK:
+        if _STREAM_BUFFERS:
+            return _STREAM_BUFFERS.pop()
+    return bytearray(STREAM_CHUNK_SIZE)
+
+
+def release_stream_buffer(buffer):
+    with _STREAM_BUFFERS_LOCK:
+        if len(_STREAM_BUFFERS) < STREAM_BUFFERS_MAX:
+            _STREAM_BUFFERS.append(buffer)
+
+
+class UpstreamStream:
+    """Upstream response whose body is read in chunks; close() hands the connection back."""
+
+    def __init__(self, response, on_done):
+        self.status = response.status
+        self.encoding = (response.getheader('Content-Encoding') or '').strip().lower() or None
+        length = response.getheader('Content-Length')
+        self.length = int(length) if length and length.isdigit() else None
+        self._response = response
+        self._on_done = on_done
+        self._body = None
+        self._error = None
+
+    @classmethod
+    def from_bytes(cls, status, body):
+        stream = cls.__new__(cls)
+        stream.status, stream.encoding, stream.length = status, None, len(body)
+        stream._response = None
+        stream._on_done = None
+        stream._body = body
+        stream._error = None
+        return stream
+
+    def chunks(self, buffer):
+        """Yield memoryviews of buffer, each valid until the next chunk is requested."""
+        if self._response is None:
+            if self._body:
+                yield memoryview(self._body)
+            return
+        view = memoryview(buffer)
+        while True:
+            try:
+                count = self._response.readinto(buffer)
+            except Exception as e:
+                self._error = e
+                raise
+            if not count:
+                break
+            yield view[:count]
+
+    def close(self):
+        """Release the connection; it is reused only when the body was read completely."""
+        on_done, self._on_done = self._on_done, None
+        if on_done is not None:
+            on_done(self._response.isclosed(), self._error)
+
 
 class TimeLimitAPI:
     def __init__(self, server_url, verbose=True):
         """Initialize the API client with server URL and verbosity."""
         self.server_url = server_url.strip().rstrip('/')
-        self.ssl_context = ssl._create_unverified_context()
         self.verbose = bool(verbose)
 
-    def _log(self, category, message):
-        """Log a message with category, respecting verbosity."""
+    def _log(self, category, message, *args):
+        """Log a message with category, respecting verbosity; args are only formatted when logged."""
         if category == "DEBUG" and not self.verbose:
             return
-        sys.stderr.write(f"[{time.strftime('%H:%M:%S')}] [{category}] {message}\n")
+        if args:
+            message = message % args
+        log_sink.write(f"[{category}] {message}")
+
+    def circuit(self):
+        """Circuit breaker of the upstream server this client talks to."""
+        return get_connection_pool(self.server_url).breaker
+
+    def _send(self, pool, conn, path, body, accept_gzip):
+        """Write one request (headers and body) on a connection."""
+        if conn.sock is None:
+            conn.connect()
+            pool.note_handshake()
+        headers = {
+            'Content-Type': 'application/json',
+            'Connection': 'keep-alive'
+        }
+        if accept_gzip:
+            headers['Accept-Encoding'] = 'gzip'
+        conn.request('POST', f"{pool.base_path}{path}", body=body, headers=headers)
+
+    def _request(self, pool, conn, path, body, accept_gzip):
+        """Send one request on a connection and return the response with its headers read."""
+        self._send(pool, conn, path, body, accept_gzip)
+        return conn.getresponse()
+
+    def _open(self, pool, path, body, accept_gzip):
+        """Return (connection, response) for a request, retrying once on a stale keep-alive connection.
+
+        Once the whole request was written the server may have acted on it, so from then on only
+        idempotent calls are retried; a push-actions batch is never sent twice.
+        """
+        conn, reused = pool.acquire()
+        sent = False
+        try:
+            self._send(pool, conn, path, body, accept_gzip)
+            sent = True
+            return conn, conn.getresponse()
+        except _STALE_CONNECTION_ERRORS:
+            # A pooled connection may have been closed by the server; retry once on a fresh one.
+            pool.release(conn, reusable=False)
+            if not reused or (sent and not path.endswith(_IDEMPOTENT_PATHS)):
+                raise
+            pool.note_retry()
+            self._log("DEBUG", "Keep-alive connection was closed upstream, retrying on a new connection")
+            conn = pool._new_connection()
+            try:
+                return conn, self._request(pool, conn, path, body, accept_gzip)
+            except Exception:
+                pool.release(conn, reusable=False)
+                raise
+        except Exception:
+            pool.release(conn, reusable=False)
+            raise
+
+    def _pool_or_rejection(self, path):
+        """Return (pool, None) when the call may go upstream, else (None, (status, body))."""
+        try:
+            pool = get_connection_pool(self.server_url)
+        except Exception as e:
+            self._log("ERROR", str(e))
+            return None, (500, str(e).encode())
+
+        if not pool.breaker.allow():
+            # Fail fast instead of tying up a handler thread for the full socket timeout.
+            metrics.note_upstream(path, "circuit_open", 0.0)
+            self._log("DEBUG", "Circuit open for %s, request to %s rejected", self.server_url, path)
+            body = json.dumps({"error": "upstream unavailable", "retryAfter": pool.breaker.retry_after()})
+            return None, (503, body.encode())
+        return pool, None
+
+    def _finish(self, pool, path, status, started):
+        """Record the outcome of an upstream call that produced a response."""
+        metrics.note_upstream(path, status, time.monotonic() - started)
+        if status in _FAILURE_STATUSES:
+            pool.breaker.record_failure()
+        else:
+            pool.breaker.record_success()
+        if 200 <= status < 400:
+            self._log("SUCCESS", f"Status {status}")
+        else:
+            self._log("ERROR", f"Code {status}")
+
+    def _fail(self, pool, path, started, error):
+        pool.breaker.record_failure()
+        metrics.note_upstream(path, "error", time.monotonic() - started)
+        self._log("ERROR", str(error))
 
     def post(self, path, data):
-        """Send a POST request to the server and return status and response body."""
-        target_url = f"{self.server_url}{path}"
-        self._log("DEBUG", f"Target: {target_url}")
-        
+        """Send a POST request to the server and return status and (decoded) response body."""
+        status, res_body, encoding = self.post_raw(path, data)
+        if encoding == 'gzip':
+            try:
+                res_body = gzip.decompress(res_body)
+            except Exception as e:
+                self._log("ERROR", f"Gzip decode failed: {str(e)}")
+                return 502, str(e).encode()
+        return status, res_body
+
+    def post_raw(self, path, data, accept_gzip=True):
+        """Send a POST request and return status, the body as received and its Content-Encoding."""
+        self._log("DEBUG", "Target: %s%s", self.server_url, path)
+        body = data if isinstance(data, bytes) else data.encode('utf-8')
+        pool, rejection = self._pool_or_rejection(path)
+        if rejection is not None:
+            return rejection[0], rejection[1], None
+
+        started = time.monotonic()
         try:
-            req = urllib.request.Request(
-                target_url, 
-                data=data if isinstance(data, bytes) else data.encode('utf-8'), 
-                headers={'Content-Type': 'application/json'}, 
-                method='POST'
-            )
-
-            with urllib.request.urlopen(req, context=self.ssl_context, timeout=10) as response:
+            conn, response = self._open(pool, path, body, accept_gzip)
+            try:
                 res_body = response.read()
-                self._log("SUCCESS", f"Status {response.status}")
-                return response.status, res_body
-
-        except urllib.error.HTTPError as e:
-            err_body = e.read()
-            self._log("ERROR", f"Code {e.code}")
-            return e.code, err_body
-            
+            except Exception:
+                pool.release(conn, reusable=False)
+                raise
+            pool.release(conn, reusable=not response.will_close)
         except Exception as e:
-            self._log("ERROR", str(e))
-            return 500, str(e).encode()
\ No newline at end of file
+            self._fail(pool, path, started, e)
+            return 500, str(e).encode(), None
+
+        self._finish(pool, path, response.status, started)
+        encoding = (response.getheader('Content-Encoding') or '').strip().lower() or None
+        return response.status, res_body, encoding
+
+    def post_stream(self, path, data, accept_gzip=True):
+        """Send a POST request and return an UpstreamStream to read the body in chunks.
+
+        Errors are returned as a stream over a short error body, like post_raw does.
+        """
+        self._log("DEBUG", "Target (stream): %s%s", self.server_url, path)
+        body = data if isinstance(data, bytes) else data.encode('utf-8')
+        pool, rejection = self._pool_or_rejection(path)
+        if rejection is not None:
+            return UpstreamStream.from_bytes(rejection[0], rejection[1])
+
+        started = time.monotonic()
+        try:
+            conn, response = self._open(pool, path, body, accept_gzip)
+        except Exception as e:
+            self._fail(pool, path, started, e)
+            return UpstreamStream.from_bytes(500, str(e).encode())
+
+        def done(complete, error):
+            # An unfinished body without an upstream error means the client went away.
+            pool.release(conn, reusable=complete and not response.will_close)
+            if error is not None:
+                self._fail(pool, path, started, error)
+            else:
+                self._finish(pool, path, response.status, started)
+
+        return UpstreamStream(response, done)
@@ -0,0 +1,232 @@
+"""Asyncio HTTP server core: serves the web server routes without one OS thread per connection."""
+
+import asyncio
+import concurrent.futures
+import http
+import http.client
+import io
+
+import log_sink
+
+# Flow: the event loop owns every connection; blocking handler work runs on bounded executor lanes,
+# while native coroutine routes (long-poll) wait on the loop and cost no thread at all.
+KEEPALIVE_TIMEOUT = 75
+# Crypto lane threads only wait for the bcrypt engine, which limits and orders the actual CPU work.
+DEFAULT_LANE_WORKERS = {"default": 8, "crypto": 8}
+
+
+def _log(message):
+    log_sink.write(message)
+
+
+class AsyncRequest:
+    def __init__(self, method, path, version, headers, body, client_address):
+        """Parsed HTTP request as seen by native coroutine routes."""
+        self.method = method
+        self.path = path
+        self.version = version
+        self.headers = headers
+        self.body = body
+        self.client_address = client_address
+
+    @property
+    def keep_alive(self):
+        connection = (self.headers.get('Connection') or '').lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+
+class AsyncNotifier:
+    """Wakes coroutines waiting on the loop; notify() may be called from any thread."""
+
+    def __init__(self):
+        self._loop = None
+        self._waiters = set()
+
+    def bind(self, loop):
+        self._loop = loop
+
+    def notify(self):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._wake_all)
+
+    def _wake_all(self):
+        waiters, self._waiters = self._waiters, set()
+        for fut in waiters:
+            if not fut.done():
+                fut.set_result(True)
+
+    async def wait(self, timeout):
+        """Wait until the next notify() or timeout; returns True when notified."""
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.add(fut)
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiters.discard(fut)
+
+    @property
+    def waiter_count(self):
+        return len(self._waiters)
+
+
+def build_response(status, body, content_type, keep_alive=True, extra_headers=None):
+    """Serialize a complete HTTP/1.1 response."""
+    try:
+        reason = http.HTTPStatus(status).phrase
+    except ValueError:
+        reason = ""
+    lines = [
+        f"HTTP/1.1 {status} {reason}",
+        f"Content-type: {content_type}",
+        f"Content-Length: {len(body)}",
+    ]
+    for key, value in (extra_headers or {}).items():
+        lines.append(f"{key}: {value}")
+    if not keep_alive:
+        lines.append("Connection: close")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body
+
+
+async def send_response(writer, status, body, content_type, keep_alive=True, extra_headers=None):
+    """Write a complete response from a native route and return whether to keep the connection."""
+    writer.write(build_response(status, body, content_type, keep_alive, extra_headers))
+    await writer.drain()
+    return keep_alive
+
+
+class _BufferedRequestMixin:
+    """Runs one request of a BaseHTTPRequestHandler against in-memory buffers."""
+
+    # The whole response ends up in wfile before it is written, so streaming gains nothing.
+    streaming_responses = False
+
+    def __init__(self, raw_request, client_address, server):
+        self._raw_request = raw_request
+        super().__init__(None, client_address, server)
+
+    def setup(self):
+        self.connection = None
+        self.rfile = io.BytesIO(self._raw_request)
+        self.wfile = io.BytesIO()
+
+    def handle(self):
+        self.handle_one_request()
+
+    def finish(self):
+        pass
+
+
+class AsyncHTTPServer:
+    def __init__(self, server_address, handler_class, native_routes=None, lane_for=None, lane_workers=None):
+        """Initialize the server.
+
+        Args:
+            server_address: (host, port) tuple
+            handler_class: BaseHTTPRequestHandler subclass used for all non-native routes
+            native_routes: list of (predicate(request), coroutine(request, writer)) pairs
+            lane_for: callable(request) returning the executor lane name for blocking routes
+            lane_workers: dict lane name -> max worker threads
+        """
+        self.server_address = server_address
+        self.native_routes = list(native_routes or [])
+        self.lane_for = lane_for or (lambda request: "default")
+        self.buffered_handler_class = type(
+            f"Buffered{handler_class.__name__}", (_BufferedRequestMixin, handler_class), {}
+        )
+        workers = dict(DEFAULT_LANE_WORKERS)
+        workers.update(lane_workers or {})
+        self.executors = {
+            lane: concurrent.futures.ThreadPoolExecutor(max_workers=count, thread_name_prefix=f"lane-{lane}")
+            for lane, count in workers.items()
+        }
+        self.notifiers = []
+        self.loop = None
+
+    def add_notifier(self, notifier):
+        """Bind a notifier to this server's loop once it starts."""
+        self.notifiers.append(notifier)
+        if self.loop is not None:
+            notifier.bind(self.loop)
+
+    def _dispatch_blocking(self, raw_request, client_address):
+        handler = self.buffered_handler_class(raw_request, client_address, self)
+        return handler.wfile.getvalue(), handler.close_connection
+
+    async def _read_request(self, reader, client_address):
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+        request_line, _, header_blob = head.partition(b"\r\n")
+        parts = request_line.decode('latin-1').split()
+        if len(parts) != 3:
+            return None, head
+        method, path, version = parts
+        headers = http.client.parse_headers(io.BytesIO(header_blob))
+        length = int(headers.get('Content-Length') or 0)
+        body = await reader.readexactly(length) if length > 0 else b""
+        return AsyncRequest(method, path, version, headers, body, client_address), head + body
+
+    async def _handle_connection(self, reader, writer):
+        client_address = writer.get_extra_info('peername') or ("", 0)
+        try:
+            while True:
+                try:
+                    request, raw = await self._read_request(reader, client_address)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                        ConnectionError, ValueError):
+                    break
+
+                if request is None:
+                    # Let the regular handler produce the 400 response for malformed request lines.
+                    response, _ = await self.loop.run_in_executor(
+                        self.executors["default"], self._dispatch_blocking, raw, client_address
+                    )
+                    writer.write(response)
+                    await writer.drain()
+                    break
+
+                native = next((route for match, route in self.native_routes if match(request)), None)
+                if native is not None:
+                    keep_alive = await native(request, writer)
+                else:
+                    lane = self.lane_for(request)
+                    executor = self.executors.get(lane, self.executors["default"])
+                    response, close = await self.loop.run_in_executor(
+                        executor, self._dispatch_blocking, raw, client_address
+                    )
+                    writer.write(response)
+                    await writer.drain()
+                    keep_alive = not close
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            _log(f"[ERROR] Async connection error: {str(e)}")
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        for notifier in self.notifiers:
+            notifier.bind(self.loop)
+        host, port = self.server_address
+        server = await asyncio.start_server(
+            self._handle_connection, host or None, port, reuse_address=True
+        )
+        async with server:
+            await server.serve_forever()
+
+    def serve_forever(self):
+        try:
+            asyncio.run(self._serve())
+        finally:
+            for executor in self.executors.values():
+                executor.shutdown(wait=False)
@@ -0,0 +1,79 @@
+"""Circuit breaker for one upstream server: fail fast while it is down, probe it now and then."""
+
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=15.0, max_reset_timeout=120.0):
+        """Open after failure_threshold consecutive failures; probe again after reset_timeout.
+
+        Every failed probe doubles the wait, up to max_reset_timeout.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._open_for = reset_timeout
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self._stats = {"successes": 0, "failures": 0, "rejected": 0, "opened": 0, "probes": 0}
+
+    def allow(self):
+        """Return True when a call may go upstream; at most one probe runs while half-open."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self._open_for:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                self._stats["probes"] += 1
+                return True
+            self._stats["rejected"] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._stats["successes"] += 1
+            self._failures = 0
+            self._probing = False
+            self._open_for = self.reset_timeout
+            self.state = CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._stats["failures"] += 1
+            self._failures += 1
+            if self.state == HALF_OPEN:
+                self._probing = False
+                self._open_for = min(self._open_for * 2, self.max_reset_timeout)
+                self._open_locked()
+            elif self.state == CLOSED and self._failures >= self.failure_threshold:
+                self._open_locked()
+
+    def _open_locked(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._stats["opened"] += 1
+
+    def retry_after(self):
+        """Seconds until the next probe is allowed (0 when closed), for Retry-After headers."""
+        with self._lock:
+            if self.state == CLOSED:
+                return 0
+            remaining = self._open_for - (time.monotonic() - self._opened_at)
+            return max(1, int(remaining + 0.999))
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["state"] = self.state
+            data["consecutiveFailures"] = self._failures
+        return data
@@ -0,0 +1,88 @@
+"""Cached add-on configuration: reloads options.json only when the file changes."""
+
+import json
+import os
+import threading
+import time
+import types
+
+import log_sink
+
+
+def _log(message):
+    log_sink.write(message)
+
+
+class ConfigStore:
+    """Holds an immutable snapshot of the add-on options.
+
+    The file is stat'ed at most once per check_interval seconds and only re-parsed when
+    its mtime, size or inode changed. Subscribers are called as callback(new, old) when
+    the value of the key they subscribed to changes.
+    """
+
+    def __init__(self, path, defaults, check_interval=1.0):
+        self.path = path
+        self.defaults = dict(defaults)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._signature = None
+        self._checked_at = 0.0
+        self._snapshot = types.MappingProxyType(dict(self.defaults))
+        self._subscribers = []
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            _log(f"Config Error: {str(e)}")
+            return None
+
+    def subscribe(self, key, callback):
+        """Call callback(new, old) whenever the value for key changes."""
+        with self._lock:
+            self._subscribers.append((key, callback))
+
+    def snapshot(self):
+        """Return the current read-only config, reloading it first if the file changed."""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self._snapshot
+
+        changes = []
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return self._snapshot
+            self._checked_at = now
+            signature = self._stat_signature()
+            if signature == self._signature:
+                return self._snapshot
+            self._signature = signature
+
+            loaded = self._load() if signature is not None else None
+            if signature is not None and loaded is None:
+                # Keep the last good snapshot when the file is being rewritten or invalid.
+                return self._snapshot
+            data = loaded if isinstance(loaded, dict) else dict(self.defaults)
+
+            old = self._snapshot
+            self._snapshot = types.MappingProxyType(dict(data))
+            for key, callback in self._subscribers:
+                if old.get(key) != data.get(key):
+                    changes.append((callback, data.get(key), old.get(key)))
+            snapshot = self._snapshot
+
+        for callback, new_value, old_value in changes:
+            try:
+                callback(new_value, old_value)
+            except Exception as e:
+                _log(f"[ERROR] Config subscriber fout: {str(e)}")
+        return snapshot
@@ -4,6 +4,236 @@ import bcrypt
 import hmac
 import hashlib
 import base64
+import struct
+import concurrent.futures
+import concurrent.futures.process
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+import collections
+
+import log_sink
+import metrics
+from single_flight import SingleFlight
+
+# Flow: bcrypt runs in a small worker pool so it never occupies a request thread's CPU time slice,
+# and both family hashes are computed in parallel. Waiting jobs are started round-robin per client,
+# so one client retrying a login cannot push everyone else's jobs back.
+BCRYPT_WORKERS = max(1, min(2, os.cpu_count() or 1))
+BCRYPT_MAX_QUEUE = 8
+BCRYPT_MAX_CLIENT_JOBS = 4
+BCRYPT_JOB_TIMEOUT = 30
+# Worker processes run at a lower CPU priority than the web server, so proxy traffic wins the cores.
+BCRYPT_NICE = 10
+
+
+class BcryptBusyError(RuntimeError):
+    """Raised when the bcrypt queue is full; callers should answer 503."""
+
+
+class BcryptTimeoutError(RuntimeError):
+    """Raised when a bcrypt job did not finish within the job timeout."""
+
+
+def _bcrypt_hashpw(password_bytes, salt_bytes):
+    # Top-level so it can be pickled into worker processes.
+    return bcrypt.hashpw(password_bytes, salt_bytes)
+
+
+def _lower_priority():
+    # Initializer of the worker processes; only affects the bcrypt workers, not the web server.
+    try:
+        os.nice(BCRYPT_NICE)
+    except OSError:
+        pass
+
+
+class _Job:
+    def __init__(self, client, fn, args):
+        self.client = client
+        self.fn = fn
+        self.args = args
+        self.future = concurrent.futures.Future()
+        self.queued_at = time.monotonic()
+        self.started = None
+
+
+class BcryptEngine:
+    def __init__(self, workers=BCRYPT_WORKERS, max_queue=BCRYPT_MAX_QUEUE, timeout=BCRYPT_JOB_TIMEOUT, use_processes=True,
+                 max_client_jobs=BCRYPT_MAX_CLIENT_JOBS):
+        """Bounded bcrypt worker pool with per-job timeout and timing metrics.
+
+        At most workers jobs run at once; queued jobs are started round-robin per client and
+        one client can have at most max_client_jobs jobs queued or running.
+        """
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_client_jobs = max_client_jobs
+        self.timeout = timeout
+        self.use_processes = use_processes
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        # client -> waiting jobs; the client at the front is served next, then moves to the back.
+        self._queues = collections.OrderedDict()
+        self._client_jobs = collections.Counter()
+        self._stats = {
+            "submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "timeouts": 0,
+            "totalMs": 0.0, "maxMs": 0.0, "lastMs": 0.0, "maxWaitMs": 0.0, "poolRestarts": 0
+        }
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.use_processes:
+                # forkserver: never fork the multi-threaded web server itself.
+                context = multiprocessing.get_context("forkserver")
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=context, initializer=_lower_priority
+                )
+            else:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    def _drop_executor(self, executor):
+        """Forget a broken pool (e.g. a worker was OOM-killed); the next job starts a new one."""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self._stats["poolRestarts"] += 1
+        log_sink.write("[BCRYPT] Worker pool kapot (proces gestopt), wordt opnieuw gestart")
+        executor.shutdown(wait=False)
+
+    def _next_jobs_locked(self):
+        """Take jobs off the client queues while a worker is free; they are started outside the lock."""
+        jobs = []
+        while self._running < self.workers and self._queues:
+            client, queue = next(iter(self._queues.items()))
+            job = queue.popleft()
+            if queue:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+            if not job.future.set_running_or_notify_cancel():
+                # Cancelled while waiting (e.g. the other half of a rejected family hash pair).
+                self._finish_locked(job)
+                continue
+            self._running += 1
+            job.started = time.monotonic()
+            self._stats["maxWaitMs"] = max(self._stats["maxWaitMs"], (job.started - job.queued_at) * 1000)
+            jobs.append(job)
+        return jobs
+
+    def _finish_locked(self, job):
+        self._pending -= 1
+        self._client_jobs[job.client] -= 1
+        if self._client_jobs[job.client] <= 0:
+            del self._client_jobs[job.client]
+
+    def _start(self, jobs):
+        if not jobs:
+            return
+        for job in jobs:
+            for attempt in range(2):
+                with self._lock:
+                    executor = self._get_executor()
+                try:
+                    future = executor.submit(job.fn, *job.args)
+                except concurrent.futures.process.BrokenProcessPool as e:
+                    # Nothing ran yet: retry once on a fresh pool.
+                    self._drop_executor(executor)
+                    if attempt == 0:
+                        continue
+                    self._job_done(job, None, e)
+                except Exception as e:
+                    self._job_done(job, None, e)
+                else:
+                    future.add_done_callback(lambda f, job=job, executor=executor: self._job_done(job, f, executor=executor))
+                break
+
+    def _job_done(self, job, future, error=None, executor=None):
+        duration_ms = (time.monotonic() - job.started) * 1000
+        if future is not None and future.cancelled():
+            error = concurrent.futures.CancelledError()
+        elif future is not None:
+            error = future.exception()
+        if isinstance(error, concurrent.futures.process.BrokenProcessPool) and executor is not None:
+            self._drop_executor(executor)
+        with self._lock:
+            self._running -= 1
+            self._finish_locked(job)
+            if error is not None:
+                self._stats["failed"] += 1
+            else:
+                self._stats["completed"] += 1
+                self._stats["totalMs"] += duration_ms
+                self._stats["lastMs"] = duration_ms
+                self._stats["maxMs"] = max(self._stats["maxMs"], duration_ms)
+            jobs = self._next_jobs_locked()
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            metrics.observe("timelimit_bcrypt_duration_seconds", duration_ms / 1000)
+            job.future.set_result(future.result())
+        self._start(jobs)
+
+    def submit(self, fn, *args, client=None):
+        """Queue a job for client; raises BcryptBusyError when the queue or the client's share is full."""
+        job = _Job(client, fn, args)
+        with self._lock:
+            if self._pending >= self.max_queue:
+                self._stats["rejected"] += 1
+                raise BcryptBusyError(f"bcrypt queue full ({self._pending} jobs)")
+            if self._client_jobs[client] >= self.max_client_jobs:
+                self._stats["rejected"] += 1
+                raise BcryptBusyError(f"too many bcrypt jobs for this client ({self._client_jobs[client]})")
+            self._pending += 1
+            self._client_jobs[client] += 1
+            self._stats["submitted"] += 1
+            self._queues.setdefault(client, collections.deque()).append(job)
+            jobs = self._next_jobs_locked()
+        self._start(jobs)
+        return job.future
+
+    def result(self, future):
+        """Wait for a job within the job timeout."""
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            # The worker cannot be interrupted; the job still counts as pending until it ends.
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise BcryptTimeoutError(f"bcrypt job exceeded {self.timeout}s")
+
+    def hashpw(self, password_bytes, salt_bytes, client=None):
+        return self.result(self.submit(_bcrypt_hashpw, password_bytes, salt_bytes, client=client))
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["queueDepth"] = self._pending
+            data["running"] = self._running
+            data["clients"] = len(self._client_jobs)
+        data["avgMs"] = round(data["totalMs"] / data["completed"], 1) if data["completed"] else 0.0
+        data["workers"] = self.workers
+        data["maxQueue"] = self.max_queue
+        return data
+
+
+_BCRYPT_ENGINE = None
+_BCRYPT_ENGINE_LOCK = threading.Lock()
+
+
+def get_bcrypt_engine():
+    """Return the process-wide bcrypt engine."""
+    global _BCRYPT_ENGINE
+    with _BCRYPT_ENGINE_LOCK:
+        if _BCRYPT_ENGINE is None:
+            _BCRYPT_ENGINE = BcryptEngine()
+        return _BCRYPT_ENGINE
 
 def generate_family_hashes(password):
     """Generate BCrypt hashes for family password, matching Android app logic."""
@@ -24,6 +254,125 @@ def generate_family_hashes(password):
         "secondSalt": salt2.decode('utf-8')
     }
 
+SECOND_HASH_CACHE_SIZE = 32
+SECOND_HASH_CACHE_TTL = 15 * 60
+
+
+class SecondHashCache:
+    """Bounded TTL cache for regenerated secondHash values.
+
+    Entries are keyed by HMAC-SHA256(process-random key, password + salt), so neither the
+    plaintext password nor an offline-crackable digest of it is kept in memory.
+    """
+
+    def __init__(self, max_entries=SECOND_HASH_CACHE_SIZE, ttl=SECOND_HASH_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._key = secrets.token_bytes(32)
+        self._entries = collections.OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "clears": 0}
+
+    def _digest(self, password, second_salt):
+        password_bytes = password.encode('utf-8')
+        salt_bytes = second_salt.encode('utf-8')
+        message = struct.pack('>I', len(password_bytes)) + password_bytes + salt_bytes
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def get(self, password, second_salt):
+        now = time.monotonic()
+        with self._lock:
+            digest = self._digest(password, second_salt)
+            entry = self._entries.get(digest)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(digest)
+                self._stats["hits"] += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[digest]
+                self._stats["evictions"] += 1
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, password, second_salt, second_hash):
+        now = time.monotonic()
+        with self._lock:
+            digest = self._digest(password, second_salt)
+            self._entries[digest] = (second_hash, now + self.ttl)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        """Drop all entries and rotate the digest key."""
+        with self._lock:
+            self._entries.clear()
+            self._key = secrets.token_bytes(32)
+            self._stats["clears"] += 1
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["entries"] = len(self._entries)
+        return data
+
+
+SECOND_HASH_CACHE = SecondHashCache()
+
+# Identical secondHash regenerations (same password and salt) that arrive while the first one is still
+# queued or running share its result. Fresh-salt hash generation is never shared.
+BCRYPT_FLIGHTS = SingleFlight(ttl=0)
+_FLIGHT_KEY = secrets.token_bytes(32)
+
+
+def _flight_key(kind, *parts):
+    """BCRYPT_FLIGHTS key: an HMAC under a process-random key, so no password digest is kept."""
+    message = b"".join(struct.pack('>I', len(part)) + part for part in (p.encode('utf-8') for p in parts))
+    return kind, hmac.new(_FLIGHT_KEY, message, hashlib.sha256).digest()
+
+
+def generate_family_hashes_parallel(password, client=None):
+    """Generate the family hashes like generate_family_hashes, with both bcrypt runs in parallel.
+
+    Never shared between requests: every call must get salts of its own.
+    """
+    engine = get_bcrypt_engine()
+    password_bytes = password.encode('utf-8')
+
+    salt1 = bcrypt.gensalt(rounds=12)
+    salt2 = bcrypt.gensalt(rounds=12)
+
+    future1 = engine.submit(_bcrypt_hashpw, password_bytes, salt1, client=client)
+    try:
+        future2 = engine.submit(_bcrypt_hashpw, password_bytes, salt2, client=client)
+    except BcryptBusyError:
+        future1.cancel()
+        raise
+    hash1 = engine.result(future1)
+    hash2 = engine.result(future2)
+
+    return {
+        "hash": hash1.decode('utf-8'),
+        "secondHash": hash2.decode('utf-8'),
+        "secondSalt": salt2.decode('utf-8')
+    }
+
+def regenerate_second_hash_pooled(password, second_salt, client=None):
+    """Regenerate secondHash like regenerate_second_hash, on the bcrypt worker pool (memoized)."""
+    cached = SECOND_HASH_CACHE.get(password, second_salt)
+    if cached is not None:
+        return cached
+
+    def compute():
+        hash_result = get_bcrypt_engine().hashpw(password.encode('utf-8'), second_salt.encode('utf-8'), client=client)
+        second_hash = hash_result.decode('utf-8')
+        SECOND_HASH_CACHE.put(password, second_salt, second_hash)
+        return second_hash
+
+    second_hash, _ = BCRYPT_FLIGHTS.do(_flight_key("second", password, second_salt), compute)
+    return second_hash
+
 def regenerate_second_hash(password, second_salt):
     """Regenerate secondHash using an existing salt from the server."""
     """
@@ -110,25 +459,10 @@ def calculate_hmac_sha256_binary(second_hash, sequence_number, device_id, encode
         String in the format "password:<base64_hmac>"
     """
     try:
-        import struct
-        
         # Use secondHash (bcrypt string) as UTF-8 bytes for the key
         key_bytes = second_hash.encode('utf-8')
-        
-        # Build binary message:
-        # 1. sequenceNumber as 8-byte big-endian (long/int64)
-        seq_bytes = struct.pack('>Q', sequence_number)  # >Q = big-endian unsigned long long
-        
-        # 2. deviceId length + bytes
-        device_id_bytes = device_id.encode('utf-8')
-        device_id_len = struct.pack('>I', len(device_id_bytes))  # >I = big-endian unsigned int
-        
-        # 3. encodedAction length + bytes
-        encoded_action_bytes = encoded_action.encode('utf-8')
-        encoded_action_len = struct.pack('>I', len(encoded_action_bytes))
-        
-        # Combine all parts
-        message = seq_bytes + device_id_len + device_id_bytes + encoded_action_len + encoded_action_bytes
+
+        message = _build_integrity_message(sequence_number, device_id, encoded_action)
         
         # Compute HMAC-SHA256 (not SHA512!)
         hmac_obj = hmac.new(key_bytes, message, hashlib.sha256)
@@ -138,4 +472,46 @@ def calculate_hmac_sha256_binary(second_hash, sequence_number, device_id, encode
         return f"password:{hash_base64}"
         
     except Exception as e:
-        raise ValueError(f"HMAC-SHA256 binary calculation failed: {str(e)}")
\ No newline at end of file
+        raise ValueError(f"HMAC-SHA256 binary calculation failed: {str(e)}")
+
+def _build_integrity_message(sequence_number, device_id, encoded_action):
+    """Build the binary integrity message (see calculate_hmac_sha256_binary)."""
+    # 1. sequenceNumber as 8-byte big-endian (long/int64)
+    seq_bytes = struct.pack('>Q', sequence_number)  # >Q = big-endian unsigned long long
+    
+    # 2. deviceId length + bytes
+    device_id_bytes = device_id.encode('utf-8')
+    device_id_len = struct.pack('>I', len(device_id_bytes))  # >I = big-endian unsigned int
+    
+    # 3. encodedAction length + bytes
+    encoded_action_bytes = encoded_action.encode('utf-8')
+    encoded_action_len = struct.pack('>I', len(encoded_action_bytes))
+    
+    # Combine all parts
+    return seq_bytes + device_id_len + device_id_bytes + encoded_action_len + encoded_action_bytes
+
+def calculate_hmac_sha256_binary_batch(second_hash, items):
+    """
+    Calculate HMAC-SHA256 integrity strings for a batch of actions signed with the same secondHash.
+    
+    The HMAC key is set up once; every item starts from a copy of that keyed state.
+    
+    Args:
+        second_hash: BCrypt hash string (e.g. $2a$12$...)
+        items: List of dicts with sequenceNumber, deviceId and encodedAction
+    
+    Returns:
+        List of strings in the format "password:<base64_hmac>", in the order of items
+    """
+    try:
+        keyed = hmac.new(second_hash.encode('utf-8'), digestmod=hashlib.sha256)
+        results = []
+        for item in items:
+            hmac_obj = keyed.copy()
+            hmac_obj.update(_build_integrity_message(
+                item['sequenceNumber'], item['deviceId'], item['encodedAction']
+            ))
+            results.append(f"password:{base64.b64encode(hmac_obj.digest()).decode('utf-8')}")
+        return results
+    except Exception as e:
+        raise ValueError(f"HMAC-SHA256 batch calculation failed: {str(e)}")
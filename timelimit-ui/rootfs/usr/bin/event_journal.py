@@ -0,0 +1,127 @@
+"""Bounded, sequence-numbered event journal used to replay events to long-poll clients."""
+
+import collections
+import json
+import os
+import threading
+import time
+
+import log_sink
+
+# Events broadcast within this window end up in a single journal rewrite.
+FLUSH_DELAY_S = 2.0
+# A failed flush is retried after flush_delay * 2^failures seconds, at most this long.
+FLUSH_RETRY_MAX_S = 60.0
+
+
+def _log(message):
+    log_sink.write(message)
+
+
+class EventJournal:
+    """Ring buffer of the last N broadcast events.
+
+    Not thread-safe on its own: web_server.py calls it while holding LONGPOLL_COND,
+    so appends and cursor checks stay atomic with the long-poll wait. Persisting is
+    the exception: flush() runs on a timer thread, outside LONGPOLL_COND.
+    """
+
+    def __init__(self, capacity=256, path=None, flush_delay=FLUSH_DELAY_S):
+        self.capacity = capacity
+        self.path = None
+        self.flush_delay = flush_delay
+        self._events = collections.deque(maxlen=capacity)
+        self._last_id = 0
+        # Guards the dirty flag and the timer, and keeps flush() from reading a half-done append.
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._dirty = False
+        self._timer = None
+        self._flush_failures = 0
+        if path:
+            self.enable_persistence(path)
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    @property
+    def first_id(self):
+        return self._events[0]["id"] if self._events else self._last_id + 1
+
+    def enable_persistence(self, path):
+        """Load the journal from disk and persist it shortly after each append."""
+        self.path = path
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r') as f:
+                stored = json.load(f)
+            events = [e for e in stored.get("events", []) if isinstance(e, dict) and "id" in e]
+            self._events.extend(events[-self.capacity:])
+            self._last_id = max(int(stored.get("lastId", 0)), self._events[-1]["id"] if self._events else 0)
+            _log(f"[EVENT] Event journal geladen: {len(self._events)} events, lastId={self._last_id}")
+        except Exception as e:
+            _log(f"[ERROR] Event journal laden mislukt: {str(e)}")
+
+    def _schedule_flush_locked(self, delay):
+        if self._timer is None:
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Write the journal to disk if it changed since the last flush; no file I/O under LONGPOLL_COND."""
+        with self._flush_lock:
+            with self._lock:
+                self._timer = None
+                if not self._dirty or not self.path:
+                    return False
+                self._dirty = False
+                body = json.dumps({"lastId": self._last_id, "events": list(self._events)})
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, 'w') as f:
+                    f.write(body)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                with self._lock:
+                    self._dirty = True
+                    self._flush_failures += 1
+                    delay = min(self.flush_delay * (2 ** self._flush_failures), FLUSH_RETRY_MAX_S)
+                    self._schedule_flush_locked(delay)
+                _log(f"[ERROR] Event journal opslaan mislukt: {str(e)} (nieuwe poging over {delay:.1f}s)")
+                return False
+            with self._lock:
+                self._flush_failures = 0
+            return True
+
+    def append(self, event, data):
+        """Record a new event and return it; the file is rewritten at most once per flush_delay."""
+        with self._lock:
+            self._last_id += 1
+            entry = {"id": self._last_id, "event": event, "data": data, "ts": int(time.time() * 1000)}
+            self._events.append(entry)
+            if self.path:
+                self._dirty = True
+                self._schedule_flush_locked(self.flush_delay)
+        return entry
+
+    def resolve(self, cursor):
+        """Cursor to read from: None is a client's first contact and starts at the head, without backlog.
+
+        A cursor of 0 is a real position (e.g. the head after a restart) and replays from first_id.
+        """
+        return self._last_id if cursor is None else cursor
+
+    def since(self, cursor):
+        """Return (events after cursor, gap).
+
+        gap is True when events after the cursor were already evicted, or when the cursor
+        is ahead of the journal (the add-on restarted without persistence).
+        """
+        if cursor > self._last_id:
+            return list(self._events), True
+        events = [e for e in self._events if e["id"] > cursor]
+        gap = cursor < self.first_id - 1
+        return events, gap
@@ -0,0 +1,134 @@
+"""Indexed view of one full pull-status document, for small server-side queries."""
+
+import collections
+
+
+def _category_order(category):
+    """Same order as compareCategoryOrder in tree.js: server sort, then title."""
+    sort = category.get("sort")
+    if not isinstance(sort, (int, float)) or isinstance(sort, bool):
+        sort = 0
+    return sort, str(category.get("title") or "").lower()
+
+
+def _by_category(items, field):
+    """categoryId -> the field of the (single) entry of a per-category section."""
+    index = {}
+    for item in items or []:
+        if isinstance(item, dict) and "categoryId" in item:
+            index[str(item["categoryId"])] = item.get(field) or []
+    return index
+
+
+def _summary(category):
+    return {
+        "categoryId": category.get("categoryId"),
+        "title": category.get("title"),
+        "childId": category.get("childId"),
+        "parentCategoryId": category.get("parentCategoryId") or None,
+        "sort": category.get("sort"),
+    }
+
+
+class FamilyIndex:
+    def __init__(self, doc):
+        """Build all lookups once; the document is treated as read-only afterwards."""
+        users = (doc.get("users") or {}).get("data") or []
+        devices = (doc.get("devices") or {}).get("data") or []
+        categories = [c for c in doc.get("categoryBase") or [] if isinstance(c, dict) and "categoryId" in c]
+
+        self.users_by_id = {str(u.get("id")): u for u in users if isinstance(u, dict)}
+        self.devices_by_id = {str(d.get("deviceId")): d for d in devices if isinstance(d, dict)}
+        self.devices_by_name = collections.defaultdict(list)
+        self.devices_by_user = collections.defaultdict(list)
+        for device in self.devices_by_id.values():
+            self.devices_by_name[str(device.get("name") or "").lower()].append(device)
+            if device.get("currentUserId"):
+                self.devices_by_user[str(device["currentUserId"])].append(device)
+
+        self.categories_by_id = {str(c["categoryId"]): c for c in categories}
+        # Parent id -> child categories in display order; None holds the roots.
+        self.children_by_parent = collections.defaultdict(list)
+        self.categories_by_user = collections.defaultdict(list)
+        for category in sorted(categories, key=_category_order):
+            parent = category.get("parentCategoryId")
+            parent = str(parent) if parent and str(parent) in self.categories_by_id else None
+            self.children_by_parent[parent].append(category)
+            if category.get("childId"):
+                self.categories_by_user[str(category["childId"])].append(category)
+
+        self.apps_by_category = _by_category(doc.get("categoryApp"), "apps")
+        self.rules_by_category = _by_category(doc.get("rules"), "rules")
+        self.used_times_by_category = _by_category(doc.get("usedTimes"), "times")
+        self.categories_by_app = collections.defaultdict(list)
+        for category_id, apps in self.apps_by_category.items():
+            for package_name in apps:
+                self.categories_by_app[str(package_name)].append(category_id)
+
+    def summary(self):
+        return {
+            "users": [
+                {"id": u.get("id"), "name": u.get("name"), "type": u.get("type")}
+                for u in self.users_by_id.values()
+            ],
+            "devices": [
+                {"deviceId": d.get("deviceId"), "name": d.get("name"), "currentUserId": d.get("currentUserId")}
+                for d in self.devices_by_id.values()
+            ],
+            "rootCategories": [_summary(c) for c in self.children_by_parent.get(None, [])],
+            "counts": {
+                "users": len(self.users_by_id),
+                "devices": len(self.devices_by_id),
+                "categories": len(self.categories_by_id),
+                "apps": len(self.categories_by_app),
+            },
+        }
+
+    def children(self, category_id=None):
+        """Direct child categories of category_id (root categories for None), or None if unknown."""
+        if category_id is not None:
+            category_id = str(category_id)
+            if category_id not in self.categories_by_id:
+                return None
+        return [_summary(c) for c in self.children_by_parent.get(category_id, [])]
+
+    def category(self, category_id):
+        """One category with its apps, rules, used times and direct children, or None."""
+        category = self.categories_by_id.get(str(category_id))
+        if category is None:
+            return None
+        key = str(category["categoryId"])
+        return {
+            "category": category,
+            "children": self.children(key),
+            "apps": self.apps_by_category.get(key, []),
+            "rules": self.rules_by_category.get(key, []),
+            "usedTimes": self.used_times_by_category.get(key, []),
+        }
+
+    def user(self, user_id):
+        """A user with their devices and their categories including rules, or None."""
+        user = self.users_by_id.get(str(user_id))
+        if user is None:
+            return None
+        key = str(user.get("id"))
+        return {
+            "user": user,
+            "devices": self.devices_by_user.get(key, []),
+            "categories": [
+                dict(_summary(c), rules=self.rules_by_category.get(str(c["categoryId"]), []))
+                for c in self.categories_by_user.get(key, [])
+            ],
+        }
+
+    def device(self, device_id=None, name=None):
+        """Devices by id, or by case-insensitive name (several devices may share one)."""
+        if device_id is not None:
+            device = self.devices_by_id.get(str(device_id))
+            return [device] if device is not None else []
+        return list(self.devices_by_name.get(str(name or "").lower(), []))
+
+    def app(self, package_name):
+        """Categories an app is assigned to."""
+        return [_summary(self.categories_by_id[c]) for c in self.categories_by_app.get(str(package_name), [])
+                if c in self.categories_by_id]
@@ -0,0 +1,104 @@
+"""Background log writer: lines are queued for stderr and the most recent ones are kept in memory."""
+
+import atexit
+import collections
+import queue
+import sys
+import threading
+import time
+
+LOG_RING_SIZE = 1000
+LOG_QUEUE_SIZE = 10000
+
+
+class LogSink:
+    def __init__(self, ring_size=LOG_RING_SIZE, queue_size=LOG_QUEUE_SIZE):
+        """Request threads only append and enqueue; one writer thread does the stderr I/O."""
+        self._ring = collections.deque(maxlen=ring_size)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._seq = 0
+        self._dropped = 0
+        self._written = 0
+        self._private = 0
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def write(self, message, private=False):
+        """Queue a line for stderr; private lines (secrets, payloads) are kept out of the ring behind /logs."""
+        line = f"[{time.strftime('%H:%M:%S')}] {message}"
+        with self._lock:
+            if private:
+                self._private += 1
+            else:
+                self._seq += 1
+                self._ring.append((self._seq, line))
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            # Never block a request on a slow log consumer; the ring still has the line.
+            with self._lock:
+                self._dropped += 1
+            return
+        self._ensure_thread()
+
+    def _run(self):
+        while True:
+            lines = [self._queue.get()]
+            while len(lines) < 256:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                sys.stderr.write("\n".join(lines) + "\n")
+                sys.stderr.flush()
+            except Exception:
+                pass
+            with self._lock:
+                self._written += len(lines)
+            for _ in lines:
+                self._queue.task_done()
+
+    def flush(self, timeout=2.0):
+        """Wait (bounded) until queued lines are written, e.g. at shutdown."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def lines(self, limit=200, since=0, contains=None):
+        """Return (entries, last_seq) from the ring, oldest first, as (seq, line) pairs."""
+        with self._lock:
+            entries = [entry for entry in self._ring if entry[0] > since]
+            last_seq = self._seq
+        if contains:
+            entries = [entry for entry in entries if contains in entry[1]]
+        if limit:
+            entries = entries[-limit:]
+        return entries, last_seq
+
+    def stats(self):
+        with self._lock:
+            return {
+                "buffered": len(self._ring),
+                "queued": self._queue.qsize(),
+                "written": self._written,
+                "dropped": self._dropped,
+                "private": self._private,
+            }
+
+
+SINK = LogSink()
+atexit.register(SINK.flush)
+
+
+def write(message, private=False):
+    """Timestamp a log line and hand it to the background writer."""
+    SINK.write(message, private)
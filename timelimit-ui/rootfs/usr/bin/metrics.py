@@ -0,0 +1,165 @@
+"""Process-wide counters, gauges and histograms rendered in the Prometheus text format."""
+
+import threading
+import time
+
+# Seconds; covers cached local answers (sub-ms) up to slow upstream calls and bcrypt runs.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_LOCK = threading.Lock()
+_COUNTERS = {}
+_HISTOGRAMS = {}
+_GAUGES = []
+_HELP = {}
+# Per handler thread: upstream seconds spent on the request that is currently being served.
+_CURRENT = threading.local()
+_IN_FLIGHT = [0]
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+
+def _key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def describe(name, help_text):
+    _HELP[name] = help_text
+
+
+def inc(name, labels=None, value=1):
+    key = _key(labels)
+    with _LOCK:
+        series = _COUNTERS.setdefault(name, {})
+        series[key] = series.get(key, 0) + value
+
+
+def observe(name, value, labels=None):
+    key = _key(labels)
+    with _LOCK:
+        series = _HISTOGRAMS.setdefault(name, {})
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+
+def register_gauge(name, help_text, callback):
+    """callback() returns a number or a list of (labels, value) pairs; it is called on render."""
+    describe(name, help_text)
+    with _LOCK:
+        _GAUGES.append((name, callback))
+
+
+def begin_request():
+    _CURRENT.upstream = 0.0
+    with _LOCK:
+        _IN_FLIGHT[0] += 1
+
+
+def note_upstream(path, status, seconds):
+    """Record one upstream call and charge its time to the request of the calling thread."""
+    inc("timelimit_upstream_responses_total", {"path": path, "code": str(status)})
+    observe("timelimit_upstream_duration_seconds", seconds, {"path": path})
+    _CURRENT.upstream = getattr(_CURRENT, "upstream", 0.0) + seconds
+
+
+def end_request(route, method, status, started, bytes_in, bytes_out):
+    """Record a finished request; local time is the wall time minus the upstream share."""
+    upstream = getattr(_CURRENT, "upstream", 0.0)
+    _CURRENT.upstream = 0.0
+    with _LOCK:
+        _IN_FLIGHT[0] -= 1
+    record_request(route, method, status, time.monotonic() - started, bytes_in, bytes_out, upstream)
+
+
+def record_request(route, method, status, total, bytes_in, bytes_out, upstream=0.0):
+    """Record a request that was not tracked with begin/end (e.g. native asyncio routes)."""
+    labels = {"route": route}
+    inc("timelimit_requests_total", {"route": route, "method": method, "code": str(status)})
+    observe("timelimit_request_local_seconds", max(total - upstream, 0.0), labels)
+    if upstream:
+        observe("timelimit_request_upstream_seconds", upstream, labels)
+    inc("timelimit_request_bytes_in_total", labels, bytes_in)
+    inc("timelimit_request_bytes_out_total", labels, bytes_out)
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + list(extra or [])
+    if not items:
+        return ""
+    parts = []
+    for name, value in items:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def render():
+    """Return all metrics as Prometheus text exposition (version 0.0.4)."""
+    lines = []
+    with _LOCK:
+        counters = {name: dict(series) for name, series in _COUNTERS.items()}
+        histograms = {
+            name: {key: (list(h.buckets), list(h.counts), h.count, h.sum) for key, h in series.items()}
+            for name, series in _HISTOGRAMS.items()
+        }
+        gauges = list(_GAUGES)
+
+    for name in sorted(counters):
+        if name in _HELP:
+            lines.append(f"# HELP {name} {_HELP[name]}")
+        lines.append(f"# TYPE {name} counter")
+        for key, value in sorted(counters[name].items()):
+            lines.append(f"{name}{_format_labels(key)} {value}")
+
+    for name in sorted(histograms):
+        if name in _HELP:
+            lines.append(f"# HELP {name} {_HELP[name]}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, (buckets, counts, count, total) in sorted(histograms[name].items()):
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(key)} {round(total, 6)}")
+            lines.append(f"{name}_count{_format_labels(key)} {count}")
+
+    for name, callback in gauges:
+        try:
+            value = callback()
+        except Exception:
+            continue
+        lines.append(f"# HELP {name} {_HELP[name]}")
+        lines.append(f"# TYPE {name} gauge")
+        samples = value if isinstance(value, list) else [({}, value)]
+        for labels, sample in samples:
+            lines.append(f"{name}{_format_labels(_key(labels))} {sample}")
+    return "\n".join(lines) + "\n"
+
+
+register_gauge("timelimit_requests_in_flight", "Requests currently being handled.", lambda: _IN_FLIGHT[0])
+describe("timelimit_requests_total", "Requests handled, by route, method and response status.")
+describe("timelimit_request_local_seconds", "Time spent in the add-on itself per request (wall time minus upstream).")
+describe("timelimit_request_upstream_seconds", "Time spent waiting for the TimeLimit server per request.")
+describe("timelimit_request_bytes_in_total", "Request body bytes received.")
+describe("timelimit_request_bytes_out_total", "Response body bytes sent.")
+describe("timelimit_upstream_responses_total", "Upstream responses by API path and status code.")
+describe("timelimit_upstream_duration_seconds", "Duration of single upstream calls.")
+describe("timelimit_bcrypt_duration_seconds", "Duration of bcrypt jobs in the worker pool.")
+describe("timelimit_storage_write_seconds", "Time to apply an /ha-storage write in memory.")
+describe("timelimit_storage_flush_seconds", "Time to write the HA storage file to disk.")
@@ -0,0 +1,137 @@
+"""Gzip negotiation for proxied TimeLimit API responses, with compression counters."""
+
+import gzip
+import struct
+import threading
+import zlib
+
+# Bodies below this size are sent as-is; the gzip header would eat most of the saving.
+MIN_COMPRESS_BYTES = 1024
+COMPRESS_LEVEL = 6
+
+
+def accepts_gzip(accept_encoding):
+    """True when an Accept-Encoding header allows gzip (q=0 excluded)."""
+    for part in (accept_encoding or '').lower().split(','):
+        name, _, params = part.strip().partition(';')
+        if name.strip() not in ('gzip', '*'):
+            continue
+        params = params.replace(' ', '')
+        if params.startswith('q=') and params[2:] in ('0', '0.0', '0.00', '0.000'):
+            continue
+        return True
+    return False
+
+
+def gzip_size(body):
+    """Uncompressed size from the gzip ISIZE trailer (mod 2**32)."""
+    if len(body) < 18:
+        return len(body)
+    return struct.unpack('<I', body[-4:])[0]
+
+
+class ProxyCompression:
+    def __init__(self):
+        """Decide per response whether to pass through, compress or decompress."""
+        self._lock = threading.Lock()
+        self._stats = {
+            "responses": 0, "passthrough": 0, "compressed": 0, "decompressed": 0, "identity": 0,
+            "bytesRaw": 0, "bytesWire": 0,
+        }
+
+    def _count(self, mode, raw_size, wire_size):
+        with self._lock:
+            self._stats["responses"] += 1
+            self._stats[mode] += 1
+            self._stats["bytesRaw"] += raw_size
+            self._stats["bytesWire"] += wire_size
+
+    def encode(self, body, encoding, client_gzip):
+        """Return (body, content_encoding) for the browser from an upstream body and its encoding."""
+        if encoding == 'gzip':
+            if client_gzip:
+                self._count("passthrough", gzip_size(body), len(body))
+                return body, 'gzip'
+            raw = gzip.decompress(body)
+            self._count("decompressed", len(raw), len(raw))
+            return raw, None
+        if encoding:
+            # We only ask for gzip; anything else is forwarded untouched.
+            self._count("passthrough", len(body), len(body))
+            return body, encoding
+        if client_gzip and len(body) >= MIN_COMPRESS_BYTES:
+            compressed = gzip.compress(body, compresslevel=COMPRESS_LEVEL)
+            if len(compressed) < len(body):
+                self._count("compressed", len(body), len(compressed))
+                return compressed, 'gzip'
+        self._count("identity", len(body), len(body))
+        return body, None
+
+    def stream_encoder(self, encoding, client_gzip, length=None):
+        """StreamEncoder applying the same choice as encode() to a body read in chunks."""
+        return StreamEncoder(self, encoding, client_gzip, length)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        data["ratio"] = round(data["bytesWire"] / data["bytesRaw"], 3) if data["bytesRaw"] else None
+        return data
+
+
+class StreamEncoder:
+    def __init__(self, compression, encoding, client_gzip, length=None):
+        """Recode a streamed body chunk by chunk; length is the upstream Content-Length if known.
+
+        content_encoding is the header for the browser; keeps_length is False when the
+        body size changes, so the caller must send it chunked.
+        """
+        self._compression = compression
+        self._raw = 0
+        self._wire = 0
+        self._tail = b""
+        self._zlib = None
+        if encoding == 'gzip' and not client_gzip:
+            self.mode, self.content_encoding = "decompressed", None
+            self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding:
+            self.mode, self.content_encoding = "passthrough", encoding
+        elif client_gzip and (length is None or length >= MIN_COMPRESS_BYTES):
+            self.mode, self.content_encoding = "compressed", 'gzip'
+            self._zlib = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        else:
+            self.mode, self.content_encoding = "identity", None
+        self._gzip_in = encoding == 'gzip'
+        self.keeps_length = self._zlib is None
+
+    def feed(self, chunk, max_length=0):
+        """Yield the encoded pieces for chunk; max_length bounds each inflated piece."""
+        if self._gzip_in:
+            self._tail = (self._tail + bytes(chunk[-4:]))[-4:]
+        else:
+            self._raw += len(chunk)
+        if self.mode == "decompressed":
+            data = self._zlib.decompress(chunk, max_length)
+            while data:
+                self._raw += len(data)
+                self._wire += len(data)
+                yield data
+                data = self._zlib.decompress(self._zlib.unconsumed_tail, max_length)
+        elif self.mode == "compressed":
+            data = self._zlib.compress(chunk)
+            if data:
+                self._wire += len(data)
+                yield data
+        else:
+            self._wire += len(chunk)
+            yield chunk
+
+    def finish(self):
+        """Remaining encoded bytes (may be empty); counts the response in the stats."""
+        data = self._zlib.flush() if self._zlib is not None else b""
+        if self.mode == "decompressed":
+            self._raw += len(data)
+        self._wire += len(data)
+        if self.mode == "passthrough" and self._gzip_in and len(self._tail) == 4:
+            self._raw = struct.unpack('<I', self._tail)[0]
+        self._compression._count(self.mode, self._raw, self._wire)
+        return data
@@ -0,0 +1,206 @@
+"""Version-aware cache for /sync/pull-status: asks the upstream only for what changed."""
+
+import collections
+import hashlib
+import json
+import threading
+
+from family_model import FamilyIndex
+
+# Per-category sections of the server response and their key in the client status.
+CATEGORY_SECTIONS = {
+    "categoryBase": "base",
+    "categoryApp": "apps",
+    "rules": "rules",
+    "usedTimes": "usedTime",
+    "tasks": "tasks",
+}
+REQUIRED_CATEGORY_KEYS = ("base", "apps", "rules", "usedTime")
+# Versioned top-level sections that are carried over when the upstream omits them.
+VERSIONED_SECTIONS = ("devices", "users", "apps", "devices2") + tuple(CATEGORY_SECTIONS)
+
+
+def _token_key(server_url, token):
+    return hashlib.sha256(f"{server_url}\n{token}".encode('utf-8')).hexdigest()
+
+
+def is_full_pull_request(status):
+    """True when the browser asks for the complete dataset (the only case we take over)."""
+    return (
+        isinstance(status, dict)
+        and str(status.get("devices", "0")) == "0"
+        and str(status.get("users", "0")) == "0"
+        and not status.get("apps")
+        and not status.get("categories")
+    )
+
+
+def _replace_by_key(cached_list, updates, key):
+    by_key = collections.OrderedDict((str(item.get(key)), item) for item in cached_list or [] if isinstance(item, dict))
+    for item in updates or []:
+        if isinstance(item, dict):
+            by_key[str(item.get(key))] = item
+    return list(by_key.values())
+
+
+def merge_pull_status(cached, partial):
+    """Merge a partial upstream answer into the cached full document (returns a new dict)."""
+    merged = {key: value for key, value in cached.items() if key in VERSIONED_SECTIONS}
+
+    for key in ("devices", "users"):
+        if isinstance(partial.get(key), dict):
+            merged[key] = partial[key]
+
+    if isinstance(partial.get("apps"), list):
+        merged["apps"] = _replace_by_key(merged.get("apps"), partial["apps"], "deviceId")
+    if isinstance(partial.get("devices2"), list):
+        merged["devices2"] = _replace_by_key(merged.get("devices2"), partial["devices2"], "deviceId")
+
+    for section in CATEGORY_SECTIONS:
+        if isinstance(partial.get(section), list):
+            merged[section] = _replace_by_key(merged.get(section), partial[section], "categoryId")
+
+    removed = {str(c) for c in partial.get("rmCategories") or []}
+    if removed:
+        for section in CATEGORY_SECTIONS:
+            if section in merged:
+                merged[section] = [item for item in merged[section] if str(item.get("categoryId")) not in removed]
+
+    # Non-versioned keys (apiLevel, krq, kr, message, ...) always come from the latest answer.
+    for key, value in partial.items():
+        if key not in VERSIONED_SECTIONS and key != "rmCategories":
+            merged[key] = value
+    return merged
+
+
+def build_client_status(cached, client_status):
+    """Client status that tells the upstream which versions we already hold."""
+    status = dict(client_status)
+    status["devices"] = str(cached.get("devices", {}).get("version", "0"))
+    status["users"] = str(cached.get("users", {}).get("version", "0"))
+    status["apps"] = {
+        str(item["deviceId"]): str(item.get("version", "0"))
+        for item in cached.get("apps", []) if "deviceId" in item
+    }
+
+    categories = {}
+    for section, status_key in CATEGORY_SECTIONS.items():
+        for item in cached.get(section, []):
+            category_id = str(item.get("categoryId"))
+            categories.setdefault(category_id, {})[status_key] = str(item.get("version", "0"))
+    for versions in categories.values():
+        # Missing sections are requested again from scratch.
+        for status_key in REQUIRED_CATEGORY_KEYS:
+            versions.setdefault(status_key, "0")
+    status["categories"] = categories
+    return status
+
+
+class PullStatusCache:
+    def __init__(self, max_entries=8):
+        """Keep the last full pull-status per (server, deviceAuthToken), LRU bounded."""
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        # Key -> FamilyIndex of the current entry, built on the first query after each update.
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "bypass": 0, "bytesUpstream": 0, "bytesMerged": 0, "indexBuilds": 0}
+
+    def _get(self, key):
+        with self._lock:
+            doc = self._entries.get(key)
+            if doc is not None:
+                self._entries.move_to_end(key)
+            return doc
+
+    def _put(self, key, doc):
+        with self._lock:
+            self._entries[key] = doc
+            self._entries.move_to_end(key)
+            self._indexes.pop(key, None)
+            while len(self._entries) > self.max_entries:
+                dropped, _ = self._entries.popitem(last=False)
+                self._indexes.pop(dropped, None)
+
+    def invalidate(self, server_url=None, token=None):
+        with self._lock:
+            if server_url is None or token is None:
+                self._entries.clear()
+                self._indexes.clear()
+            else:
+                key = _token_key(server_url, token)
+                self._entries.pop(key, None)
+                self._indexes.pop(key, None)
+
+    def family_index(self, server_url, token):
+        """FamilyIndex of the last full pull-status for a token, or None when nothing is cached."""
+        key = _token_key(server_url, token)
+        with self._lock:
+            doc = self._entries.get(key)
+            index = self._indexes.get(key)
+        if doc is None:
+            return None
+        if index is None or index[0] is not doc:
+            index = (doc, FamilyIndex(doc))
+            with self._lock:
+                # Only keep it when no newer document arrived while building.
+                if self._entries.get(key) is doc:
+                    self._indexes[key] = index
+                self._stats["indexBuilds"] += 1
+        return index[1]
+
+    def prepare(self, server_url, request_body):
+        """Return (context, upstream_body); context is None when the request is passed through."""
+        try:
+            request = json.loads(request_body)
+        except Exception:
+            request = None
+        token = request.get("deviceAuthToken") if isinstance(request, dict) else None
+        if not token or not is_full_pull_request(request.get("status")):
+            with self._lock:
+                self._stats["bypass"] += 1
+            return None, request_body
+
+        key = _token_key(server_url, token)
+        cached = self._get(key)
+        context = {"key": key, "cached": cached, "server": server_url, "token": token}
+        with self._lock:
+            self._stats["hits" if cached is not None else "misses"] += 1
+        if cached is None:
+            return context, request_body
+
+        upstream_request = dict(request)
+        upstream_request["status"] = build_client_status(cached, request["status"])
+        return context, json.dumps(upstream_request).encode()
+
+    def complete(self, context, status, body):
+        """Merge an upstream answer; returns (full_bytes, delta_bytes) or None to pass through."""
+        if context is None:
+            return None
+        if status == 401:
+            self.invalidate(context["server"], context["token"])
+            return None
+        if status != 200:
+            return None
+        try:
+            partial = json.loads(body)
+        except Exception:
+            return None
+        if not isinstance(partial, dict):
+            return None
+
+        cached = context["cached"]
+        merged = merge_pull_status(cached, partial) if cached is not None else partial
+        self._put(context["key"], merged)
+        full_body = json.dumps(merged).encode()
+        with self._lock:
+            self._stats["bytesUpstream"] += len(body)
+            self._stats["bytesMerged"] += len(full_body)
+        return full_body, body
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["entries"] = len(self._entries)
+            data["indexes"] = len(self._indexes)
+        return data
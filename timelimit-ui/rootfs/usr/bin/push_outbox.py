@@ -0,0 +1,244 @@
+"""Durable outbox for signed push-actions: persisted under /data, sent in batches with retry."""
+
+import json
+import os
+import random
+import threading
+import time
+
+import log_sink
+
+# Upstream answers that are worth retrying; any other non-2xx status rejects the batch for good.
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+def _log(message, *args):
+    if args:
+        message = message % args
+    log_sink.write(f"[OUTBOX] {message}")
+
+
+def _action_key(action):
+    return action.get("sequenceNumber"), action.get("integrity")
+
+
+class _TokenState:
+    """Backoff state of one (server, token) queue; kept in memory only."""
+
+    def __init__(self):
+        self.attempts = 0
+        self.next_attempt = 0.0
+        self.last_error = None
+
+
+class PushOutbox:
+    def __init__(self, path, send, on_batch_done=None, on_batch_failed=None, max_batch_actions=50,
+                 max_batch_bytes=256 * 1024, retry_base=2.0, retry_max=300.0, max_attempts=30, max_failed=100):
+        """Queue actions per (server, token) in sequenceNumber order.
+
+        send(server_url, token, actions) returns (status, body). on_batch_done(server_url, token,
+        count) and on_batch_failed(server_url, token, count, status) are called after each batch.
+        Failed retries wait retry_base * 2^attempts seconds (with jitter), at most retry_max;
+        after max_attempts the batch is rejected so it cannot block the queue forever.
+        """
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.send = send
+        self.on_batch_done = on_batch_done
+        self.on_batch_failed = on_batch_failed
+        self.max_batch_actions = max_batch_actions
+        self.max_batch_bytes = max_batch_bytes
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.max_attempts = max_attempts
+        self.max_failed = max_failed
+        self._queues = {}
+        self._states = {}
+        self._failed = []
+        self._next_id = 1
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._stats = {"enqueued": 0, "duplicates": 0, "batches": 0, "sent": 0, "retries": 0, "rejected": 0}
+
+    def load(self):
+        """Restore entries that were still queued when the add-on stopped."""
+        if not os.path.exists(self.path):
+            return 0
+        try:
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+        except Exception as e:
+            _log("Outbox laden mislukt: %s", e)
+            return 0
+        with self._cond:
+            for entry in stored.get("queue", []):
+                key = (entry["server"], entry["token"])
+                self._queues.setdefault(key, []).append(entry)
+                self._next_id = max(self._next_id, entry["id"] + 1)
+            for entries in self._queues.values():
+                entries.sort(key=lambda e: e["action"].get("sequenceNumber", 0))
+            self._failed = stored.get("failed", [])[-self.max_failed:]
+            count = sum(len(entries) for entries in self._queues.values())
+        _log("Outbox geladen: %s acties in wachtrij", count)
+        return count
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="push-outbox", daemon=True)
+                self._thread.start()
+
+    def _persist(self):
+        """Write the queue to disk (tmp file + rename); callers are not holding _cond."""
+        with self._write_lock:
+            with self._cond:
+                body = json.dumps({
+                    "queue": [entry for entries in self._queues.values() for entry in entries],
+                    "failed": self._failed,
+                })
+            try:
+                with open(self.tmp_path, 'w') as f:
+                    f.write(body)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(self.tmp_path, self.path)
+            except Exception as e:
+                _log("Outbox opslaan mislukt: %s", e)
+
+    def enqueue(self, server_url, token, actions):
+        """Add signed actions; they are on disk when this returns. Returns (accepted, duplicates)."""
+        key = (server_url, token)
+        accepted = duplicates = 0
+        now = int(time.time() * 1000)
+        # The whole batch is checked first, so a bad action never leaves part of it queued.
+        for action in actions:
+            if not isinstance(action, dict) or "sequenceNumber" not in action:
+                raise ValueError("Elke actie heeft een sequenceNumber nodig")
+        with self._cond:
+            entries = self._queues.setdefault(key, [])
+            known = {_action_key(entry["action"]) for entry in entries}
+            for action in actions:
+                if _action_key(action) in known:
+                    # The same signed action again (e.g. a browser retry): send it once.
+                    duplicates += 1
+                    continue
+                known.add(_action_key(action))
+                entries.append({"id": self._next_id, "server": server_url, "token": token,
+                                "action": action, "enqueuedAt": now})
+                self._next_id += 1
+                accepted += 1
+            # Upstream expects sequence numbers in order; late submissions slot in before newer ones.
+            entries.sort(key=lambda e: e["action"].get("sequenceNumber", 0))
+            if not entries:
+                del self._queues[key]
+            self._stats["enqueued"] += accepted
+            self._stats["duplicates"] += duplicates
+            self._cond.notify()
+        self._persist()
+        return accepted, duplicates
+
+    def _next_batch_locked(self):
+        """Return (key, entries) of the next batch that may be sent, or (None, seconds to wait)."""
+        now = time.monotonic()
+        wait = None
+        for key, entries in self._queues.items():
+            if not entries:
+                continue
+            state = self._states.setdefault(key, _TokenState())
+            if state.next_attempt > now:
+                remaining = state.next_attempt - now
+                wait = remaining if wait is None else min(wait, remaining)
+                continue
+            batch, size = [], 0
+            for entry in entries[:self.max_batch_actions]:
+                entry_size = len(json.dumps(entry["action"]))
+                if batch and size + entry_size > self.max_batch_bytes:
+                    break
+                batch.append(entry)
+                size += entry_size
+            return key, batch
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                key, batch = self._next_batch_locked()
+                while key is None:
+                    self._cond.wait(batch)
+                    key, batch = self._next_batch_locked()
+            self._send_batch(key, batch)
+
+    def _send_batch(self, key, batch):
+        server_url, token = key
+        actions = [entry["action"] for entry in batch]
+        try:
+            status, body = self.send(server_url, token, actions)
+        except Exception as e:
+            status, body = None, str(e).encode()
+
+        sent_ids = {entry["id"] for entry in batch}
+        with self._cond:
+            state = self._states.setdefault(key, _TokenState())
+            if status is not None and 200 <= status < 300:
+                outcome = "done"
+                state.attempts, state.next_attempt, state.last_error = 0, 0.0, None
+                self._stats["batches"] += 1
+                self._stats["sent"] += len(batch)
+            elif (status is None or status in RETRY_STATUSES) and state.attempts + 1 < self.max_attempts:
+                outcome = "retry"
+                state.attempts += 1
+                delay = min(self.retry_base * (2 ** (state.attempts - 1)), self.retry_max)
+                state.next_attempt = time.monotonic() + delay * random.uniform(0.8, 1.2)
+                state.last_error = f"{status or 'netwerk'}: {body[:200].decode('utf-8', errors='replace')}"
+                self._stats["retries"] += 1
+            else:
+                outcome = "rejected"
+                state.attempts, state.next_attempt = 0, 0.0
+                state.last_error = f"{status}: {body[:200].decode('utf-8', errors='replace')}"
+                self._failed.extend(dict(entry, status=status) for entry in batch)
+                self._failed = self._failed[-self.max_failed:]
+                self._stats["rejected"] += len(batch)
+            if outcome != "retry":
+                remaining = [entry for entry in self._queues.get(key, []) if entry["id"] not in sent_ids]
+                if remaining:
+                    self._queues[key] = remaining
+                else:
+                    self._queues.pop(key, None)
+
+        if outcome == "retry":
+            _log("Batch van %s acties mislukt (%s), nieuwe poging over %.1fs",
+                 len(batch), status or 'netwerk', state.next_attempt - time.monotonic())
+            return
+        self._persist()
+        if outcome == "done":
+            _log("Batch van %s acties verzonden", len(batch))
+            if self.on_batch_done:
+                self.on_batch_done(server_url, token, len(batch))
+        else:
+            _log("Batch van %s acties geweigerd door server (%s)", len(batch), status)
+            if self.on_batch_failed:
+                self.on_batch_failed(server_url, token, len(batch), status)
+
+    def depth(self):
+        with self._cond:
+            return sum(len(entries) for entries in self._queues.values())
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            data = dict(self._stats)
+            data["depth"] = sum(len(entries) for entries in self._queues.values())
+            data["failed"] = len(self._failed)
+            data["queues"] = []
+            for key, entries in self._queues.items():
+                state = self._states.get(key) or _TokenState()
+                data["queues"].append({
+                    "server": key[0],
+                    "depth": len(entries),
+                    "firstSequenceNumber": entries[0]["action"].get("sequenceNumber") if entries else None,
+                    "attempts": state.attempts,
+                    "retryIn": round(max(state.next_attempt - now, 0.0), 1),
+                    "lastError": state.last_error,
+                })
+        return data
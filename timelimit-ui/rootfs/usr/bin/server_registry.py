@@ -0,0 +1,177 @@
+"""Candidate TimeLimit servers: probed in parallel, with rolling latency and error rates."""
+
+import collections
+import concurrent.futures
+import threading
+import time
+import urllib.parse
+
+import log_sink
+
+
+def _log(message, *args):
+    if args:
+        message = message % args
+    log_sink.write(f"[SERVERS] {message}")
+
+
+def normalize_server_url(server_url):
+    """Canonical form of a server url (as used for connection pools); ValueError when invalid."""
+    url = str(server_url or "").strip().rstrip('/')
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError(f"Invalid server url: {server_url}")
+    return url
+
+
+class _Candidate:
+    def __init__(self, url, source, window):
+        self.url = url
+        self.sources = {source}
+        # (ok, seconds) of the latest probes, oldest first.
+        self.samples = collections.deque(maxlen=window)
+        self.probes = 0
+        self.failures = 0
+        self.last_probe = None
+        self.last_error = None
+
+    def healthy(self):
+        return bool(self.samples) and self.samples[-1][0]
+
+    def latency(self):
+        """Median latency of the successful probes in the window, or None."""
+        times = sorted(seconds for ok, seconds in self.samples if ok)
+        return times[len(times) // 2] if times else None
+
+    def error_rate(self):
+        if not self.samples:
+            return None
+        return sum(1 for ok, _ in self.samples if not ok) / len(self.samples)
+
+
+class ServerRegistry:
+    def __init__(self, probe, on_round=None, interval=30.0, timeout=3.0, window=20, max_workers=4):
+        """Keep probing every candidate url every interval seconds, all candidates at once.
+
+        probe(url, timeout) returns (ok, seconds, error); on_round() is called after each
+        round, e.g. to switch to a faster server. Only the last window probes count.
+        """
+        self.probe = probe
+        self.on_round = on_round
+        self.interval = interval
+        self.timeout = timeout
+        self.window = window
+        self.max_workers = max_workers
+        self._candidates = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._executor = None
+        self._stats = {"rounds": 0, "probes": 0, "failures": 0}
+
+    def add(self, server_url, source="ui"):
+        """Register a candidate (no-op when known); returns the normalized url."""
+        url = normalize_server_url(server_url)
+        with self._lock:
+            candidate = self._candidates.get(url)
+            if candidate is None:
+                self._candidates[url] = _Candidate(url, source, self.window)
+                _log("Kandidaat toegevoegd: %s (%s)", url, source)
+                self._wake.set()
+            else:
+                candidate.sources.add(source)
+        return url
+
+    def urls(self):
+        with self._lock:
+            return list(self._candidates)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(self.max_workers, "server-probe")
+                self._thread = threading.Thread(target=self._run, name="server-registry", daemon=True)
+                self._thread.start()
+
+    def probe_soon(self):
+        """Start the next round now instead of after the interval (e.g. after upstream errors)."""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                self.probe_all()
+                if self.on_round:
+                    self.on_round()
+            except Exception as e:
+                _log("Probe ronde mislukt: %s", e)
+            self._wake.wait(self.interval)
+
+    def _probe_one(self, url):
+        try:
+            return self.probe(url, self.timeout)
+        except Exception as e:
+            return False, self.timeout, str(e)
+
+    def probe_all(self):
+        """Probe all candidates concurrently; a round takes about as long as the slowest probe."""
+        urls = self.urls()
+        if self._executor is not None:
+            results = list(self._executor.map(self._probe_one, urls))
+        else:
+            results = [self._probe_one(url) for url in urls]
+        now = time.time()
+        with self._lock:
+            self._stats["rounds"] += 1
+            for url, (ok, seconds, error) in zip(urls, results):
+                candidate = self._candidates.get(url)
+                if candidate is None:
+                    continue
+                if candidate.healthy() != ok and candidate.samples:
+                    _log("%s is nu %s", url, "bereikbaar" if ok else f"onbereikbaar ({error})")
+                candidate.samples.append((ok, seconds))
+                candidate.probes += 1
+                candidate.last_probe = now
+                self._stats["probes"] += 1
+                if not ok:
+                    candidate.failures += 1
+                    candidate.last_error = error
+                    self._stats["failures"] += 1
+
+    def best(self, current=None, margin=0.3):
+        """Url to route to: the fastest healthy candidate, or None when none is healthy.
+
+        The current server is kept while it is healthy unless another one is more than
+        margin (as a fraction) faster, so near-equal servers do not flap.
+        """
+        with self._lock:
+            healthy = [c for c in self._candidates.values() if c.healthy()]
+            if not healthy:
+                return None
+            fastest = min(healthy, key=lambda c: c.latency())
+            active = self._candidates.get(current) if current else None
+            if active is not None and active.healthy() and fastest.latency() >= active.latency() * (1 - margin):
+                return active.url
+            return fastest.url
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["interval"] = self.interval
+            data["candidates"] = [
+                {
+                    "url": c.url,
+                    "sources": sorted(c.sources),
+                    "healthy": c.healthy(),
+                    "latencyMs": round(c.latency() * 1000, 1) if c.latency() is not None else None,
+                    "errorRate": round(c.error_rate(), 2) if c.error_rate() is not None else None,
+                    "samples": len(c.samples),
+                    "probes": c.probes,
+                    "failures": c.failures,
+                    "lastProbe": c.last_probe,
+                    "lastError": c.last_error,
+                }
+                for c in self._candidates.values()
+            ]
+        return data
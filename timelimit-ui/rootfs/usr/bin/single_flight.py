@@ -0,0 +1,140 @@
+"""Single-flight execution: concurrent identical calls share one run and, briefly, its result."""
+
+import threading
+import time
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+        # Set by invalidate(): the result predates the invalidation and is not cached.
+        self.invalidated = False
+
+
+class SingleFlight:
+    def __init__(self, ttl=1.0, max_entries=64, stale_ttl=0.0):
+        """Coalesce calls per key; successful results are reused for ttl seconds (0 disables that).
+
+        With stale_ttl the last successful result per key is kept that long for stale().
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._results = {}
+        self._last_good = {}
+        self._stats = {"leaders": 0, "followers": 0, "cached": 0, "errors": 0, "stale": 0, "refreshes": 0}
+
+    def do(self, key, fn, cacheable=None):
+        """Return (result, role) where role is "leader", "follower" or "cached".
+
+        key is a tuple whose first elements may be used as an invalidation prefix.
+        Exceptions raised by the leader are re-raised in every follower.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                if cached[0] > now:
+                    self._stats["cached"] += 1
+                    return cached[1], "cached"
+                del self._results[key]
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self._stats["leaders"] += 1
+                leader = True
+            else:
+                flight.followers += 1
+                self._stats["followers"] += 1
+                leader = False
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, "follower"
+
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self._stats["errors"] += 1
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+            raise
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if not flight.invalidated and (cacheable is None or cacheable(flight.result)):
+                if self.ttl > 0:
+                    self._results[key] = (time.monotonic() + self.ttl, flight.result)
+                if self.stale_ttl > 0:
+                    self._last_good.pop(key, None)
+                    self._last_good[key] = (time.monotonic() + self.stale_ttl, flight.result)
+                self._prune_locked()
+        flight.done.set()
+        return flight.result, "leader"
+
+    def _prune_locked(self):
+        now = time.monotonic()
+        for key in [key for key, (expires, _) in self._results.items() if expires <= now]:
+            del self._results[key]
+        while len(self._results) > self.max_entries:
+            self._results.pop(next(iter(self._results)))
+        for key in [key for key, (expires, _) in self._last_good.items() if expires <= now]:
+            del self._last_good[key]
+        while len(self._last_good) > self.max_entries:
+            self._last_good.pop(next(iter(self._last_good)))
+
+    def stale(self, key):
+        """Last successful result for key within stale_ttl, or None."""
+        with self._lock:
+            entry = self._last_good.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            self._stats["stale"] += 1
+            return entry[1]
+
+    def refresh(self, key, fn, cacheable=None):
+        """Run do(key, fn) on a background thread unless a call for key is already in flight."""
+        with self._lock:
+            if key in self._flights:
+                return False
+            self._stats["refreshes"] += 1
+
+        def run():
+            try:
+                self.do(key, fn, cacheable)
+            except Exception:
+                pass
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def invalidate(self, *prefix):
+        """Drop cached results whose key starts with prefix (all results without a prefix).
+
+        Calls in flight for such keys are detached: later calls start a new flight instead of
+        joining one that began before the invalidation, and their result is not cached.
+        Stale copies stay; they are only handed out through stale().
+        """
+        with self._lock:
+            for key in [key for key in self._results if key[:len(prefix)] == prefix]:
+                del self._results[key]
+            for key in [key for key in self._flights if key[:len(prefix)] == prefix]:
+                self._flights.pop(key).invalidated = True
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["inFlight"] = len(self._flights)
+            data["cachedResults"] = len(self._results)
+            data["staleResults"] = len(self._last_good)
+        return data
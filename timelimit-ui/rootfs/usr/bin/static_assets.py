@@ -0,0 +1,137 @@
+"""In-memory static asset table: gzip + identity variants, ETags and content-hash URLs."""
+
+import gzip
+import hashlib
+import os
+import re
+import threading
+import urllib.parse
+
+import log_sink
+from proxy_compression import accepts_gzip
+
+ASSET_EXTENSIONS = {
+    ".js": "text/javascript; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".html": "text/html; charset=utf-8",
+}
+INDEX_ROUTES = ("/", "", "/index.html")
+# Only compress when it saves at least this fraction of the bytes.
+MIN_GZIP_SAVING = 0.1
+CACHE_FOREVER = "public, max-age=31536000, immutable"
+CACHE_REVALIDATE = "no-cache"
+
+
+def _log(message):
+    log_sink.write(message)
+
+
+class StaticAsset:
+    def __init__(self, name, body, content_type):
+        """One cached file with its identity and (optional) gzip variant."""
+        self.name = name
+        self.content_type = content_type
+        self.body = body
+        self.hash = hashlib.sha256(body).hexdigest()[:16]
+        self.etag = f'"{self.hash}"'
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(compressed) <= len(body) * (1 - MIN_GZIP_SAVING):
+            self.gzip_body = compressed
+            self.gzip_etag = f'"{self.hash}-gz"'
+        else:
+            self.gzip_body = None
+            self.gzip_etag = None
+
+    def matches(self, if_none_match):
+        """True when an If-None-Match header names one of our variants."""
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag == '*' or tag == self.etag or (self.gzip_etag and tag == self.gzip_etag):
+                return True
+        return False
+
+    def select(self, accept_encoding):
+        """Return (body, etag, content_encoding) for the client's Accept-Encoding."""
+        if self.gzip_body is not None and accepts_gzip(accept_encoding):
+            return self.gzip_body, self.gzip_etag, "gzip"
+        return self.body, self.etag, None
+
+
+class StaticAssetCache:
+    def __init__(self, directory, index_name="dashboard.html"):
+        """Load all web assets of a directory once; the index HTML gets content-hash URLs."""
+        self.directory = directory
+        self.index_name = index_name
+        self._assets = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _rewrite_index(self, html, assets):
+        # Replace hand-maintained ?v=NN query strings by the content hash of each file.
+        for name, asset in assets.items():
+            pattern = re.compile(r'((?:src|href)=")' + re.escape(name) + r'(?:\?[^"]*)?(")')
+            html = pattern.sub(lambda m: f"{m.group(1)}{name}?h={asset.hash}{m.group(2)}", html)
+        return html
+
+    def load(self):
+        assets = {}
+        index_body = None
+        try:
+            names = sorted(os.listdir(self.directory))
+        except OSError as e:
+            _log(f"[ERROR] Static assets niet geladen: {str(e)}")
+            names = []
+        for name in names:
+            ext = os.path.splitext(name)[1]
+            if ext not in ASSET_EXTENSIONS:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, 'rb') as f:
+                    body = f.read()
+            except OSError as e:
+                _log(f"[ERROR] Static asset {name}: {str(e)}")
+                continue
+            if name == self.index_name:
+                index_body = body
+            else:
+                assets[name] = StaticAsset(name, body, ASSET_EXTENSIONS[ext])
+
+        table = {f"/{name}": asset for name, asset in assets.items()}
+        if index_body is not None:
+            html = self._rewrite_index(index_body.decode('utf-8'), assets)
+            index = StaticAsset(self.index_name, html.encode('utf-8'), ASSET_EXTENSIONS[".html"])
+            table[f"/{self.index_name}"] = index
+            for route in INDEX_ROUTES:
+                table[route] = index
+
+        with self._lock:
+            self._assets = table
+            self._loaded = True
+        total = sum(len(a.body) for a in set(table.values()))
+        total_gz = sum(len(a.gzip_body or a.body) for a in set(table.values()))
+        _log(f"[STATIC] {len(set(table.values()))} assets geladen ({total} bytes, gzip {total_gz} bytes)")
+
+    def lookup(self, request_path):
+        """Return (asset, immutable) for a request path, or (None, False)."""
+        if not self._loaded:
+            self.load()
+        parsed = urllib.parse.urlsplit(request_path)
+        asset = self._assets.get(parsed.path)
+        if asset is None:
+            return None, False
+        requested_hash = urllib.parse.parse_qs(parsed.query).get('h', [None])[0]
+        return asset, requested_hash == asset.hash
+
+    def stats(self):
+        with self._lock:
+            assets = set(self._assets.values())
+        return {
+            "assets": len(assets),
+            "bytes": sum(len(a.body) for a in assets),
+            "gzipBytes": sum(len(a.gzip_body or a.body) for a in assets),
+        }
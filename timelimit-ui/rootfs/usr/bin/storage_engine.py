@@ -0,0 +1,252 @@
+"""In-memory HA storage document with revisions, JSON-patch updates and coalesced flushes."""
+
+import copy
+import json
+import os
+import threading
+import time
+
+import log_sink
+import metrics
+
+# Writes that arrive within this window end up in a single file rewrite.
+FLUSH_DELAY_S = 0.5
+# A failed flush is retried after flush_delay * 2^failures seconds, at most this long.
+FLUSH_RETRY_MAX_S = 30.0
+PATCH_OPS = ("add", "replace", "remove")
+
+
+def _log(message):
+    log_sink.write(message)
+
+
+class StorageConflictError(RuntimeError):
+    def __init__(self, expected, current):
+        super().__init__(f"Revision mismatch: expected {expected}, current {current}")
+        self.expected = expected
+        self.current = current
+
+
+def parse_if_match(value):
+    """Revision from an If-Match header ('"12-<ts>"', '"12"' or '12'); None when absent or '*'."""
+    if value is None:
+        return None
+    value = value.strip()
+    if not value or value == '*':
+        return None
+    if value.startswith('W/'):
+        value = value[2:]
+    # ETags look like "<revision>-<serverTimestamp>"; only the revision matters here.
+    value = value.strip('"').split('-', 1)[0]
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Invalid If-Match: {value}")
+
+
+def etag_matches(if_none_match, etag):
+    """True when an If-None-Match header names the given strong ETag."""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*' or tag == etag:
+            return True
+    return False
+
+
+def _pointer_parts(path):
+    if not isinstance(path, str) or not path.startswith('/'):
+        raise ValueError(f"Invalid patch path: {path}")
+    return [part.replace('~1', '/').replace('~0', '~') for part in path[1:].split('/')]
+
+
+def apply_patch(document, operations):
+    """Apply add/replace/remove operations (RFC 6902 subset) to a dict in place."""
+    if not isinstance(operations, list):
+        raise ValueError("Patch must be a list of operations")
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get("op") not in PATCH_OPS:
+            raise ValueError(f"Unsupported patch operation: {operation}")
+        op = operation["op"]
+        parts = _pointer_parts(operation.get("path"))
+        if parts == ['revision'] or parts == ['serverTimestamp']:
+            raise ValueError(f"Read-only path: {operation['path']}")
+
+        parent = document
+        for part in parts[:-1]:
+            if isinstance(parent, dict):
+                if part not in parent:
+                    if op != "add":
+                        raise ValueError(f"Missing path: {operation['path']}")
+                    parent[part] = {}
+                parent = parent[part]
+            elif isinstance(parent, list):
+                parent = parent[int(part)]
+            else:
+                raise ValueError(f"Invalid path: {operation['path']}")
+
+        key = parts[-1]
+        if isinstance(parent, dict):
+            if op == "remove":
+                parent.pop(key, None)
+            else:
+                parent[key] = operation.get("value")
+        elif isinstance(parent, list):
+            if op == "add" and key == '-':
+                parent.append(operation.get("value"))
+            elif op == "add":
+                parent.insert(int(key), operation.get("value"))
+            elif op == "remove":
+                del parent[int(key)]
+            else:
+                parent[int(key)] = operation.get("value")
+        else:
+            raise ValueError(f"Invalid path: {operation['path']}")
+    return document
+
+
+class StorageEngine:
+    def __init__(self, path, tmp_path=None, flush_delay=FLUSH_DELAY_S):
+        """Keep the storage document in memory; the file is rewritten at most once per flush_delay."""
+        self.path = path
+        self.tmp_path = tmp_path or f"{path}.tmp"
+        self.flush_delay = flush_delay
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._document = None
+        self._revision = 0
+        self._dirty = False
+        self._timer = None
+        self._flush_failures = 0
+        self._loaded = False
+        self._serialized = None
+        self._stats = {"writes": 0, "patches": 0, "conflicts": 0, "flushes": 0, "flushFailures": 0}
+
+    def _load_locked(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.path, 'r') as f:
+                document = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            _log(f"[ERROR] HA storage niet geladen: {str(e)}")
+            return
+        if isinstance(document, dict):
+            self._document = document
+            try:
+                self._revision = int(document.get("revision", 0))
+            except (TypeError, ValueError):
+                self._revision = 0
+
+    @property
+    def revision(self):
+        with self._lock:
+            self._load_locked()
+            return self._revision
+
+    def snapshot(self):
+        """Return (revision, deep copy of the document or None when nothing was stored yet)."""
+        with self._lock:
+            self._load_locked()
+            return self._revision, copy.deepcopy(self._document)
+
+    def _etag_locked(self):
+        timestamp = (self._document or {}).get("serverTimestamp", 0)
+        return f'"{self._revision}-{timestamp}"'
+
+    @property
+    def etag(self):
+        with self._lock:
+            self._load_locked()
+            return self._etag_locked()
+
+    def serialized(self):
+        """Return (body_bytes, etag) for GET; serialized once per revision."""
+        with self._lock:
+            self._load_locked()
+            if self._serialized is None:
+                document = self._document if self._document is not None else {"status": "empty", "revision": self._revision}
+                self._serialized = (json.dumps(document).encode(), self._etag_locked())
+            return self._serialized
+
+    def _commit_locked(self, document, expected_revision):
+        if expected_revision is not None and expected_revision != self._revision:
+            self._stats["conflicts"] += 1
+            raise StorageConflictError(expected_revision, self._revision)
+        self._revision += 1
+        document["revision"] = self._revision
+        document["serverTimestamp"] = int(time.time() * 1000)
+        self._document = document
+        self._serialized = None
+        self._dirty = True
+        self._stats["writes"] += 1
+        self._schedule_flush_locked(self.flush_delay)
+        return self._revision
+
+    def _schedule_flush_locked(self, delay):
+        if self._timer is None:
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def replace(self, document, expected_revision=None):
+        """Store a complete document; returns the new revision."""
+        if not isinstance(document, dict):
+            raise ValueError("Invalid payload")
+        with self._lock:
+            self._load_locked()
+            return self._commit_locked(dict(document), expected_revision)
+
+    def patch(self, operations, expected_revision=None):
+        """Apply JSON-patch operations to the current document; returns the new revision."""
+        with self._lock:
+            self._load_locked()
+            if expected_revision is not None and expected_revision != self._revision:
+                self._stats["conflicts"] += 1
+                raise StorageConflictError(expected_revision, self._revision)
+            document = apply_patch(copy.deepcopy(self._document or {}), operations)
+            self._stats["patches"] += 1
+            return self._commit_locked(document, None)
+
+    def flush(self):
+        """Write the current document to disk if it changed since the last flush."""
+        with self._flush_lock:
+            with self._lock:
+                self._timer = None
+                if not self._dirty:
+                    return False
+                self._dirty = False
+                body = json.dumps(self._document)
+            started = time.monotonic()
+            try:
+                with open(self.tmp_path, 'w') as f:
+                    f.write(body)
+                os.replace(self.tmp_path, self.path)
+            except Exception as e:
+                with self._lock:
+                    self._dirty = True
+                    self._flush_failures += 1
+                    self._stats["flushFailures"] += 1
+                    # Keep retrying on our own; the document must not wait for the next write.
+                    delay = min(self.flush_delay * (2 ** self._flush_failures), FLUSH_RETRY_MAX_S)
+                    self._schedule_flush_locked(delay)
+                _log(f"[ERROR] HA storage flush mislukt: {str(e)} (nieuwe poging over {delay:.1f}s)")
+                return False
+            metrics.observe("timelimit_storage_flush_seconds", time.monotonic() - started)
+            with self._lock:
+                self._flush_failures = 0
+                self._stats["flushes"] += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["revision"] = self._revision
+            data["dirty"] = self._dirty
+        return data
@@ -8,6 +8,9 @@
 let syncTimer = null;
 let secondsCounter = 0;
 const SYNC_INTERVAL = 30; // seconds
+// Set when the add-on pulls for our token itself; we then follow its "sync" events instead of polling.
+let serverSyncFingerprint = null;
+let lastSyncDigest = null;
 const SERVER_API_LEVEL_KEY = "timelimit_serverApiLevel";
 let serverApiLevel = null;
 
@@ -160,8 +163,8 @@ function setPendingBadgeSyncState(isSyncing) {
     }
 }
 
-// Perform a pull sync from the server and update local state
-async function runSync() {
+// Perform a pull sync from the server and update local state; manual syncs skip the add-on's scheduled copy
+async function runSync(manual = false) {
     const badge = document.getElementById('status-badge');
     const jsonView = document.getElementById('json-view');
 
@@ -188,11 +191,15 @@ async function runSync() {
             headers: {
                 'Content-Type': 'application/json',
                 'Cache-Control': 'no-cache',
-                'Pragma': 'no-cache'
+                'Pragma': 'no-cache',
+                ...(manual ? { 'X-Sync-Manual': '1' } : {})
             },
             body: JSON.stringify(syncPayload)
         });
 
+        serverSyncFingerprint = res.headers.get('X-Sync-Scheduler');
+        lastSyncDigest = res.headers.get('X-Pull-Status-Digest') || lastSyncDigest;
+
         // --- CRITICAL CHECK ---
         const contentType = res.headers.get("content-type");
         let responseData;
@@ -401,12 +408,20 @@ function triggerManualSync() {
         return executePushSync();
     }
     if (typeof runSync === 'function') {
-        return runSync();
+        return runSync(true);
     }
 }
 
+// Handle a "sync" event ("fingerprint:digest"); returns true when this tab should pull.
+function isSyncEventForUs(data) {
+    const [fingerprint, digest] = String(data || '').split(':');
+    if (!serverSyncFingerprint || fingerprint !== serverSyncFingerprint) return false;
+    return digest !== lastSyncDigest;
+}
+
 if (typeof window !== 'undefined') {
     window.triggerManualSync = triggerManualSync;
+    window.isSyncEventForUs = isSyncEventForUs;
 }
 
 
@@ -423,6 +438,17 @@ function startSyncLoop() {
                 badge.className = "status-badge status-offline";
                 return;
             }
+            const followsServer = serverSyncFingerprint
+                && typeof window.isHaEventChannelLive === 'function'
+                && window.isHaEventChannelLive();
+            if (followsServer) {
+                // The add-on pulls for us and announces changes; no upstream polling from this tab.
+                secondsCounter = 0;
+                if (badge.innerText.includes("Online")) {
+                    badge.innerText = "Online (live)";
+                }
+                return;
+            }
             secondsCounter++;
             
             // Show progress on the badge (optional, visual feedback)
@@ -657,6 +683,52 @@ async function calculateIntegrity(sequenceNumber, deviceId, encodedAction) {
     }
 }
 
+/**
+ * Bereken integrity voor een hele batch in één request (apiLevel >= 6).
+ * Valt terug op calculateIntegrity per actie voor legacy servers of bij fouten.
+ *
+ * @returns {string[]} Integrity strings in dezelfde volgorde als items
+ */
+// Calculate integrity hashes for a batch of actions with one server round-trip
+async function calculateIntegrityBatch(items, deviceId) {
+    const useLegacyIntegrity = typeof serverApiLevel === "number" && serverApiLevel < 6;
+    const secondHash = parentPasswordHash && parentPasswordHash.secondHash;
+
+    if (!useLegacyIntegrity && secondHash && items.length > 0) {
+        try {
+            const response = await fetch('calculate-hmac-sha256-batch', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    secondHash: secondHash,
+                    items: items.map(item => ({
+                        sequenceNumber: item.sequenceNumber,
+                        deviceId: deviceId,
+                        encodedAction: item.encodedAction
+                    }))
+                })
+            });
+
+            if (response.ok) {
+                const result = await response.json();
+                if (result && Array.isArray(result.integrities) && result.integrities.length === items.length) {
+                    console.log(`[INTEGRITY] Batch HMAC-SHA256: ${items.length} acties in één request`);
+                    return result.integrities.map(entry => entry.integrity);
+                }
+            }
+            console.warn(`[INTEGRITY] Batch endpoint onbruikbaar (status ${response.status}), per actie berekenen`);
+        } catch (error) {
+            console.warn("[INTEGRITY] Batch endpoint fout, per actie berekenen:", error.message);
+        }
+    }
+
+    const integrities = [];
+    for (const item of items) {
+        integrities.push(await calculateIntegrity(item.sequenceNumber, deviceId, item.encodedAction));
+    }
+    return integrities;
+}
+
 /**
  * Bundle all changes into actions for delivery (max 50 per batch)
  */
@@ -866,8 +938,9 @@ BATCHES: ${syncData.batches.length}
     let usedFallback = false;
 
     try {
-        for (const item of firstBatch) {
-            const integrity = await calculateIntegrity(item.sequenceNumber, deviceId, item.encodedAction);
+        const integrities = await calculateIntegrityBatch(firstBatch, deviceId);
+        firstBatch.forEach((item, idx) => {
+            const integrity = integrities[idx];
             if (integrity === "device") {
                 usedFallback = true;
             }
@@ -878,7 +951,7 @@ BATCHES: ${syncData.batches.length}
                 type: "parent",           // UPDATE_TIMELIMIT_RULE is a parent action
                 userId: parentUserId      // Parent executing the action
             });
-        }
+        });
 
         logContent += `\n${JSON.stringify(mockPayload, null, 2)}\n`;
         if (usedFallback) {
@@ -1241,6 +1314,21 @@ function generateRandomId(length) {
     return result;
 }
 
+// Hand a signed batch to the add-on outbox (delivered with retry, also after this tab closes).
+// Falls back to the direct proxy when the outbox is switched off.
+async function sendPushBatch(payloadString) {
+    const request = {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: payloadString
+    };
+    const response = await fetch('push-outbox', request);
+    if (response.status !== 404) {
+        return response;
+    }
+    return fetch('sync/push-actions', request);
+}
+
 /**
  * TEST version: Send changes via /sync/push-actions
  * With verbose logging of server responses
@@ -1359,6 +1447,7 @@ async function executePushSync() {
     // Process each batch
     let successfulBatches = 0;
     let failedBatches = 0;
+    let queuedBatches = 0;
     
     for (let batchIdx = 0; batchIdx < syncData.batches.length; batchIdx++) {
         const batch = syncData.batches[batchIdx];
@@ -1407,8 +1496,9 @@ async function executePushSync() {
             addLog(`📤 Batch ${batchNum}: Integrity berekenen voor ${batch.length} acties...`, false);
             console.log(`[PUSH-SYNC] Batch ${batchNum}: Integrity signing starten...`);
             
-            for (const item of batch) {
-                const integrity = await calculateIntegrity(item.sequenceNumber, deviceId, item.encodedAction);
+            const integrities = await calculateIntegrityBatch(batch, deviceId);
+            batch.forEach((item, idx) => {
+                const integrity = integrities[idx];
                 
                 actions.push({
                     sequenceNumber: item.sequenceNumber,
@@ -1419,7 +1509,7 @@ async function executePushSync() {
                 });
                 
                 console.log(`  [Seq ${item.sequenceNumber}] Action: ${item.action.type}, Integrity: ${integrity.substring(0, 30)}...`);
-            }
+            });
             
             logContent += `Acties met signing:\n${JSON.stringify(actions, null, 2)}\n\n`;
             
@@ -1463,11 +1553,10 @@ async function executePushSync() {
             console.log(`  - Current location: ${window.location.href}`);
             console.log(`  - Resolved URL will be: ${new URL('sync/push-actions', window.location.href).href}`);
             
-            const response = await fetch('sync/push-actions', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: payloadString
-            });
+            const response = await sendPushBatch(payloadString);
+            if (response.status === 202) {
+                queuedBatches++;
+            }
             
             const responseStatus = response.status;
             const responseContentType = response.headers.get('content-type') || 'unknown';
@@ -1518,7 +1607,11 @@ async function executePushSync() {
                 
                 console.log(`[PUSH-SYNC] Batch ${batchNum}: ✅ SUCCESVOL`);
                 logContent += `✅ BATCH ${batchNum} SUCCESVOL VERWERKT\n`;
-                addLog(`✅ Batch ${batchNum}: Succesvol verzonden!`, false);
+                if (responseStatus === 202) {
+                    addLog(`✅ Batch ${batchNum}: In de outbox van de add-on geplaatst`, false);
+                } else {
+                    addLog(`✅ Batch ${batchNum}: Succesvol verzonden!`, false);
+                }
                 successfulBatches++;
                 
             } else {
@@ -1635,7 +1728,10 @@ async function executePushSync() {
     
     // If all batches succeeded and there were no failures, trigger a pull sync.
     // This ensures we run a full sync when the server requested it.
-    if (successfulBatches === syncData.batches.length && failedBatches === 0) {
+    if (queuedBatches > 0) {
+        // The add-on sends a "push" event once the outbox delivered the batch; that triggers the pull.
+        addLog(`📮 ${queuedBatches} batch(es) in outbox, pull sync volgt na verzending`, false);
+    } else if (successfulBatches === syncData.batches.length && failedBatches === 0) {
         console.log(`[PUSH-SYNC] 🔄 Automatische pull sync starten om server state te synchroniseren...`);
         addLog(`🔄 Pull sync starten om server state op te halen...`, false);
         
@@ -0,0 +1,239 @@
+"""Add-on-side pull loop: one schedule per known token, dashboards are told when data changed."""
+
+import hashlib
+import heapq
+import json
+import threading
+import time
+
+import log_sink
+
+
+def _log(message, *args):
+    if args:
+        message = message % args
+    log_sink.write(f"[SYNC-SCHEDULER] {message}")
+
+
+def token_fingerprint(server_url, token):
+    """Short public id of a (server, token) pair; dashboards use it to pick their own events."""
+    return hashlib.sha256(f"{server_url}\n{token}".encode('utf-8')).hexdigest()[:12]
+
+
+def body_digest(body):
+    """Digest of a pull-status answer that ignores key order, so merged and upstream bodies compare equal."""
+    try:
+        canonical = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':')).encode('utf-8')
+    except ValueError:
+        canonical = body
+    return hashlib.sha256(canonical).hexdigest()[:16]
+
+
+class _Schedule:
+    def __init__(self, server_url, token, request_body, interval):
+        self.server_url = server_url
+        self.token = token
+        self.request_body = request_body
+        self.fingerprint = token_fingerprint(server_url, token)
+        self.interval = interval
+        self.due = 0.0
+        self.latest = None
+        self.digest = None
+        self.fresh = False
+        self.boost_until = 0.0
+        self.last_seen = time.monotonic()
+        self.generation = 0
+        # Bumped by every push; answers from pulls that started before it are outdated.
+        self.pushes = 0
+
+
+class SyncScheduler:
+    def __init__(self, pull, on_change, has_listeners, min_interval=3.0, base_interval=15.0,
+                 max_interval=120.0, boost_window=30.0, forget_after=600.0):
+        """Pull each known token on its own adaptive interval.
+
+        pull(server_url, token, request_body) returns (status, full_body or None);
+        on_change(fingerprint, digest) is called when the answer for a token changed;
+        has_listeners() tells whether any dashboard is connected to the event channel.
+        Intervals: base after a change, growing 1.5x per unchanged pull up to max_interval,
+        min_interval for boost_window seconds after a push.
+        Tokens nobody asked for in forget_after seconds are dropped while no dashboard listens.
+        """
+        self.pull = pull
+        self.on_change = on_change
+        self.has_listeners = has_listeners
+        self.min_interval = min_interval
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.boost_window = boost_window
+        self.forget_after = forget_after
+        self._schedules = {}
+        self._heap = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stats = {"pulls": 0, "changes": 0, "errors": 0, "served": 0, "forgotten": 0, "outdated": 0}
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sync-scheduler", daemon=True)
+                self._thread.start()
+
+    def _push_locked(self, schedule, due):
+        schedule.due = due
+        schedule.generation += 1
+        heapq.heappush(self._heap, (due, schedule.generation, id(schedule), schedule))
+        self._cond.notify()
+
+    def touch(self, server_url, token, request_body):
+        """Register a token from a dashboard's full pull; the same request body is used for later pulls."""
+        if not token:
+            return
+        key = (server_url, token)
+        with self._cond:
+            schedule = self._schedules.get(key)
+            if schedule is None:
+                schedule = self._schedules[key] = _Schedule(server_url, token, request_body, self.base_interval)
+                self._push_locked(schedule, time.monotonic() + schedule.interval)
+                _log("Token %s ingepland (elke %ss)", schedule.fingerprint, schedule.interval)
+            schedule.request_body = request_body
+            schedule.last_seen = time.monotonic()
+
+    def push_generation(self, server_url, token):
+        """Push count of a token; take it before a pull starts and hand it to record()."""
+        with self._cond:
+            schedule = self._schedules.get((server_url, token))
+            return schedule.pushes if schedule is not None else None
+
+    def record(self, server_url, token, body, pushes=None):
+        """Store a successful full answer from any source and reschedule; returns its digest.
+
+        pushes is push_generation() from before the pull started; an answer from a pull that
+        started before the last boost() may miss the pushed actions and is not stored.
+        """
+        digest = body_digest(body)
+        now = time.monotonic()
+        with self._cond:
+            schedule = self._schedules.get((server_url, token))
+            if schedule is None:
+                return digest
+            if pushes is not None and pushes != schedule.pushes:
+                self._stats["outdated"] += 1
+                return digest
+            changed = schedule.digest is not None and schedule.digest != digest
+            schedule.latest, schedule.digest, schedule.fresh = body, digest, True
+            if now < schedule.boost_until:
+                schedule.interval = self.min_interval
+            elif changed:
+                schedule.interval = self.base_interval
+            else:
+                schedule.interval = min(schedule.interval * 1.5, self.max_interval)
+            self._push_locked(schedule, now + schedule.interval)
+            if changed:
+                self._stats["changes"] += 1
+            fingerprint = schedule.fingerprint
+        if changed:
+            _log("Wijziging voor %s (%s)", fingerprint, digest)
+            self.on_change(fingerprint, digest)
+        return digest
+
+    def boost(self, server_url, token):
+        """After a push: the stored answer is outdated; pull now and often for a while."""
+        with self._cond:
+            schedule = self._schedules.get((server_url, token))
+            if schedule is None:
+                return
+            schedule.fresh = False
+            schedule.pushes += 1
+            schedule.boost_until = time.monotonic() + self.boost_window
+            schedule.interval = self.min_interval
+            self._push_locked(schedule, time.monotonic())
+
+    def latest(self, server_url, token):
+        """(body, digest) of the last answer when it is still current, else None."""
+        with self._cond:
+            schedule = self._schedules.get((server_url, token))
+            if schedule is None or not schedule.fresh or schedule.latest is None:
+                return None
+            schedule.last_seen = time.monotonic()
+            self._stats["served"] += 1
+            return schedule.latest, schedule.digest
+
+    def fingerprint(self, server_url, token):
+        """Fingerprint of a scheduled token, or None when the token is not scheduled."""
+        with self._cond:
+            schedule = self._schedules.get((server_url, token))
+            return schedule.fingerprint if schedule is not None else None
+
+    def forget(self, server_url=None, token=None):
+        """Stop pulling for one token, or for all tokens without arguments."""
+        with self._cond:
+            if server_url is None:
+                self._schedules.clear()
+                self._heap = []
+            else:
+                self._schedules.pop((server_url, token), None)
+
+    def _next_due_locked(self):
+        """Pop the next schedule that is due, or return the seconds to wait."""
+        while self._heap:
+            due, generation, _, schedule = self._heap[0]
+            current = self._schedules.get((schedule.server_url, schedule.token)) is schedule
+            if not current or generation != schedule.generation:
+                heapq.heappop(self._heap)
+                continue
+            wait = due - time.monotonic()
+            if wait > 0:
+                return None, wait
+            heapq.heappop(self._heap)
+            return schedule, 0
+        return None, None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                schedule, wait = self._next_due_locked()
+                while schedule is None:
+                    self._cond.wait(wait)
+                    schedule, wait = self._next_due_locked()
+                idle = time.monotonic() - schedule.last_seen > self.forget_after
+                request_body = schedule.request_body
+                pushes = schedule.pushes
+            if idle and not self.has_listeners():
+                with self._cond:
+                    if self._schedules.get((schedule.server_url, schedule.token)) is schedule:
+                        del self._schedules[(schedule.server_url, schedule.token)]
+                        self._stats["forgotten"] += 1
+                _log("Token %s vergeten: geen dashboards meer", schedule.fingerprint)
+                continue
+            self._pull(schedule, request_body, pushes)
+
+    def _pull(self, schedule, request_body, pushes=None):
+        try:
+            status, body = self.pull(schedule.server_url, schedule.token, request_body)
+        except Exception as e:
+            status, body = None, None
+            _log("Pull fout voor %s: %s", schedule.fingerprint, e)
+        with self._cond:
+            self._stats["pulls"] += 1
+        if body is not None:
+            self.record(schedule.server_url, schedule.token, body, pushes)
+            return
+        with self._cond:
+            self._stats["errors"] += 1
+            if status == 401:
+                # The token is no longer valid; dashboards will register again after a new login.
+                self._schedules.pop((schedule.server_url, schedule.token), None)
+                return
+            if self._schedules.get((schedule.server_url, schedule.token)) is schedule:
+                schedule.interval = min(schedule.interval * 2, self.max_interval)
+                self._push_locked(schedule, time.monotonic() + schedule.interval)
+
+    def stats(self):
+        with self._cond:
+            data = dict(self._stats)
+            data["tokens"] = [
+                {"fingerprint": s.fingerprint, "interval": round(s.interval, 1), "digest": s.digest, "fresh": s.fresh}
+                for s in self._schedules.values()
+            ]
+        return data
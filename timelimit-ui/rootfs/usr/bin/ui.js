@@ -48,6 +48,45 @@ const HA_STORAGE_KEYS = [
 ];
 
 let haShadowTimer = null;
+// Last storage revision and data seen from the server; pushes only send what differs.
+let haStorageRevision = null;
+let haStorageServerData = null;
+
+function rememberHaStorageState(storage) {
+    if (!storage || !Number.isFinite(Number(storage.revision))) return;
+    haStorageRevision = Number(storage.revision);
+    haStorageServerData = storage.data && typeof storage.data === 'object' ? { ...storage.data } : null;
+}
+
+// Build JSON-patch operations for the keys that differ from the server copy
+function buildHaStoragePatch(snapshot, reason) {
+    const ops = [];
+    if (!haStorageServerData) {
+        ops.push({ op: 'add', path: '/data', value: snapshot.data });
+    } else {
+        Object.keys(snapshot.data).forEach((key) => {
+            if (haStorageServerData[key] !== snapshot.data[key]) {
+                ops.push({ op: 'add', path: `/data/${key.replace(/~/g, '~0').replace(/\//g, '~1')}`, value: snapshot.data[key] });
+            }
+        });
+    }
+    ops.push({ op: 'add', path: '/version', value: snapshot.version });
+    ops.push({ op: 'add', path: '/updatedAt', value: snapshot.updatedAt });
+    ops.push({ op: 'add', path: '/reason', value: reason || 'unknown' });
+    return ops;
+}
+
+async function sendHaStoragePatch(ops) {
+    const headers = { 'Content-Type': 'application/json' };
+    if (haStorageRevision !== null) {
+        headers['If-Match'] = `"${haStorageRevision}"`;
+    }
+    return fetch(HA_STORAGE_ENDPOINT, {
+        method: 'POST',
+        headers,
+        body: JSON.stringify(ops)
+    });
+}
 
 // Build a snapshot of HA storage keys for syncing
 function buildHaStorageSnapshot() {
@@ -67,12 +106,31 @@ function buildHaStorageSnapshot() {
 async function pushHaStorageSnapshot(reason) {
     try {
         const payload = buildHaStorageSnapshot();
-        payload.reason = reason || 'unknown';
-        const res = await fetch(HA_STORAGE_ENDPOINT, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(payload)
-        });
+        let res;
+        if (haStorageRevision === null) {
+            payload.reason = reason || 'unknown';
+            res = await fetch(HA_STORAGE_ENDPOINT, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(payload)
+            });
+        } else {
+            const ops = buildHaStoragePatch(payload, reason);
+            res = await sendHaStoragePatch(ops);
+            if (res && res.status === 412) {
+                // Another device wrote in between; re-apply only our own changes on its revision.
+                const current = await fetch(HA_STORAGE_ENDPOINT, { method: 'GET' }).then((r) => r.json());
+                rememberHaStorageState(current);
+                res = await sendHaStoragePatch(ops);
+            }
+        }
+        if (res && res.ok) {
+            const result = await res.clone().json().catch(() => null);
+            if (result && Number.isFinite(Number(result.revision))) {
+                haStorageRevision = Number(result.revision);
+                haStorageServerData = { ...(haStorageServerData || {}), ...payload.data };
+            }
+        }
         if (res && res.ok && typeof loadHaStorageStatus === 'function') {
             addLog(`✅ HA storage sync verstuurd (${reason || 'unknown'})`, false);
             loadHaStorageStatus();
@@ -248,6 +306,7 @@ async function loadHaStorageStatus() {
         const res = await fetch(HA_STORAGE_ENDPOINT, { method: 'GET' });
         if (!res.ok) throw new Error('status');
         const data = await res.json();
+        rememberHaStorageState(data);
         renderHaStorageDetails(data);
         return data;
     } catch (e) {
@@ -271,7 +330,8 @@ let haEventLastSyncAt = 0;
 let haEventLastStorageAt = 0;
 let haLongPollTimer = null;
 let haLongPollActive = false;
-let haLongPollLastId = 0;
+// Last event id seen; null until the add-on told us its journal head (first contact sends no cursor).
+let haLongPollLastId = null;
 let haLongPollErrorCount = 0;
 
 function handleHaEvent(type, data) {
@@ -297,6 +357,21 @@ function handleHaEvent(type, data) {
         return;
     }
 
+    if (type === 'push' && String(data || '').startsWith('failed:')) {
+        const parts = String(data).split(':');
+        addLog(`❌ Outbox: ${parts[1]} actie(s) geweigerd door server (status ${parts[2]})`, true);
+    }
+
+    if (type === 'server') {
+        // Auto mode moved to another server; the sync below pulls from the new one.
+        addLog(`🔀 Server automatisch gewisseld naar: ${data}`, false);
+    }
+
+    if (type === 'sync' && typeof window.isSyncEventForUs === 'function' && !window.isSyncEventForUs(data)) {
+        // Change of another token, or data this tab already has.
+        return;
+    }
+
     if (now - haEventLastSyncAt < 2000) return;
     haEventLastSyncAt = now;
     if (typeof runSync === 'function') {
@@ -313,16 +388,35 @@ function startHaLongPoll() {
     const pollOnce = async () => {
         // Keep one long-poll request open; restart quickly after each response.
         if (!haLongPollActive) return;
+        let nextDelayMs = 250;
         try {
-            const url = `ha-events-longpoll?since=${haLongPollLastId}&timeout=25`;
+            const cursor = haLongPollLastId === null ? '' : `since=${haLongPollLastId}&`;
+            const url = `ha-events-longpoll?${cursor}timeout=25`;
             const res = await fetch(url, { method: 'GET', cache: 'no-store' });
+            if (res.status === 503) {
+                // The add-on is shedding load: come back when it says so instead of after 250 ms.
+                const retryAfter = parseInt(res.headers.get('Retry-After') || '', 10);
+                nextDelayMs = (Number.isFinite(retryAfter) && retryAfter > 0 ? retryAfter : 5) * 1000;
+            }
             if (!res.ok) throw new Error(`status ${res.status}`);
             const payload = await res.json();
             haLongPollErrorCount = 0;
-            if (payload && payload.id) {
+            if (payload && typeof payload.id === 'number') {
+                // Also accept lower ids: after a restart the server journal may start over.
                 haLongPollLastId = payload.id;
             }
-            if (payload && payload.status === 'event' && payload.event) {
+            if (payload && payload.status === 'gap') {
+                // Our cursor fell out of the server journal: reload everything.
+                addLog('⚠️ Long-poll gap: volledige resync', true);
+                handleHaEvent('storage', 'resync');
+                handleHaEvent('push', 'resync');
+            } else if (payload && payload.status === 'event' && Array.isArray(payload.events)) {
+                payload.events.forEach((item) => {
+                    if (item && item.event) {
+                        handleHaEvent(item.event, item.data || '');
+                    }
+                });
+            } else if (payload && payload.status === 'event' && payload.event) {
                 handleHaEvent(payload.event, payload.data || '');
             }
         } catch (e) {
@@ -333,7 +427,7 @@ function startHaLongPoll() {
             }
         } finally {
             if (!haLongPollActive) return;
-            haLongPollTimer = setTimeout(pollOnce, 250);
+            haLongPollTimer = setTimeout(pollOnce, nextDelayMs);
         }
     };
 
@@ -349,8 +443,72 @@ function stopHaLongPoll() {
     }
 }
 
+// Flow: prefer one server-sent events stream; fall back to long-poll when it cannot connect.
+let haEventSource = null;
+let haEventSourceOpened = false;
+
+function handleHaStreamMessage(message) {
+    let payload = null;
+    try {
+        payload = JSON.parse(message.data);
+    } catch (e) {
+        return;
+    }
+    if (!payload) return;
+    if (typeof payload.id === 'number') {
+        haLongPollLastId = payload.id;
+    }
+    if (payload.status === 'gap') {
+        addLog('⚠️ Event stream gap: volledige resync', true);
+        handleHaEvent('storage', 'resync');
+        handleHaEvent('push', 'resync');
+        return;
+    }
+    if (payload.event) {
+        handleHaEvent(payload.event, payload.data || '');
+    }
+}
+
+function startHaEventStream() {
+    if (haEventSource || haLongPollActive) return;
+    haEventSourceOpened = false;
+    haEventSource = new EventSource(haLongPollLastId === null ? 'ha-events-stream' : `ha-events-stream?since=${haLongPollLastId}`);
+    haEventSource.onopen = () => {
+        if (!haEventSourceOpened) {
+            addLog('📡 Event stream gestart', false);
+        }
+        haEventSourceOpened = true;
+    };
+    haEventSource.onmessage = handleHaStreamMessage;
+    haEventSource.onerror = () => {
+        // EventSource reconnects by itself (with Last-Event-ID); only give up if it never worked.
+        if (haEventSourceOpened) return;
+        addLog('⚠️ Event stream niet beschikbaar, terug naar long-poll', true);
+        stopHaEventStream();
+        startHaLongPoll();
+    };
+}
+
+function stopHaEventStream() {
+    if (!haEventSource) return;
+    haEventSource.close();
+    haEventSource = null;
+}
+
+// True while this tab receives events, so the add-on's sync scheduler can replace polling.
+function isHaEventChannelLive() {
+    if (haEventSource) return haEventSourceOpened && haEventSource.readyState === 1;
+    return haLongPollActive && haLongPollErrorCount === 0;
+}
+
+window.isHaEventChannelLive = isHaEventChannelLive;
+
 function initHaLongPoll() {
-    startHaLongPoll();
+    if (typeof EventSource !== 'undefined') {
+        startHaEventStream();
+    } else {
+        startHaLongPoll();
+    }
 }
 
 window.initHaLongPoll = initHaLongPoll;
@@ -1,103 +1,537 @@
 """Web server for the UI: serves static assets, proxies API calls, and handles long-poll events."""
 
+import atexit
+import functools
+import gzip
+import hashlib
 import http.server
-import socketserver
 import json
 import os
+import signal
 import sys
 import time
 import threading
 import urllib.parse
-from socketserver import ThreadingMixIn
-from api_client import TimeLimitAPI
+from api_client import (
+    TimeLimitAPI, reset_connection_pools, get_connection_pool_stats, probe_server,
+    acquire_stream_buffer, release_stream_buffer, STREAM_CHUNK_SIZE
+)
+from event_journal import EventJournal
+from config_store import ConfigStore
+from pull_status_cache import PullStatusCache, is_full_pull_request
+from single_flight import SingleFlight
+from sync_scheduler import SyncScheduler
+from push_outbox import PushOutbox
+from server_registry import ServerRegistry
+from worker_pool import PooledHTTPServer, DEFAULT_WORKERS, DEFAULT_LANES, DEFAULT_MAX_STREAMS
+from static_assets import StaticAssetCache, CACHE_FOREVER, CACHE_REVALIDATE, INDEX_ROUTES
+from proxy_compression import ProxyCompression, accepts_gzip
+import log_sink
+import metrics
+from storage_engine import StorageEngine, StorageConflictError, parse_if_match, etag_matches
 
 CONFIG_PATH = "/data/options.json"
+DEFAULT_CONFIG = {"server_url": "http://192.168.68.30:8080", "logging_mode": "standard"}
 HTML_PATH = "/usr/bin/dashboard.html" 
 STORAGE_PATH = "/data/timelimit_ui_storage.json"
 STORAGE_TMP_PATH = "/data/timelimit_ui_storage.json.tmp"
+PUSH_OUTBOX_PATH = "/data/timelimit_push_outbox.json"
+SSE_HEARTBEAT_S = 15
+SSE_RETRY_MS = 2000
+EVENTS_PATH = "/data/timelimit_ui_events.json"
+EVENT_JOURNAL_SIZE = 256
+PULL_STATUS_RESULT_TTL = 1.0
+PULL_STATUS_STALE_TTL = 3600.0
+SERVER_PROBE_INTERVAL = 30.0
 
 # Flow: keep selected server in memory, and use long-poll for cross-device signals.
 SELECTED_SERVER = None
+# "manual": the server picked in the UI; "auto": the fastest healthy candidate from SERVER_REGISTRY.
+SERVER_MODE = "manual"
+# Serializes server switches from handlers, config changes and the probe thread.
+SERVER_LOCK = threading.Lock()
 LOGGING_MODE = "standard"
 LONGPOLL_LOCK = threading.Lock()
 LONGPOLL_COND = threading.Condition(LONGPOLL_LOCK)
-LONGPOLL_LAST_EVENT = {"id": 0, "event": None, "data": None, "ts": 0}
+# Journal of recent events so reconnecting clients can replay everything after their cursor.
+EVENT_JOURNAL = EventJournal(EVENT_JOURNAL_SIZE)
+# Last full pull-status per token, so the upstream only has to send what changed.
+PULL_STATUS_CACHE = PullStatusCache()
+# Concurrent identical pull-status requests share one upstream call; results live for 1 s,
+# the last good one stays available as a stale answer while the upstream is down.
+PULL_STATUS_FLIGHTS = SingleFlight(ttl=PULL_STATUS_RESULT_TTL, stale_ttl=PULL_STATUS_STALE_TTL)
+# HA storage document lives in memory; bursts of writes are flushed to disk once.
+STORAGE = StorageEngine(STORAGE_PATH, STORAGE_TMP_PATH)
+# Gzip negotiation for proxied API responses (upstream and browser side).
+PROXY_COMPRESSION = ProxyCompression()
+# Web assets next to the dashboard HTML, loaded once into memory.
+STATIC_ASSETS = StaticAssetCache(os.path.dirname(HTML_PATH), os.path.basename(HTML_PATH))
+# Extra callbacks run after each broadcast (e.g. waking asyncio long-poll waiters).
+EVENT_LISTENERS = []
 
-def log(message):
-    if message.startswith("[DEBUG") and LOGGING_MODE != "verbose":
+# UI route suffix -> TimeLimit API path; INTERNAL routes are answered by this add-on.
+PROXY_ROUTES = {
+    '/wizard-step1': '/auth/send-mail-login-code-v2',
+    '/wizard-step2': '/auth/sign-in-by-mail-code',
+    '/wizard-step3': '/parent/create-family',
+    '/wizard-login': '/parent/sign-in-into-family',
+    '/sync': '/sync/pull-status',
+    '/sync/push-actions': '/sync/push-actions',
+    '/generate-hashes': 'INTERNAL',
+    '/regenerate-hash': 'INTERNAL',
+    '/calculate-hmac': 'INTERNAL',
+    '/calculate-hmac-sha256': 'INTERNAL',
+    '/calculate-hmac-sha256-batch': 'INTERNAL',
+    '/calculate-sha512': 'INTERNAL',
+    '/debug-integrity': 'INTERNAL',
+    '/get-token-device': 'INTERNAL',
+    '/family-model': 'INTERNAL',
+    '/push-outbox': 'INTERNAL'
+}
+# Routes that call the TimeLimit server, and the bcrypt-heavy ones; each gets its own worker lane.
+UPSTREAM_ROUTES = tuple(route for route, target in PROXY_ROUTES.items() if target != 'INTERNAL')
+CRYPTO_ROUTES = ('/generate-hashes', '/regenerate-hash', '/debug-integrity')
+# Route labels for /metrics besides the proxy routes; anything else is counted as "static".
+METRIC_ROUTES = tuple(PROXY_ROUTES) + (
+    '/set-server', '/servers', '/ha-storage', '/ha-events-longpoll', '/ha-events-stream', '/ui-version',
+    '/upstream-stats', '/worker-stats', '/crypto-stats', '/logs', '/metrics'
+)
+# Threads currently blocked on LONGPOLL_COND (long-poll and event stream clients).
+LONGPOLL_WAITERS = 0
+# The running PooledHTTPServer in threaded mode, for /worker-stats.
+HTTP_SERVER = None
+
+def log(message, *args):
+    # Debug lines are dropped before any formatting; %-style args are only applied when the line is kept.
+    if LOGGING_MODE != "verbose" and message.startswith("[DEBUG"):
+        return
+    if args:
+        message = message % args
+    log_sink.write(message)
+
+def private_log(message, *args):
+    # Lines with payloads, hashes or token prefixes: add-on log only, never served by /logs.
+    if LOGGING_MODE != "verbose" and message.startswith("[DEBUG"):
         return
-    sys.stderr.write(f"[{time.strftime('%H:%M:%S')}] {message}\n")
+    if args:
+        message = message % args
+    log_sink.write(message, private=True)
 
-def event_log(message):
-    log(message)
+def event_log(message, *args):
+    log(message, *args)
 
 def broadcast_event(event, data):
     # Notify all long-poll waiters about a new event.
-    event_log(f"[EVENT] Broadcast event={event} data={data}")
+    event_log("[EVENT] Broadcast event=%s data=%s", event, data)
     with LONGPOLL_COND:
-        LONGPOLL_LAST_EVENT["id"] += 1
-        LONGPOLL_LAST_EVENT["event"] = event
-        LONGPOLL_LAST_EVENT["data"] = data
-        LONGPOLL_LAST_EVENT["ts"] = int(time.time() * 1000)
+        EVENT_JOURNAL.append(event, data)
         LONGPOLL_COND.notify_all()
+    for listener in list(EVENT_LISTENERS):
+        try:
+            listener()
+        except Exception as e:
+            log(f"[ERROR] Event listener fout: {str(e)}")
+
+def parse_longpoll_params(path):
+    """Parse since/timeout query parameters of a long-poll request.
+
+    since_id is None without a usable since= parameter: the client's first contact.
+    """
+    parsed = urllib.parse.urlparse(path)
+    params = urllib.parse.parse_qs(parsed.query)
+    since_raw = params.get('since', [None])[0]
+    timeout_raw = params.get('timeout', ['25'])[0]
+    try:
+        since_id = int(since_raw)
+    except Exception:
+        since_id = None
+    try:
+        timeout_s = int(timeout_raw)
+    except Exception:
+        timeout_s = 25
+    if timeout_s < 1:
+        timeout_s = 1
+    if timeout_s > 30:
+        timeout_s = 30
+    return since_id, timeout_s
+
+def logs_payload(path):
+    """Recent log lines from the in-memory ring; ?limit=, ?since=<seq> and ?q=<text> filter them."""
+    params = urllib.parse.parse_qs(urllib.parse.urlparse(path).query)
+    try:
+        limit = max(1, min(int(params.get('limit', ['200'])[0]), log_sink.LOG_RING_SIZE))
+    except ValueError:
+        limit = 200
+    try:
+        since = int(params.get('since', ['0'])[0])
+    except ValueError:
+        since = 0
+    entries, last_seq = log_sink.SINK.lines(limit, since, params.get('q', [None])[0])
+    return {
+        "lines": [line for _, line in entries],
+        "last": last_seq,
+        "loggingMode": LOGGING_MODE,
+        "stats": log_sink.SINK.stats()
+    }
+
+def request_token(post_data):
+    """deviceAuthToken of a JSON API request body, or None."""
+    try:
+        request = json.loads(post_data)
+    except Exception:
+        return None
+    return request.get("deviceAuthToken") if isinstance(request, dict) else None
+
+def fairness_client(forwarded_for, peer):
+    """Client key for bcrypt fairness: the address the ingress hop added, else the peer address.
+
+    Behind HA ingress every request comes from the supervisor, which appends the browser's
+    address to X-Forwarded-For. Earlier entries come from the browser itself and are not trusted.
+    """
+    hops = [hop.strip() for hop in (forwarded_for or '').split(',') if hop.strip()]
+    return hops[-1] if hops else peer
+
+def proxy_streaming_enabled():
+    return bool(get_config().get("proxy_streaming", True))
+
+def needs_buffered_proxy(target_path, post_data):
+    """Full pull-status answers are merged into the version cache and shared, so they are buffered."""
+    if target_path != '/sync/pull-status':
+        return False
+    try:
+        request = json.loads(post_data)
+    except Exception:
+        return False
+    return isinstance(request, dict) and is_full_pull_request(request.get("status"))
+
+def family_model_query(request):
+    """Answer a /family-model request body; returns (status, payload)."""
+    family = PULL_STATUS_CACHE.family_index(SELECTED_SERVER, request.get("deviceAuthToken"))
+    if family is None:
+        return 404, {"error": "Geen pull-status in cache voor deze token; eerst synchroniseren"}
+    query = request.get("query", "summary")
+    if query == "summary":
+        result = family.summary()
+    elif query == "children":
+        result = family.children(request.get("categoryId"))
+    elif query == "category":
+        result = family.category(request.get("categoryId"))
+    elif query == "user":
+        result = family.user(request.get("userId"))
+    elif query == "device":
+        result = family.device(request.get("deviceId"), request.get("name"))
+    elif query == "app":
+        result = family.app(request.get("packageName"))
+    else:
+        return 400, {"error": f"Onbekende query: {query}"}
+    if result is None:
+        return 404, {"query": query, "error": "Niet gevonden"}
+    return 200, {"query": query, "result": result}
+
+def fetch_pull_status(api, post_data):
+    """One upstream pull-status round trip through the version cache.
+
+    Returns (status, body, encoding, merged, cache_state); merged is (full, delta) when
+    the version cache took the request over, else None.
+    """
+    # Full pull-status requests are answered from the cache plus an upstream delta.
+    pull_context, upstream_data = PULL_STATUS_CACHE.prepare(SELECTED_SERVER, post_data)
+    status, body, encoding = api.post_raw('/sync/pull-status', upstream_data)
+    if encoding == 'gzip' and pull_context is not None:
+        # The cache merge needs plain JSON; the result is compressed again by the handler.
+        body = gzip.decompress(body)
+        encoding = None
+    merged = PULL_STATUS_CACHE.complete(pull_context, status, body)
+    cache_state = None
+    if merged is not None:
+        cache_state = "miss" if pull_context["cached"] is None else "hit"
+    return status, body, encoding, merged, cache_state
+
+def wait_on_longpoll_locked(timeout_s):
+    # Caller holds LONGPOLL_COND; the waiter count feeds the /metrics gauge.
+    global LONGPOLL_WAITERS
+    LONGPOLL_WAITERS += 1
+    try:
+        LONGPOLL_COND.wait(timeout=timeout_s)
+    finally:
+        LONGPOLL_WAITERS -= 1
+
+def longpoll_payload_locked(since_id, timed_out=False):
+    """Build the long-poll answer for a client cursor; caller must hold LONGPOLL_COND.
+
+    The top-level event fields describe the newest event (for older clients); "events"
+    holds every retained event after the cursor, which EVENT_JOURNAL.resolve() must have
+    turned into a journal position. A "gap" status means the cursor was evicted from the
+    journal and the client must do a full resync.
+    """
+    events, gap = EVENT_JOURNAL.since(since_id)
+    last_id = EVENT_JOURNAL.last_id
+    if gap:
+        return {"status": "gap", "id": last_id, "resync": True, "events": events}
+    if events:
+        newest = events[-1]
+        return {
+            "status": "event",
+            "id": newest["id"],
+            "event": newest["event"],
+            "data": newest["data"],
+            "ts": newest["ts"],
+            "events": events
+        }
+    if timed_out:
+        return {"status": "timeout", "id": last_id}
+    return None
+
+def parse_stream_cursor(path, last_event_id):
+    """Cursor for an event stream: Last-Event-ID header wins over the since= parameter (None: first contact)."""
+    if last_event_id:
+        try:
+            return int(last_event_id)
+        except Exception:
+            pass
+    return parse_longpoll_params(path)[0]
+
+def stream_open_frame_locked(cursor):
+    """First frame of an event stream and its cursor; caller must hold LONGPOLL_COND.
+
+    A first-contact cursor starts at the journal head; the id-only frame hands that head to
+    EventSource, so a reconnect sends it as Last-Event-ID instead of replaying the journal.
+    """
+    cursor = EVENT_JOURNAL.resolve(cursor)
+    return f"retry: {SSE_RETRY_MS}\nid: {cursor}\n\n".encode(), cursor
+
+def stream_frames_locked(cursor):
+    """Return (frames, new_cursor) for events after cursor; caller must hold LONGPOLL_COND."""
+    events, gap = EVENT_JOURNAL.since(cursor)
+    if gap:
+        last_id = EVENT_JOURNAL.last_id
+        frame = f"id: {last_id}\ndata: {json.dumps({'status': 'gap', 'id': last_id, 'resync': True})}\n\n"
+        return frame.encode(), last_id
+    if not events:
+        return b"", cursor
+    frames = "".join(f"id: {e['id']}\ndata: {json.dumps(e)}\n\n" for e in events)
+    return frames.encode(), events[-1]["id"]
 
 def get_config():
-    """Haalt de actuele configuratie op uit Home Assistant."""
-    if os.path.exists(CONFIG_PATH):
+    """Haalt de actuele configuratie op uit Home Assistant (read-only snapshot)."""
+    return CONFIG.snapshot()
+
+def _on_logging_mode_change(new_mode, old_mode):
+    global LOGGING_MODE
+    LOGGING_MODE = "verbose" if new_mode == "verbose" else "standard"
+    log(f"[CONFIG] logging_mode: {LOGGING_MODE}")
+
+def _on_server_url_change(new_url, old_url):
+    if new_url:
         try:
-            with open(CONFIG_PATH, 'r') as f: 
-                return json.load(f)
-        except Exception as e:
-            log(f"Config Error: {str(e)}")
-    return {"server_url": "http://192.168.68.30:8080", "logging_mode": "standard"}
+            new_url = SERVER_REGISTRY.add(new_url, "config")
+        except ValueError as e:
+            log(f"[CONFIG] {e}")
+            return
+    # Only follow the option when the UI did not pick another server in the meantime.
+    global SELECTED_SERVER
+    if new_url and SERVER_MODE == "manual" and SELECTED_SERVER is not None and SELECTED_SERVER == old_url:
+        SELECTED_SERVER = new_url
+        reset_connection_pools(SELECTED_SERVER)
+        log(f"[CONFIG] server_url gewijzigd naar: {SELECTED_SERVER}")
+
+# Flow: options.json is parsed once and re-read only when its mtime/inode changes.
+CONFIG = ConfigStore(CONFIG_PATH, DEFAULT_CONFIG)
+CONFIG.subscribe("logging_mode", _on_logging_mode_change)
+CONFIG.subscribe("server_url", _on_server_url_change)
 
 def load_logging_mode():
-    global LOGGING_MODE
-    config = get_config()
-    mode = config.get("logging_mode", "standard")
-    LOGGING_MODE = "verbose" if mode == "verbose" else "standard"
+    # LOGGING_MODE is kept up to date by the config subscriber; this only triggers the change check.
+    get_config()
+
+def clear_second_hash_cache():
+    # crypto_utils needs bcrypt; only touch the cache when the module was already loaded.
+    crypto_utils = sys.modules.get("crypto_utils")
+    if crypto_utils is not None:
+        crypto_utils.SECOND_HASH_CACHE.clear()
 
 def is_verbose_logging():
     return LOGGING_MODE == "verbose"
 
-class ThreadedHTTPServer(ThreadingMixIn, socketserver.TCPServer):
-    daemon_threads = True
-    allow_reuse_address = True
+def metrics_route(path):
+    """Bounded route label for a request path (longest matching route suffix)."""
+    request_path = urllib.parse.urlparse(path).path
+    matches = [route for route in METRIC_ROUTES if request_path.endswith(route)]
+    return max(matches, key=len) if matches else "static"
+
+def longpoll_waiter_count():
+    count = LONGPOLL_WAITERS
+    if ASYNC_LONGPOLL_NOTIFIER is not None:
+        count += ASYNC_LONGPOLL_NOTIFIER.waiter_count
+    return count
+
+def bcrypt_queue_depth():
+    # crypto_utils (and bcrypt) are only imported once a crypto route was used.
+    crypto_utils = sys.modules.get("crypto_utils")
+    return crypto_utils.get_bcrypt_engine().stats()["queueDepth"] if crypto_utils else 0
+
+metrics.register_gauge("timelimit_longpoll_waiters", "Clients waiting for events (long-poll and event stream).", longpoll_waiter_count)
+metrics.register_gauge("timelimit_threads", "Live threads in the process (handler threads included).", threading.active_count)
+metrics.register_gauge("timelimit_bcrypt_queue_depth", "bcrypt jobs queued or running.", bcrypt_queue_depth)
+
+def request_lane(method, path):
+    """Worker lane of a request: longpoll (events), crypto (bcrypt), proxy (upstream calls) or static."""
+    if method == "GET" and ('/ha-events-longpoll' in path or '/ha-events-stream' in path):
+        return "longpoll"
+    if method == "POST" and path.endswith(CRYPTO_ROUTES):
+        return "crypto"
+    if method == "POST" and path.endswith(UPSTREAM_ROUTES):
+        return "proxy"
+    return "static"
+
+def worker_stats():
+    return HTTP_SERVER.stats() if HTTP_SERVER is not None else {"pool": None, "lanes": {}}
+
+def lane_gauge(field):
+    return lambda: [({"lane": name}, lane[field]) for name, lane in worker_stats()["lanes"].items()]
+
+metrics.register_gauge("timelimit_lane_active", "Requests running per worker lane (threaded mode).", lane_gauge("active"))
+metrics.register_gauge("timelimit_lane_waiting", "Requests queued per worker lane (threaded mode).", lane_gauge("waiting"))
+
+def metered(handler_method):
+    """Wrap do_GET/do_POST to record route, status, local/upstream time and body bytes."""
+    @functools.wraps(handler_method)
+    def wrapper(self):
+        started = time.monotonic()
+        metrics.begin_request()
+        self._metrics_status = 0
+        self._metrics_bytes_out = 0
+        try:
+            return handler_method(self)
+        finally:
+            metrics.end_request(
+                metrics_route(self.path), self.command, self._metrics_status, started,
+                int(self.headers.get('Content-Length') or 0), self._metrics_bytes_out
+            )
+    return wrapper
+
+def server_sync_enabled():
+    return bool(get_config().get("server_sync", True))
+
+def scheduled_pull(server_url, token, request_body):
+    """Pull for the sync scheduler, through the same single-flight and version cache as dashboards."""
+    api = TimeLimitAPI(server_url, verbose=is_verbose_logging())
+    key = (server_url, token, hashlib.sha256(request_body).hexdigest())
+    (status, body, encoding, merged, cache_state), flight = PULL_STATUS_FLIGHTS.do(
+        key, lambda: fetch_pull_status(api, request_body), cacheable=lambda result: result[0] == 200
+    )
+    log("[DEBUG] Scheduled pull-status: %s (%s)", status, flight)
+    return status, merged[0] if merged is not None else None
+
+def notify_sync_change(fingerprint, digest):
+    # Dashboards compare the fingerprint with their own token and reload only when the digest is new.
+    broadcast_event("sync", f"{fingerprint}:{digest}")
+
+# One pull loop in the add-on for every token a dashboard synced; dashboards follow its events.
+SYNC_SCHEDULER = SyncScheduler(scheduled_pull, notify_sync_change, lambda: longpoll_waiter_count() > 0)
+
+def after_push_actions(server_url, token, data="done"):
+    # A pull right after a push must see the pushed actions, not a coalesced earlier answer.
+    PULL_STATUS_FLIGHTS.invalidate(server_url, token)
+    SYNC_SCHEDULER.boost(server_url, token)
+    event_log("[EVENT] Trigger broadcast from push-actions (%s)", data)
+    broadcast_event("push", data)
+
+def push_outbox_enabled():
+    return bool(get_config().get("push_outbox", True))
+
+def outbox_send(server_url, token, actions):
+    api = TimeLimitAPI(server_url, verbose=is_verbose_logging())
+    return api.post('/sync/push-actions', json.dumps({"deviceAuthToken": token, "actions": actions}).encode())
+
+def outbox_batch_failed(server_url, token, count, status):
+    broadcast_event("push", f"failed:{count}:{status}")
+
+# Signed push-actions accepted from dashboards; survives restarts and is sent in batches with retry.
+PUSH_OUTBOX = PushOutbox(
+    PUSH_OUTBOX_PATH,
+    outbox_send,
+    on_batch_done=lambda server_url, token, count: after_push_actions(server_url, token, f"outbox:{count}"),
+    on_batch_failed=outbox_batch_failed
+)
+metrics.register_gauge("timelimit_push_outbox_depth", "Push actions waiting in the outbox.", PUSH_OUTBOX.depth)
+
+def apply_server(new_url):
+    """Route proxy calls to new_url; connections and caches of the previous server are dropped."""
+    global SELECTED_SERVER
+    SELECTED_SERVER = new_url
+    # Keep-alive connections to the previous server are no longer useful.
+    dropped = reset_connection_pools(SELECTED_SERVER)
+    PULL_STATUS_CACHE.invalidate()
+    PULL_STATUS_FLIGHTS.invalidate()
+    SYNC_SCHEDULER.forget()
+    clear_second_hash_cache()
+    log("[DEBUG] Upstream connection pools gesloten: %s", dropped)
+
+def auto_select_server():
+    """After each probe round in auto mode: move to a faster server, or away from one that is down."""
+    with SERVER_LOCK:
+        if SERVER_MODE != "auto":
+            return
+        best = SERVER_REGISTRY.best(SELECTED_SERVER)
+        if best is None or best == SELECTED_SERVER:
+            return
+        previous = SELECTED_SERVER
+        apply_server(best)
+    log(f"[SUCCESS] AUTO: SERVER GEWISSELD NAAR: {best} (was {previous})")
+    broadcast_event("server", best)
+
+def load_server_candidates():
+    """The server_url option and fallback_server_urls are always candidates; the UI can add more."""
+    global SERVER_MODE
+    config = get_config()
+    SERVER_MODE = "auto" if config.get("server_selection") == "auto" else "manual"
+    for url, source in [(config.get("server_url"), "config")] + [(u, "fallback") for u in config.get("fallback_server_urls") or []]:
+        try:
+            SERVER_REGISTRY.add(url, source)
+        except ValueError as e:
+            log(f"[CONFIG] {e}")
+
+# Candidate servers with rolling probe latency and error rates; picks the server in auto mode.
+SERVER_REGISTRY = ServerRegistry(probe_server, on_round=auto_select_server, interval=SERVER_PROBE_INTERVAL)
 
 class TimeLimitHandler(http.server.SimpleHTTPRequestHandler):
     protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without TCP_NODELAY keep-alive replies wait for a delayed ACK.
+    disable_nagle_algorithm = True
+    # Proxy answers may be forwarded while they arrive (off when responses are collected in memory).
+    streaming_responses = True
 
-    def do_GET(self):
-        # Serve UI version from config
-        if self.path.endswith('/ui-version'):
-            try:
-                config = get_config()
-                version = config.get('version', 'unknown')
-                self._send_raw(200, json.dumps({'version': version}).encode(), 'application/json')
-            except Exception as e:
-                self._send_raw(500, str(e).encode(), 'text/plain')
-            return
-        # ...existing code...
     def log_message(self, format, *args):
-        log(f"[HTTP] {format%args}")
+        log("[HTTP] " + format, *args)
+
+    def send_response(self, code, message=None):
+        self._metrics_status = code
+        super().send_response(code, message)
 
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'content-length':
+            self._metrics_bytes_out = int(value)
+        super().send_header(keyword, value)
+
+    @metered
     def do_POST(self):
         """Handelt alle API verzoeken van het dashboard af met uitgebreide logging."""
-        global SELECTED_SERVER
+        global SELECTED_SERVER, SERVER_MODE
         load_logging_mode()
         
         # DEBUG: Log welk pad wordt aangeroepen
-        log(f"[DEBUG] Binnenkomend POST verzoek op pad: {self.path}")
-        log(f"[DEBUG] Request headers: {dict(self.headers)}")
+        log("[DEBUG] Binnenkomend POST verzoek op pad: %s", self.path)
+        log("[DEBUG] Request headers: %s", self.headers.items())
         
         content_length = int(self.headers.get('Content-Length', 0))
         post_data = self.rfile.read(content_length)
-        log(f"[DEBUG] Content-Length: {content_length} bytes")
+        log("[DEBUG] Content-Length: %s bytes", content_length)
         
         # Initialiseer SELECTED_SERVER
         if SELECTED_SERVER is None:
             SELECTED_SERVER = get_config().get('server_url', "http://192.168.68.30:8080")
-            log(f"[DEBUG] SELECTED_SERVER geïnitialiseerd op: {SELECTED_SERVER}")
+            log("[DEBUG] SELECTED_SERVER geïnitialiseerd op: %s", SELECTED_SERVER)
 
         # Route: set-server is UI-controlled and updates in-memory server selection.
         if self.path.endswith('/set-server'):
@@ -105,13 +539,23 @@ class TimeLimitHandler(http.server.SimpleHTTPRequestHandler):
             try:
                 data = json.loads(post_data)
                 new_url = data.get('url')
-                log(f"[DEBUG] Poging tot wisselen naar: {new_url}")
-                
-                SELECTED_SERVER = new_url
-                log(f"[SUCCESS] SERVER GEWISSELD NAAR: {SELECTED_SERVER}")
-                
+                log("[DEBUG] Poging tot wisselen naar: %s", new_url)
+
+                if new_url == "auto":
+                    # Auto mode: keep the current server until the probes found a better one.
+                    SERVER_MODE = "auto"
+                    log("[SUCCESS] SERVER SELECTIE: AUTO")
+                    auto_select_server()
+                    SERVER_REGISTRY.probe_soon()
+                else:
+                    new_url = SERVER_REGISTRY.add(new_url, "ui")
+                    with SERVER_LOCK:
+                        SERVER_MODE = "manual"
+                        apply_server(new_url)
+                    log(f"[SUCCESS] SERVER GEWISSELD NAAR: {SELECTED_SERVER}")
+
                 # Stuur expliciet antwoord terug naar de browser
-                self._send_raw(200, json.dumps({"status": "ok", "server": SELECTED_SERVER}).encode(), "application/json")
+                self._send_raw(200, json.dumps({"status": "ok", "server": SELECTED_SERVER, "mode": SERVER_MODE}).encode(), "application/json")
                 return 
             except Exception as e:
                 log(f"[ERROR] Fout in /set-server: {str(e)}")
@@ -119,22 +563,30 @@ class TimeLimitHandler(http.server.SimpleHTTPRequestHandler):
                 return
 
         # Route: HA storage shadow copy for cross-device state.
+        # A JSON object replaces the document, a JSON list is applied as a patch; If-Match guards both.
         if self.path.endswith('/ha-storage'):
             try:
                 payload = json.loads(post_data) if post_data else {}
-                if not isinstance(payload, dict):
+                expected = parse_if_match(self.headers.get('If-Match'))
+                write_started = time.monotonic()
+                if isinstance(payload, list):
+                    revision = STORAGE.patch(payload, expected)
+                elif isinstance(payload, dict):
+                    revision = STORAGE.replace(payload, expected)
+                else:
                     raise ValueError("Invalid payload")
+                metrics.observe("timelimit_storage_write_seconds", time.monotonic() - write_started)
 
-                payload["serverTimestamp"] = int(time.time() * 1000)
-
-                with open(STORAGE_TMP_PATH, 'w') as f:
-                    json.dump(payload, f)
-                os.replace(STORAGE_TMP_PATH, STORAGE_PATH)
-
-                event_log("[EVENT] Trigger broadcast from /ha-storage")
+                event_log(f"[EVENT] Trigger broadcast from /ha-storage (revision {revision})")
                 broadcast_event("storage", "updated")
 
-                self._send_raw(200, json.dumps({"status": "ok"}).encode(), "application/json")
+                self._send_raw(200, json.dumps({"status": "ok", "revision": revision}).encode(), "application/json",
+                               {"ETag": STORAGE.etag})
+                return
+            except StorageConflictError as e:
+                event_log("[DEBUG] /ha-storage conflict: %s", e)
+                self._send_raw(412, json.dumps({"status": "conflict", "revision": e.current}).encode(), "application/json",
+                               {"ETag": STORAGE.etag})
                 return
             except Exception as e:
                 event_log(f"[ERROR] Fout in /ha-storage: {str(e)}")
@@ -143,38 +595,29 @@ class TimeLimitHandler(http.server.SimpleHTTPRequestHandler):
 
         # Route: proxy to TimeLimit API endpoints.
         # We bepalen eerst of we naar de geselecteerde server gaan
-        log(f"[DEBUG] Verzoek wordt doorgezet naar proxy: {SELECTED_SERVER}")
+        log("[DEBUG] Verzoek wordt doorgezet naar proxy: %s", SELECTED_SERVER)
         api = TimeLimitAPI(SELECTED_SERVER, verbose=is_verbose_logging())
         
-        routes = {
-            '/wizard-step1': '/auth/send-mail-login-code-v2',
-            '/wizard-step2': '/auth/sign-in-by-mail-code',
-            '/wizard-step3': '/parent/create-family',
-            '/wizard-login': '/parent/sign-in-into-family',
-            '/sync': '/sync/pull-status',
-            '/sync/push-actions': '/sync/push-actions',
-            '/generate-hashes': 'INTERNAL',
-            '/regenerate-hash': 'INTERNAL',
-            '/calculate-hmac': 'INTERNAL',
-            '/calculate-hmac-sha256': 'INTERNAL',
-            '/calculate-sha512': 'INTERNAL',
-            '/debug-integrity': 'INTERNAL',
-            '/get-token-device': 'INTERNAL'
-        }
         
         # Speciale afhandeling voor interne hashing
         if self.path.endswith('/generate-hashes'):
             log("[DEBUG] Interne hash generatie gestart")
-            from crypto_utils import generate_family_hashes
+            from crypto_utils import generate_family_hashes_parallel, BcryptBusyError, BcryptTimeoutError
             try:
                 data = json.loads(post_data)
-                log(f"[DEBUG] generate-hashes payload keys: {list(data.keys())}")
+                log("[DEBUG] generate-hashes payload keys: %s", list(data.keys()))
                 start_ts = time.time()
-                res = generate_family_hashes(data['password'])
+                res = generate_family_hashes_parallel(data['password'], client=self._client_id())
                 duration_ms = int((time.time() - start_ts) * 1000)
-                log(f"[DEBUG] generate-hashes duur: {duration_ms} ms")
+                log("[DEBUG] generate-hashes duur: %s ms", duration_ms)
                 log("[DEBUG] generate-hashes succesvol afgerond")
                 self._send_raw(200, json.dumps(res).encode(), "application/json")
+            except BcryptBusyError as e:
+                log(f"[ERROR] generate-hashes: {str(e)}")
+                self._send_raw(503, str(e).encode(), "text/plain", {"Retry-After": "1"})
+            except BcryptTimeoutError as e:
+                log(f"[ERROR] generate-hashes: {str(e)}")
+                self._send_raw(504, str(e).encode(), "text/plain")
             except Exception as e:
                 log(f"[ERROR] generate-hashes fout: {str(e)}")
                 self._send_raw(400, str(e).encode(), "text/plain")
@@ -183,16 +626,22 @@ class TimeLimitHandler(http.server.SimpleHTTPRequestHandler):
         # Nieuwe endpoint: regenereer secondHash met bestaande salt
         if self.path.endswith('/regenerate-hash'):
             log("[DEBUG] secondHash regeneratie gestart")
-            from crypto_utils import regenerate_second_hash
+            from crypto_utils import regenerate_second_hash_pooled, BcryptBusyError, BcryptTimeoutError
             try:
                 data = json.loads(post_data)
                 password = data['password']
                 second_salt = data['secondSalt']
                 
-                second_hash = regenerate_second_hash(password, second_salt)
-                log(f"[DEBUG] secondHash succesvol geregenereerd (first 30 chars): {second_hash[:30]}...")
+                second_hash = regenerate_second_hash_pooled(password, second_salt, client=self._client_id())
+                private_log("[DEBUG] secondHash succesvol geregenereerd (first 30 chars): %s...", second_hash[:30])
                 
                 self._send_raw(200, json.dumps({"secondHash": second_hash}).encode(), "application/json")
+            except BcryptBusyError as e:
+                log(f"[ERROR] Hash regeneratie: {str(e)}")
+                self._send_raw(503, json.dumps({"error": str(e)}).encode(), "application/json", {"Retry-After": "1"})
+            except BcryptTimeoutError as e:
+                log(f"[ERROR] Hash regeneratie: {str(e)}")
+                self._send_raw(504, json.dumps({"error": str(e)}).encode(), "application/json")
             except Exception as e:
                 log(f"[ERROR] Hash regeneratie fout: {str(e)}")
                 self._send_raw(400, json.dumps({"error": str(e)}).encode(), "application/json")
@@ -208,7 +657,7 @@ class TimeLimitHandler(http.server.SimpleHTTPRequestHandler):
                 message = data['message']
                 
                 result = calculate_hmac_sha512(key_base64, message)
-                log(f"[DEBUG] HMAC berekend: {result[:30]}...")
+                log("[DEBUG] HMAC berekend: %s...", result[:30])
                 
                 self._send_raw(200, json.dumps({"hash": result}).encode(), "application/json")
             except Exception as e:
@@ -225,7 +674,7 @@ class TimeLimitHandler(http.server.SimpleHTTPRequestHandler):
                 message = data['message']
 
                 result = calculate_sha512_hex(message)
-                log(f"[DEBUG] SHA512 berekend: {result[:30]}...")
+                log("[DEBUG] SHA512 berekend: %s...", result[:30])
 
                 self._send_raw(200, json.dumps({"hash": result}).encode(), "application/json")
             except Exception as e:
@@ -245,7 +694,7 @@ class TimeLimitHandler(http.server.SimpleHTTPRequestHandler):
                 encoded_action = data['encodedAction']
                 
                 result = calculate_hmac_sha256_binary(second_hash, sequence_number, device_id, encoded_action)
-                log(f"[DEBUG] HMAC-SHA256 berekend: {result[:50]}...")
+                log("[DEBUG] HMAC-SHA256 berekend: %s...", result[:50])
                 
                 self._send_raw(200, json.dumps({"integrity": result}).encode(), "application/json")
             except Exception as e:
@@ -253,10 +702,32 @@ class TimeLimitHandler(http.server.SimpleHTTPRequestHandler):
                 self._send_raw(400, str(e).encode(), "text/plain")
             return
         
+        # Batch variant: alle integrity strings voor een push-actions batch in één request
+        if self.path.endswith('/calculate-hmac-sha256-batch'):
+            from crypto_utils import calculate_hmac_sha256_binary_batch
+            try:
+                data = json.loads(post_data)
+                second_hash = data['secondHash']
+                items = data['items']
+                if not isinstance(items, list):
+                    raise ValueError("items must be a list")
+                log("[DEBUG] Server-side HMAC-SHA256 batch berekening gestart (%s acties)", len(items))
+
+                integrities = calculate_hmac_sha256_binary_batch(second_hash, items)
+                result = [
+                    {"sequenceNumber": item['sequenceNumber'], "integrity": integrity}
+                    for item, integrity in zip(items, integrities)
+                ]
+                self._send_raw(200, json.dumps({"integrities": result}).encode(), "application/json")
+            except Exception as e:
+                log(f"[ERROR] HMAC-SHA256 batch fout: {str(e)}")
+                self._send_raw(400, str(e).encode(), "text/plain")
+            return
+
         # DEBUG endpoint: uitgebreide integrity diagnostiek
         if self.path.endswith('/debug-integrity'):
             log("[DEBUG] === INTEGRITY DIAGNOSTIEK START ===")
-            from crypto_utils import calculate_hmac_sha256_binary, regenerate_second_hash
+            from crypto_utils import calculate_hmac_sha256_binary, regenerate_second_hash_pooled, BcryptBusyError
             import base64
             try:
                 data = json.loads(post_data)
@@ -267,39 +738,39 @@ class TimeLimitHandler(http.server.SimpleHTTPRequestHandler):
                 encoded_action = data.get('encodedAction')
                 provided_integrity = data.get('providedIntegrity')
                 
-                log(f"[DEBUG-INT] Password: {'*' * len(password) if password else 'MISSING'}")
-                log(f"[DEBUG-INT] SecondSalt: {second_salt}")
-                log(f"[DEBUG-INT] SequenceNumber: {sequence_number}")
-                log(f"[DEBUG-INT] DeviceId: '{device_id}' (length: {len(device_id)})")
-                log(f"[DEBUG-INT] EncodedAction length: {len(encoded_action)}")
-                log(f"[DEBUG-INT] ProvidedIntegrity: {provided_integrity}")
+                private_log("[DEBUG-INT] Password: %s", '*' * len(password) if password else 'MISSING')
+                private_log("[DEBUG-INT] SecondSalt: %s", second_salt)
+                private_log("[DEBUG-INT] SequenceNumber: %s", sequence_number)
+                private_log("[DEBUG-INT] DeviceId: '%s' (length: %s)", device_id, len(device_id))
+                private_log("[DEBUG-INT] EncodedAction length: %s", len(encoded_action))
+                private_log("[DEBUG-INT] ProvidedIntegrity: %s", provided_integrity)
                 
                 # Stap 1: Regenereer secondHash
-                second_hash = regenerate_second_hash(password, second_salt)
-                log(f"[DEBUG-INT] Regenerated secondHash: {second_hash}")
-                log(f"[DEBUG-INT] SecondHash as bytes: {second_hash.encode('utf-8')}")
+                second_hash = regenerate_second_hash_pooled(password, second_salt, client=self._client_id())
+                private_log("[DEBUG-INT] Regenerated secondHash: %s", second_hash)
+                private_log("[DEBUG-INT] SecondHash as bytes: %s", second_hash.encode('utf-8'))
                 
                 # Stap 2: Bereken HMAC
                 calculated_integrity = calculate_hmac_sha256_binary(
                     second_hash, sequence_number, device_id, encoded_action
                 )
-                log(f"[DEBUG-INT] Calculated integrity: {calculated_integrity}")
+                private_log("[DEBUG-INT] Calculated integrity: %s", calculated_integrity)
                 
                 # Stap 3: Vergelijk
                 match = (calculated_integrity == provided_integrity)
-                log(f"[DEBUG-INT] MATCH: {match}")
+                private_log("[DEBUG-INT] MATCH: %s", match)
                 
                 if not match:
-                    log("[DEBUG-INT] MISMATCH DETAILS:")
-                    log(f"[DEBUG-INT]   Expected: {calculated_integrity}")
-                    log(f"[DEBUG-INT]   Got:      {provided_integrity}")
+                    private_log("[DEBUG-INT] MISMATCH DETAILS:")
+                    private_log("[DEBUG-INT]   Expected: %s", calculated_integrity)
+                    private_log("[DEBUG-INT]   Got:      %s", provided_integrity)
                     
                     # Decodeer beide base64 strings en vergelijk bytes
                     if provided_integrity.startswith('password:'):
                         expected_bytes = base64.b64decode(calculated_integrity.split(':')[1])
                         provided_bytes = base64.b64decode(provided_integrity.split(':')[1])
-                        log(f"[DEBUG-INT]   Expected bytes (hex): {expected_bytes.hex()}")
-                        log(f"[DEBUG-INT]   Provided bytes (hex): {provided_bytes.hex()}")
+                        private_log("[DEBUG-INT]   Expected bytes (hex): %s", expected_bytes.hex())
+                        private_log("[DEBUG-INT]   Provided bytes (hex): %s", provided_bytes.hex())
                 
                 log("[DEBUG] === INTEGRITY DIAGNOSTIEK END ===")
                 
@@ -316,6 +787,9 @@ class TimeLimitHandler(http.server.SimpleHTTPRequestHandler):
                 }
                 
                 self._send_raw(200, json.dumps(response, indent=2).encode(), "application/json")
+            except BcryptBusyError as e:
+                log(f"[ERROR] Debug integrity: {str(e)}")
+                self._send_raw(503, json.dumps({"error": str(e)}).encode(), "application/json", {"Retry-After": "1"})
             except Exception as e:
                 import traceback
                 error_trace = traceback.format_exc()
@@ -324,6 +798,35 @@ class TimeLimitHandler(http.server.SimpleHTTPRequestHandler):
                 self._send_raw(400, json.dumps({"error": str(e), "trace": error_trace}).encode(), "application/json")
             return
         
+        # Route: hand signed push-actions to the outbox; the add-on delivers them to the server.
+        if self.path.endswith('/push-outbox'):
+            if not push_outbox_enabled():
+                self._send_raw(404, json.dumps({"error": "Outbox uitgeschakeld"}).encode(), "application/json")
+                return
+            try:
+                data = json.loads(post_data)
+                token = data.get('deviceAuthToken')
+                actions = data.get('actions')
+                if not token or not isinstance(actions, list):
+                    raise ValueError("deviceAuthToken en actions zijn verplicht")
+                accepted, duplicates = PUSH_OUTBOX.enqueue(SELECTED_SERVER, token, actions)
+                result = {"status": "queued", "accepted": accepted, "duplicates": duplicates, "depth": PUSH_OUTBOX.depth()}
+                self._send_raw(202, json.dumps(result).encode(), "application/json")
+            except Exception as e:
+                log(f"[ERROR] Fout in /push-outbox: {str(e)}")
+                self._send_raw(400, json.dumps({"error": str(e)}).encode(), "application/json")
+            return
+
+        # Queries on the indexed model of the last full pull-status, so the UI can fetch one slice.
+        if self.path.endswith('/family-model'):
+            try:
+                status, result = family_model_query(json.loads(post_data or b"{}"))
+                self._send_raw(status, json.dumps(result).encode(), "application/json")
+            except Exception as e:
+                log(f"[ERROR] Fout in /family-model: {str(e)}")
+                self._send_raw(400, json.dumps({"error": str(e)}).encode(), "application/json")
+            return
+
         # Endpoint om deviceId op te halen die hoort bij een token
         if self.path.endswith('/get-token-device'):
             log("[DEBUG] === TOKEN DEVICE LOOKUP START ===")
@@ -331,7 +834,7 @@ class TimeLimitHandler(http.server.SimpleHTTPRequestHandler):
                 data = json.loads(post_data)
                 device_auth_token = data.get('deviceAuthToken')
                 
-                log(f"[DEBUG] Looking up device for token: {device_auth_token[:10]}...")
+                private_log("[DEBUG] Looking up device for token: %s...", device_auth_token[:10])
                 
                 # Vraag aan server via pull-status (dit geeft ons de deviceId terug)
                 pull_request = {
@@ -345,10 +848,18 @@ class TimeLimitHandler(http.server.SimpleHTTPRequestHandler):
                     }
                 }
                 
-                status, body = api.post('/sync/pull-status', json.dumps(pull_request).encode())
+                # The device list of the last full sync is enough; only ask the server without one.
+                family = PULL_STATUS_CACHE.family_index(SELECTED_SERVER, device_auth_token)
+                if family is not None:
+                    status, body = 200, None
+                else:
+                    status, body = api.post('/sync/pull-status', json.dumps(pull_request).encode())
                 
                 if status == 200:
-                    response_data = json.loads(body)
+                    if family is not None:
+                        response_data = {"devices": {"data": list(family.devices_by_id.values())}}
+                    else:
+                        response_data = json.loads(body)
                     
                     # Zoek in devices.data naar het device dat deze token heeft
                     # Helaas bevat pull-status response geen deviceId field direct
@@ -356,17 +867,17 @@ class TimeLimitHandler(http.server.SimpleHTTPRequestHandler):
                     
                     if 'devices' in response_data and 'data' in response_data['devices']:
                         devices = response_data['devices']['data']
-                        log(f"[DEBUG] Found {len(devices)} devices in response")
+                        log("[DEBUG] Found %s devices in response", len(devices))
                         
                         for device in devices:
-                            log(f"[DEBUG] Device: {device.get('name')} - ID: {device.get('deviceId')}")
+                            log("[DEBUG] Device: %s - ID: %s", device.get('name'), device.get('deviceId'))
                         
                         # Probeer DashboardControl to vinden
                         dashboard_device = next((d for d in devices if 'Dashboard' in d.get('name', '')), None)
                         
                         if dashboard_device:
                             device_id = dashboard_device['deviceId']
-                            log(f"[DEBUG] Found dashboard device: {device_id}")
+                            log("[DEBUG] Found dashboard device: %s", device_id)
                             
                             result = {
                                 "deviceId": device_id,
@@ -405,137 +916,482 @@ class TimeLimitHandler(http.server.SimpleHTTPRequestHandler):
         target_path = '/sync/pull-status'  # Standaard
         matched_route = None
         
-        for ui_route, api_route in routes.items():
+        for ui_route, api_route in PROXY_ROUTES.items():
             if self.path.endswith(ui_route):
                 target_path = api_route
                 matched_route = ui_route
                 break
 
-        log(f"[DEBUG] === ROUTE MATCHING ===")
-        log(f"[DEBUG] Incoming path: {self.path}")
-        log(f"[DEBUG] Matched UI route: {matched_route}")
-        log(f"[DEBUG] Target API path: {target_path}")
-        log(f"[DEBUG] Final URL: {SELECTED_SERVER}{target_path}")
-        log(f"[DEBUG] POST data size: {content_length} bytes")
+        log("[DEBUG] === ROUTE MATCHING ===")
+        log("[DEBUG] Incoming path: %s", self.path)
+        log("[DEBUG] Matched UI route: %s", matched_route)
+        log("[DEBUG] Target API path: %s", target_path)
+        log("[DEBUG] Final URL: %s%s", SELECTED_SERVER, target_path)
+        log("[DEBUG] POST data size: %s bytes", content_length)
         
         # Log de eerste 500 bytes van de payload voor debugging (niet het hele wachtwoord!)
-        try:
-            preview_data = post_data[:500].decode('utf-8', errors='replace')
-            log(f"[DEBUG] Payload preview (first 500 bytes): {preview_data}")
-        except:
-            log("[DEBUG] Payload preview: (binary data)")
+        if is_verbose_logging():
+            try:
+                preview_data = post_data[:500].decode('utf-8', errors='replace')
+                private_log("[DEBUG] Payload preview (first 500 bytes): %s", preview_data)
+            except:
+                log("[DEBUG] Payload preview: (binary data)")
         
+        if self.streaming_responses and proxy_streaming_enabled() and not needs_buffered_proxy(target_path, post_data):
+            self._stream_proxy(api, target_path, post_data)
+            return
+
         try:
-            status, body = api.post(target_path, post_data)
-            log(f"[DEBUG] API Response status: {status}")
-            log(f"[DEBUG] API Response body size: {len(body)} bytes")
-            
+            if target_path == '/sync/pull-status':
+                token = request_token(post_data)
+                scheduled = server_sync_enabled() and token is not None
+                if scheduled:
+                    SYNC_SCHEDULER.touch(SELECTED_SERVER, token, post_data)
+                latest = None
+                # A sync the user asked for must reach upstream, not the scheduler's last pull.
+                manual = self.headers.get('X-Sync-Manual') == '1'
+                if scheduled and not manual and self.headers.get('X-Pull-Delta') != '1':
+                    latest = SYNC_SCHEDULER.latest(SELECTED_SERVER, token)
+                # Identical pull-status requests (same server, token and body) share one upstream call.
+                key = (SELECTED_SERVER, token, hashlib.sha256(post_data).hexdigest())
+                fetch = lambda: fetch_pull_status(api, post_data)
+                cacheable = lambda result: result[0] == 200
+                pushes = SYNC_SCHEDULER.push_generation(SELECTED_SERVER, token) if scheduled else None
+                stale = None
+                if latest is None and api.circuit().state != "closed":
+                    stale = PULL_STATUS_FLIGHTS.stale(key)
+                if latest is not None:
+                    # The scheduler's last pull is current: no upstream call for this dashboard.
+                    result, flight = (200, latest[0], None, None, None), "scheduler"
+                elif stale is not None:
+                    # Upstream is failing: answer from the last good response and retry in the background.
+                    PULL_STATUS_FLIGHTS.refresh(key, fetch, cacheable)
+                    result, flight = stale, "stale"
+                else:
+                    result, flight = PULL_STATUS_FLIGHTS.do(key, fetch, cacheable)
+                    if result[0] >= 500:
+                        stale = PULL_STATUS_FLIGHTS.stale(key)
+                        if stale is not None:
+                            result, flight = stale, "stale"
+                status, body, encoding, merged, cache_state = result
+                log("[DEBUG] Pull-status single-flight: %s", flight)
+                sync_digest = latest[1] if latest is not None else None
+                if scheduled and flight == "leader" and merged is not None:
+                    sync_digest = SYNC_SCHEDULER.record(SELECTED_SERVER, token, merged[0], pushes)
+                elif scheduled and status == 401:
+                    SYNC_SCHEDULER.forget(SELECTED_SERVER, token)
+            else:
+                status, body, encoding = api.post_raw(target_path, post_data)
+                merged, cache_state, flight, sync_digest = None, None, None, None
+            log("[DEBUG] API Response status: %s", status)
+            log("[DEBUG] API Response body size: %s bytes (encoding: %s)", len(body), encoding or 'identity')
+
+            client_gzip = accepts_gzip(self.headers.get('Accept-Encoding'))
+
             # Log de response preview
-            try:
-                body_preview = body[:500].decode('utf-8', errors='replace')
-                log(f"[DEBUG] Response preview (first 500 bytes): {body_preview}")
-            except:
-                log("[DEBUG] Response preview: (binary data)")
+            if encoding is None and is_verbose_logging():
+                try:
+                    body_preview = body[:500].decode('utf-8', errors='replace')
+                    private_log("[DEBUG] Response preview (first 500 bytes): %s", body_preview)
+                except:
+                    log("[DEBUG] Response preview: (binary data)")
             
-            if self.path.endswith('/sync/push-actions') and 200 <= status < 300:
-                event_log("[EVENT] Trigger broadcast from /sync/push-actions")
-                broadcast_event("push", "done")
-            self._send_raw(status, body, "application/json")
+            self._after_proxy(status, post_data)
+
+            extra_headers = {"Vary": "Accept-Encoding"}
+            if flight is not None:
+                extra_headers["X-Pull-Status-Flight"] = flight
+                fingerprint = SYNC_SCHEDULER.fingerprint(SELECTED_SERVER, token)
+                if fingerprint is not None:
+                    extra_headers["X-Sync-Scheduler"] = fingerprint
+                if sync_digest is not None:
+                    extra_headers["X-Pull-Status-Digest"] = sync_digest
+            if flight == "stale":
+                extra_headers["Warning"] = '110 - "Response is Stale"'
+            elif status == 503:
+                retry_after = api.circuit().retry_after()
+                if retry_after:
+                    extra_headers["Retry-After"] = str(retry_after)
+            if merged is not None:
+                full_body, delta_body = merged
+                log("[DEBUG] Pull-status cache %s: upstream %s bytes, merged %s bytes", cache_state, len(delta_body), len(full_body))
+                # Clients that keep their own copy can ask for just the upstream delta.
+                if self.headers.get('X-Pull-Delta') == '1':
+                    body = delta_body
+                    extra_headers.update({"X-Pull-Status-Cache": cache_state, "X-Pull-Status-Mode": "delta"})
+                else:
+                    body = full_body
+                    extra_headers.update({"X-Pull-Status-Cache": cache_state, "X-Pull-Status-Mode": "full"})
+
+            body, content_encoding = PROXY_COMPRESSION.encode(body, encoding, client_gzip)
+            if content_encoding:
+                extra_headers["Content-Encoding"] = content_encoding
+            self._send_raw(status, body, "application/json", extra_headers)
         except Exception as e:
             log(f"[ERROR] PROXY: {str(e)}")
             import traceback
             log(f"Traceback:\n{traceback.format_exc()}")
             self._send_raw(500, b"Proxy connection failed", "text/plain")
 
+    @metered
     def do_GET(self):
         # ... (do_GET blijft hetzelfde als in jouw code) ...
         load_logging_mode()
+        # Serve UI version from config
+        if self.path.endswith('/ui-version'):
+            try:
+                config = get_config()
+                version = config.get('version', 'unknown')
+                self._send_raw(200, json.dumps({'version': version}).encode(), 'application/json')
+            except Exception as e:
+                self._send_raw(500, str(e).encode(), 'text/plain')
+            return
+        # Route: server-sent events stream; one open connection instead of repeated long-polls.
+        if '/ha-events-stream' in self.path:
+            self._serve_event_stream()
+            return
         # Route: long-poll events for cross-device updates.
         if '/ha-events-longpoll' in self.path:
             try:
-                parsed = urllib.parse.urlparse(self.path)
-                params = urllib.parse.parse_qs(parsed.query)
-                since_raw = params.get('since', ['0'])[0]
-                timeout_raw = params.get('timeout', ['25'])[0]
-                try:
-                    since_id = int(since_raw)
-                except Exception:
-                    since_id = 0
-                try:
-                    timeout_s = int(timeout_raw)
-                except Exception:
-                    timeout_s = 25
-                if timeout_s < 1:
-                    timeout_s = 1
-                if timeout_s > 30:
-                    timeout_s = 30
+                since_id, timeout_s = parse_longpoll_params(self.path)
 
                 with LONGPOLL_COND:
-                    last_id = LONGPOLL_LAST_EVENT["id"]
-                    if last_id > since_id and LONGPOLL_LAST_EVENT["event"]:
-                        payload = {
-                            "status": "event",
-                            "id": last_id,
-                            "event": LONGPOLL_LAST_EVENT["event"],
-                            "data": LONGPOLL_LAST_EVENT["data"],
-                            "ts": LONGPOLL_LAST_EVENT["ts"]
-                        }
-                    else:
-                        LONGPOLL_COND.wait(timeout=timeout_s)
-                        last_id = LONGPOLL_LAST_EVENT["id"]
-                        if last_id > since_id and LONGPOLL_LAST_EVENT["event"]:
-                            payload = {
-                                "status": "event",
-                                "id": last_id,
-                                "event": LONGPOLL_LAST_EVENT["event"],
-                                "data": LONGPOLL_LAST_EVENT["data"],
-                                "ts": LONGPOLL_LAST_EVENT["ts"]
-                            }
-                        else:
-                            payload = {"status": "timeout", "id": last_id}
+                    since_id = EVENT_JOURNAL.resolve(since_id)
+                    payload = longpoll_payload_locked(since_id)
+                    if payload is None:
+                        wait_on_longpoll_locked(timeout_s)
+                        payload = longpoll_payload_locked(since_id, timed_out=True)
 
                 self._send_raw(200, json.dumps(payload).encode(), "application/json")
             except Exception as e:
                 log(f"[ERROR] Fout in /ha-events-longpoll: {str(e)}")
                 self._send_raw(500, str(e).encode(), "text/plain")
             return
+        if self.path.endswith('/push-outbox'):
+            self._send_raw(200, json.dumps(PUSH_OUTBOX.stats()).encode(), "application/json")
+            return
+        if self.path.endswith('/servers'):
+            payload = {"mode": SERVER_MODE, "selected": SELECTED_SERVER, "registry": SERVER_REGISTRY.stats()}
+            self._send_raw(200, json.dumps(payload).encode(), "application/json")
+            return
+        if self.path.endswith('/worker-stats'):
+            self._send_raw(200, json.dumps(worker_stats()).encode(), "application/json")
+            return
+        if self.path.endswith('/upstream-stats'):
+            stats = {
+                "pools": get_connection_pool_stats(),
+                "pullStatusCache": PULL_STATUS_CACHE.stats(),
+                "pullStatusFlights": PULL_STATUS_FLIGHTS.stats(),
+                "syncScheduler": SYNC_SCHEDULER.stats(),
+                "pushOutbox": PUSH_OUTBOX.stats(),
+                "compression": PROXY_COMPRESSION.stats()
+            }
+            self._send_raw(200, json.dumps(stats).encode(), "application/json")
+            return
+        if self.path.endswith('/metrics'):
+            self._send_raw(200, metrics.render().encode(), "text/plain; version=0.0.4; charset=utf-8")
+            return
+        if urllib.parse.urlparse(self.path).path.endswith('/logs'):
+            self._send_raw(200, json.dumps(logs_payload(self.path)).encode(), "application/json")
+            return
+        if self.path.endswith('/crypto-stats'):
+            from crypto_utils import get_bcrypt_engine, SECOND_HASH_CACHE, BCRYPT_FLIGHTS
+            stats = {
+                "bcrypt": get_bcrypt_engine().stats(),
+                "secondHashCache": SECOND_HASH_CACHE.stats(),
+                "flights": BCRYPT_FLIGHTS.stats()
+            }
+            self._send_raw(200, json.dumps(stats).encode(), "application/json")
+            return
         if self.path.endswith('/ha-storage'):
             try:
-                if os.path.exists(STORAGE_PATH):
-                    with open(STORAGE_PATH, 'r') as f:
-                        data = json.load(f)
+                # Serialized bytes are cached per revision; clients that already hold them get a 304.
+                body, etag = STORAGE.serialized()
+                headers = {"ETag": etag, "Cache-Control": "no-cache"}
+                if etag_matches(self.headers.get('If-None-Match'), etag):
+                    self._send_raw(304, b"", "application/json", headers)
                 else:
-                    data = {"status": "empty"}
-                self._send_raw(200, json.dumps(data).encode(), "application/json")
+                    self._send_raw(200, body, "application/json", headers)
             except Exception as e:
                 event_log(f"[ERROR] Fout in GET /ha-storage: {str(e)}")
                 self._send_raw(500, str(e).encode(), "text/plain")
             return
-        if self.path in ['/', '', '/index.html']:
-            try:
-                config = get_config()
-                if not os.path.exists(HTML_PATH):
-                    self.send_error(404, "Dashboard HTML niet gevonden")
-                    return
-                with open(HTML_PATH, 'r', encoding='utf-8') as f:
-                    html = f.read()
-                    self._send_raw(200, html.encode('utf-8'), "text/html")
-            except Exception as e:
-                self.send_error(500, f"Server Error: {str(e)}")
+        # Static assets come from the in-memory table (gzip, ETag, content-hash URLs).
+        asset, immutable = STATIC_ASSETS.lookup(self.path)
+        if asset is not None:
+            self._send_asset(asset, immutable)
+            return
+        if self.path in INDEX_ROUTES:
+            # The index is only missing from the table when the dashboard HTML was not found.
+            self.send_error(404, "Dashboard HTML niet gevonden")
         else:
             super().do_GET()
 
-    def _send_raw(self, status, body, content_type):
+    def _send_asset(self, asset, immutable):
+        """Serve a cached asset with conditional GET and gzip negotiation."""
+        cache_control = CACHE_FOREVER if immutable else CACHE_REVALIDATE
+        try:
+            if asset.matches(self.headers.get('If-None-Match')):
+                self.send_response(304)
+                self.send_header("ETag", asset.etag)
+                self.send_header("Cache-Control", cache_control)
+                self.send_header("Vary", "Accept-Encoding")
+                self.end_headers()
+                return
+            body, etag, encoding = asset.select(self.headers.get('Accept-Encoding'))
+            headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+            if encoding:
+                headers["Content-Encoding"] = encoding
+            self._send_raw(200, body, asset.content_type, headers)
+        except Exception as e:
+            log(f"Response Error: {str(e)}")
+
+    def copyfile(self, source, outputfile):
+        """Files outside the asset table are sent with sendfile when we own a real socket."""
+        if getattr(self.connection, 'sendfile', None) is not None:
+            self.connection.sendfile(source)
+        else:
+            super().copyfile(source, outputfile)
+
+    def _serve_event_stream(self):
+        """Keep the connection open and write journal events as text/event-stream frames."""
+        cursor = parse_stream_cursor(self.path, self.headers.get('Last-Event-ID'))
+        self.close_connection = True
+        try:
+            self.send_response(200)
+            self.send_header("Content-type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("X-Accel-Buffering", "no")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            with LONGPOLL_COND:
+                opening, cursor = stream_open_frame_locked(cursor)
+            self.wfile.write(opening)
+            self.wfile.flush()
+            while True:
+                with LONGPOLL_COND:
+                    frames, cursor = stream_frames_locked(cursor)
+                    if not frames:
+                        wait_on_longpoll_locked(SSE_HEARTBEAT_S)
+                        frames, cursor = stream_frames_locked(cursor)
+                self.wfile.write(frames or b": heartbeat\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+            log("[DEBUG] Event stream gesloten door client")
+        except Exception as e:
+            log(f"[ERROR] Fout in /ha-events-stream: {str(e)}")
+
+    def _client_id(self):
+        return fairness_client(self.headers.get('X-Forwarded-For'), self.client_address[0])
+
+    def _after_proxy(self, status, post_data):
+        if status >= 500 and SERVER_MODE == "auto":
+            # Do not wait for the next probe round to find out whether to fail over.
+            SERVER_REGISTRY.probe_soon()
+        if self.path.endswith('/sync/push-actions') and 200 <= status < 300:
+            after_push_actions(SELECTED_SERVER, request_token(post_data))
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"".join((b"%x\r\n" % len(data), data, b"\r\n")))
+        self._metrics_bytes_out += len(data)
+
+    def _write_plain(self, data):
+        self.wfile.write(data)
+        self._metrics_bytes_out += len(data)
+
+    def _stream_proxy(self, api, target_path, post_data):
+        """Forward the upstream answer chunk by chunk, so memory use does not grow with the body size.
+
+        Compression follows PROXY_COMPRESSION like buffered responses: a body passed on unchanged
+        keeps the upstream Content-Length, a body that is gzipped or inflated on the fly is sent chunked.
+        """
+        try:
+            stream = api.post_stream(target_path, post_data)
+        except Exception as e:
+            log(f"[ERROR] PROXY: {str(e)}")
+            import traceback
+            log(f"Traceback:\n{traceback.format_exc()}")
+            self._send_raw(500, b"Proxy connection failed", "text/plain")
+            return
+        log("[DEBUG] API Response status: %s (streamed, length: %s, encoding: %s)",
+            stream.status, stream.length, stream.encoding or 'identity')
+        encoder = PROXY_COMPRESSION.stream_encoder(
+            stream.encoding, accepts_gzip(self.headers.get('Accept-Encoding')), stream.length)
+        headers = {"Vary": "Accept-Encoding"}
+        if encoder.content_encoding:
+            headers["Content-Encoding"] = encoder.content_encoding
+        if stream.status == 503:
+            retry_after = api.circuit().retry_after()
+            if retry_after:
+                headers["Retry-After"] = str(retry_after)
+        chunked = not encoder.keeps_length or stream.length is None
+        if chunked and self.request_version != "HTTP/1.1":
+            # HTTP/1.0 clients get a body delimited by closing the connection.
+            chunked = False
+            self.close_connection = True
+            headers["Connection"] = "close"
+
+        buffer = acquire_stream_buffer()
+        try:
+            self.send_response(stream.status)
+            self.send_header("Content-type", "application/json")
+            if chunked:
+                self.send_header("Transfer-Encoding", "chunked")
+            elif encoder.keeps_length and stream.length is not None:
+                self.send_header("Content-Length", str(stream.length))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            # Content-Length was already counted by send_header.
+            self._metrics_bytes_out = 0
+            write = self._write_chunk if chunked else self._write_plain
+
+            for chunk in stream.chunks(buffer):
+                for data in encoder.feed(chunk, STREAM_CHUNK_SIZE):
+                    write(data)
+            tail = encoder.finish()
+            if tail:
+                write(tail)
+            if chunked:
+                self.wfile.write(b"0\r\n\r\n")
+        except Exception as e:
+            # Headers are already out; the client can only notice a cut-off body.
+            self.close_connection = True
+            log(f"[ERROR] PROXY stream: {str(e)}")
+        finally:
+            stream.close()
+            release_stream_buffer(buffer)
+        self._after_proxy(stream.status, post_data)
+
+    def _send_raw(self, status, body, content_type, extra_headers=None):
         try:
             self.send_response(status)
             self.send_header("Content-type", content_type)
             self.send_header("Content-Length", str(len(body)))
+            for key, value in (extra_headers or {}).items():
+                self.send_header(key, value)
             self.end_headers()
             self.wfile.write(body)
         except Exception as e:
             log(f"Response Error: {str(e)}")
 
+# Flow: asyncio mode keeps long-poll waiters on the event loop and runs all other routes on executor lanes.
+ASYNC_LONGPOLL_NOTIFIER = None
+
+def is_longpoll_request(request):
+    return request.method == "GET" and '/ha-events-longpoll' in request.path
+
+def is_event_stream_request(request):
+    return request.method == "GET" and '/ha-events-stream' in request.path
+
+def async_lane_for(request):
+    """Route bcrypt-heavy endpoints to their own executor lane so they cannot block proxy traffic.
+
+    Lanes without an executor of their own (proxy, static) share the default one.
+    """
+    return request_lane(request.method, request.path)
+
+async def async_longpoll(request, writer):
+    """Long-poll handler for asyncio mode: waits on the loop instead of holding a thread."""
+    from async_server import send_response
+    started = time.monotonic()
+    try:
+        since_id, timeout_s = parse_longpoll_params(request.path)
+        with LONGPOLL_COND:
+            since_id = EVENT_JOURNAL.resolve(since_id)
+            payload = longpoll_payload_locked(since_id)
+        if payload is None:
+            await ASYNC_LONGPOLL_NOTIFIER.wait(timeout_s)
+            with LONGPOLL_COND:
+                payload = longpoll_payload_locked(since_id, timed_out=True)
+        status, body, content_type = 200, json.dumps(payload).encode(), "application/json"
+    except Exception as e:
+        log(f"[ERROR] Fout in /ha-events-longpoll: {str(e)}")
+        status, body, content_type = 500, str(e).encode(), "text/plain"
+    metrics.record_request('/ha-events-longpoll', "GET", status, time.monotonic() - started, 0, len(body))
+    return await send_response(writer, status, body, content_type, request.keep_alive)
+
+async def async_event_stream(request, writer):
+    """Server-sent events handler for asyncio mode; the connection is closed when the client leaves."""
+    cursor = parse_stream_cursor(request.path, request.headers.get('Last-Event-ID'))
+    try:
+        with LONGPOLL_COND:
+            opening, cursor = stream_open_frame_locked(cursor)
+        writer.write((
+            "HTTP/1.1 200 OK\r\n"
+            "Content-type: text/event-stream\r\n"
+            "Cache-Control: no-cache\r\n"
+            "X-Accel-Buffering: no\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode() + opening)
+        await writer.drain()
+        while True:
+            with LONGPOLL_COND:
+                frames, cursor = stream_frames_locked(cursor)
+            if not frames:
+                await ASYNC_LONGPOLL_NOTIFIER.wait(SSE_HEARTBEAT_S)
+                with LONGPOLL_COND:
+                    frames, cursor = stream_frames_locked(cursor)
+            writer.write(frames or b": heartbeat\n\n")
+            await writer.drain()
+    except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+        log("[DEBUG] Event stream gesloten door client")
+    except Exception as e:
+        log(f"[ERROR] Fout in /ha-events-stream: {str(e)}")
+    return False
+
+def run_async_server(server_address):
+    global ASYNC_LONGPOLL_NOTIFIER
+    from async_server import AsyncHTTPServer, AsyncNotifier
+    ASYNC_LONGPOLL_NOTIFIER = AsyncNotifier()
+    EVENT_LISTENERS.append(ASYNC_LONGPOLL_NOTIFIER.notify)
+    server = AsyncHTTPServer(
+        server_address,
+        TimeLimitHandler,
+        native_routes=[
+            (is_longpoll_request, async_longpoll),
+            (is_event_stream_request, async_event_stream)
+        ],
+        lane_for=async_lane_for
+    )
+    server.add_notifier(ASYNC_LONGPOLL_NOTIFIER)
+    log("=== TimeLimit v60: Asyncio Backend met Server-Switch ===")
+    server.serve_forever()
+
+def run_threaded_server(server_address):
+    global HTTP_SERVER
+    workers = int(get_config().get("worker_threads") or DEFAULT_WORKERS)
+    max_streams = int(get_config().get("max_event_streams") or DEFAULT_MAX_STREAMS)
+    lanes = dict(DEFAULT_LANES, longpoll=(max_streams,) + DEFAULT_LANES["longpoll"][1:])
+    with PooledHTTPServer(server_address, TimeLimitHandler, lane_for=request_lane, workers=workers, lanes=lanes) as httpd:
+        HTTP_SERVER = httpd
+        log(f"=== TimeLimit v60: Multi-threaded Backend met Server-Switch ({workers} workers, max {max_streams} event streams) ===")
+        httpd.serve_forever()
+
+def shutdown(signum, frame):
+    # s6 stops the service with SIGTERM; exit normally so pending storage writes are flushed.
+    raise SystemExit(0)
+
+def main(port=8099):
+    atexit.register(STORAGE.flush)
+    atexit.register(EVENT_JOURNAL.flush)
+    signal.signal(signal.SIGTERM, shutdown)
+    load_logging_mode()
+    STATIC_ASSETS.load()
+    load_server_candidates()
+    SERVER_REGISTRY.start()
+    if server_sync_enabled():
+        SYNC_SCHEDULER.start()
+    if push_outbox_enabled():
+        PUSH_OUTBOX.load()
+        PUSH_OUTBOX.start()
+    if get_config().get("persist_events", False):
+        with LONGPOLL_COND:
+            EVENT_JOURNAL.enable_persistence(EVENTS_PATH)
+    if get_config().get("server_mode", "threaded") == "asyncio":
+        run_async_server(("", port))
+    else:
+        run_threaded_server(("", port))
+
 if __name__ == "__main__":
-    with ThreadedHTTPServer(("", 8099), TimeLimitHandler) as httpd:
-        log("=== TimeLimit v60: Multi-threaded Backend met Server-Switch ===")
-        httpd.serve_forever()
\ No newline at end of file
+    main()
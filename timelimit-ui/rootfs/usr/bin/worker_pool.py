@@ -0,0 +1,307 @@
+"""Threaded HTTP server core with a fixed worker pool and per-lane admission control."""
+
+import json
+import queue
+import select
+import socketserver
+import threading
+import time
+
+import log_sink
+import metrics
+
+# Flow: accepted connections wait in a bounded backlog for one of a fixed set of worker threads;
+# every request then needs a slot in its lane (long-poll, proxy, crypto, static) or gets a fast 503.
+DEFAULT_WORKERS = 32
+DEFAULT_MAX_PENDING = 64
+# Open event streams and long-polls at once; they run on threads of their own, not on pool workers.
+DEFAULT_MAX_STREAMS = 256
+# Lane name -> (concurrent requests, queued requests, Retry-After seconds).
+# Each pooled lane's slots plus queue stay below DEFAULT_WORKERS, so no single lane can take every worker.
+DEFAULT_LANES = {
+    "longpoll": (DEFAULT_MAX_STREAMS, 0, 5),
+    "proxy": (6, 6, 1),
+    # Crypto requests only wait here; the bcrypt engine limits the CPU they use and queues them fairly.
+    "crypto": (8, 0, 2),
+    "static": (4, 4, 1),
+}
+# Requests admitted to these lanes wait for minutes; their worker leaves the pool and a new one replaces it.
+DETACHED_LANES = ("longpoll",)
+LANE_QUEUE_TIMEOUT = 10.0
+# Idle keep-alive connections are closed after this many seconds so they do not hold a worker;
+# while idle they are checked every IDLE_POLL_INTERVAL seconds for connections waiting on a worker.
+KEEPALIVE_IDLE_TIMEOUT = 30
+IDLE_POLL_INTERVAL = 0.5
+# Request bodies up to this size are read before a 503, so closing the socket does not reset it.
+SHED_DRAIN_LIMIT = 1024 * 1024
+
+_POOL_FULL_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Content-Length: 29\r\n"
+    b"Retry-After: 1\r\n"
+    b"Connection: close\r\n\r\n"
+    b'{"error":"server overloaded"}'
+)
+
+metrics.describe("timelimit_requests_shed_total", "Requests answered with 503 because their lane or the worker pool was full.")
+
+
+def _log(message):
+    log_sink.write(message)
+
+
+class Lane:
+    def __init__(self, name, limit, queue_limit, retry_after=1, queue_timeout=LANE_QUEUE_TIMEOUT):
+        """Admit at most limit concurrent requests; queue_limit more may wait up to queue_timeout."""
+        self.name = name
+        self.limit = limit
+        self.queue_limit = queue_limit
+        self.retry_after = retry_after
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+        self._stats = {"admitted": 0, "queued": 0, "rejected": 0, "timeouts": 0}
+
+    def acquire(self):
+        """Take a slot; returns False when the lane is saturated (caller answers 503)."""
+        with self._cond:
+            if self.active < self.limit:
+                self.active += 1
+                self._stats["admitted"] += 1
+                return True
+            if self.waiting >= self.queue_limit:
+                self._stats["rejected"] += 1
+                return False
+            self.waiting += 1
+            self._stats["queued"] += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            self._stats["admitted"] += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            data = dict(self._stats)
+            data.update({"active": self.active, "waiting": self.waiting, "limit": self.limit, "queueLimit": self.queue_limit})
+        return data
+
+
+class WorkerPool:
+    def __init__(self, workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING):
+        """Fixed number of threads running submitted calls; at most max_pending calls wait."""
+        self.workers = workers
+        self._queue = queue.Queue(max_pending)
+        self._busy = 0
+        self._detached = 0
+        self._started = 0
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stats = {"submitted": 0, "rejected": 0, "detaches": 0}
+
+    def start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f"http-worker-{self._started}", daemon=True)
+                self._started += 1
+                self._threads.append(thread)
+                thread.start()
+
+    def detach(self):
+        """Hand the calling worker's place in the pool to a new thread; the caller exits after its call.
+
+        Returns False when the caller is not a pool worker (e.g. it was detached already).
+        """
+        current = threading.current_thread()
+        with self._lock:
+            if current not in self._threads:
+                return False
+            self._threads.remove(current)
+            self._detached += 1
+            self._stats["detaches"] += 1
+        self.start()
+        return True
+
+    def submit(self, fn, *args):
+        """Queue fn(*args) for a worker; returns False when the backlog is full."""
+        try:
+            self._queue.put_nowait((fn, args))
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected"] += 1
+            return False
+        with self._lock:
+            self._stats["submitted"] += 1
+        return True
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        current = threading.current_thread()
+        while True:
+            fn, args = self._queue.get()
+            with self._lock:
+                self._busy += 1
+            try:
+                fn(*args)
+            except Exception as e:
+                _log(f"[ERROR] Worker error: {str(e)}")
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                    detached = current not in self._threads
+                    if detached:
+                        self._detached -= 1
+            if detached:
+                return
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data.update({"workers": len(self._threads), "busy": self._busy - self._detached, "detached": self._detached})
+        data["pending"] = self._queue.qsize()
+        return data
+
+
+class _PooledRequestMixin:
+    """Admits every request through its lane and gives idle keep-alive connections back under load."""
+
+    timeout = KEEPALIVE_IDLE_TIMEOUT
+
+    def handle(self):
+        self.close_connection = True
+        self._handle_admitted()
+        while not self.close_connection and self._wait_for_next_request():
+            self._handle_admitted()
+
+    def _peek(self):
+        """Buffered or readable request bytes, without blocking (b"" when none or on EOF)."""
+        self.connection.setblocking(False)
+        try:
+            return self.rfile.peek(1)
+        except OSError:
+            return b""
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def _wait_for_next_request(self):
+        """Return True when the keep-alive client sent its next request.
+
+        Returns False when it stayed idle too long, went away, or when other connections are
+        waiting for a worker: then this connection is closed to free the worker.
+        """
+        if self._peek():
+            return True
+        deadline = time.monotonic() + KEEPALIVE_IDLE_TIMEOUT
+        while not self.server.pool.pending():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if select.select([self.connection], [], [], min(remaining, IDLE_POLL_INTERVAL))[0]:
+                # Readable without data means the client closed the connection.
+                return bool(self._peek())
+        return False
+
+    def _handle_admitted(self):
+        self._lane = None
+        try:
+            self.handle_one_request()
+        finally:
+            if self._lane is not None:
+                self._lane.release()
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        lane = self.server.lanes.get(self.server.lane_for(self.command, self.path))
+        if lane is None:
+            return True
+        if lane.acquire():
+            self._lane = lane
+            if lane.name in self.server.detached_lanes:
+                self.server.pool.detach()
+            return True
+        self._shed(lane)
+        return False
+
+    def _shed(self, lane):
+        metrics.inc("timelimit_requests_shed_total", {"lane": lane.name})
+        length = int(self.headers.get('Content-Length') or 0)
+        if 0 < length <= SHED_DRAIN_LIMIT:
+            self.rfile.read(length)
+        body = json.dumps({"error": "server busy", "lane": lane.name, "retryAfter": lane.retry_after}).encode()
+        self.send_response(503)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Retry-After", str(lane.retry_after))
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+        self.close_connection = True
+
+
+class PooledHTTPServer(socketserver.TCPServer):
+    allow_reuse_address = True
+    # Every open dashboard reconnects its long-poll at once after an event; the default backlog of 5 drops SYNs.
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, lane_for=None, workers=DEFAULT_WORKERS,
+                 max_pending=DEFAULT_MAX_PENDING, lanes=None, detached_lanes=DETACHED_LANES):
+        """Initialize the server.
+
+        Args:
+            server_address: (host, port) tuple
+            handler_class: BaseHTTPRequestHandler subclass used for all requests
+            lane_for: callable(method, path) returning the lane name of a request
+            workers: number of worker threads (connections handled at once)
+            max_pending: accepted connections that may wait for a worker before a 503
+            lanes: dict lane name -> (limit, queue limit, Retry-After seconds)
+            detached_lanes: lanes whose requests run on a thread of their own instead of a worker
+        """
+        pooled_handler_class = type(f"Pooled{handler_class.__name__}", (_PooledRequestMixin, handler_class), {})
+        super().__init__(server_address, pooled_handler_class)
+        self.lane_for = lane_for or (lambda method, path: None)
+        self.lanes = {
+            name: Lane(name, limit, queue_limit, retry_after)
+            for name, (limit, queue_limit, retry_after) in (lanes or DEFAULT_LANES).items()
+        }
+        self.detached_lanes = frozenset(detached_lanes)
+        self.pool = WorkerPool(workers, max_pending)
+        self.pool.start()
+
+    def process_request(self, request, client_address):
+        if not self.pool.submit(self._process, request, client_address):
+            # Answered from the accept thread; a few bytes on a new socket never block.
+            metrics.inc("timelimit_requests_shed_total", {"lane": "pool"})
+            try:
+                request.sendall(_POOL_FULL_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def stats(self):
+        return {"pool": self.pool.stats(), "lanes": {name: lane.stats() for name, lane in self.lanes.items()}}
@@ -0,0 +1,63 @@
+import http.server
+import socketserver
+import threading
+
+import api_client
+from api_client import TimeLimitAPI
+
+
+class _Upstream(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def _start_upstream():
+    """Upstream that answers the first request and drops the connection after reading the second."""
+    seen = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            seen.append(self.path)
+            if len(seen) == 2:
+                # The request arrived (and may have been applied), but the answer is lost.
+                self.close_connection = True
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+    server = _Upstream(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, seen, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _call_twice(path):
+    server, seen, url = _start_upstream()
+    try:
+        api = TimeLimitAPI(url, verbose=False)
+        assert api.post_raw(path, b"{}")[0] == 200
+        status = api.post_raw(path, b"{}")[0]
+    finally:
+        api_client.reset_connection_pools()
+        server.shutdown()
+        server.server_close()
+    return status, seen
+
+
+def test_push_actions_are_not_resent_after_the_request_went_out():
+    status, seen = _call_twice("/sync/push-actions")
+    assert status == 500
+    assert seen == ["/sync/push-actions"] * 2
+
+
+def test_pull_status_is_retried_on_a_new_connection():
+    status, seen = _call_twice("/sync/pull-status")
+    assert status == 200
+    assert seen == ["/sync/pull-status"] * 3
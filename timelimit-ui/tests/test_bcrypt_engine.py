@@ -0,0 +1,26 @@
+import os
+import signal
+import time
+
+import bcrypt
+
+from crypto_utils import BcryptEngine
+
+
+def test_engine_replaces_a_pool_with_a_killed_worker():
+    engine = BcryptEngine(workers=1, timeout=60)
+    salt = bcrypt.gensalt(rounds=4)
+    expected = bcrypt.hashpw(b"geheim", salt)
+    assert engine.hashpw(b"geheim", salt) == expected
+
+    broken = engine._executor
+    for process in list(broken._processes.values()):
+        os.kill(process.pid, signal.SIGKILL)
+    deadline = time.monotonic() + 10
+    while not broken._broken and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert engine.hashpw(b"geheim", salt) == expected
+    assert engine._executor is not broken
+    assert engine.stats()["poolRestarts"] == 1
+    engine._executor.shutdown()
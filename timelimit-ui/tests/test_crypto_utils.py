@@ -0,0 +1,10 @@
+import concurrent.futures
+
+from crypto_utils import generate_family_hashes_parallel
+
+
+def test_concurrent_family_hashes_get_their_own_salts():
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        first, second = executor.map(lambda client: generate_family_hashes_parallel("geheim", client), ["a", "b"])
+    assert first["secondSalt"] != second["secondSalt"]
+    assert first["hash"] != second["hash"]
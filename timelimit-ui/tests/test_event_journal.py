@@ -0,0 +1,92 @@
+from event_journal import EventJournal
+import web_server
+
+
+def _journal_with_events(count):
+    journal = EventJournal(capacity=16)
+    for index in range(count):
+        journal.append("storage", f"write-{index}")
+    return journal
+
+
+def test_fresh_client_starts_at_head_without_backlog():
+    journal = _journal_with_events(5)
+    cursor = journal.resolve(None)
+    assert cursor == 5
+    assert journal.since(cursor) == ([], False)
+
+
+def test_fresh_client_receives_events_after_first_contact():
+    journal = _journal_with_events(5)
+    cursor = journal.resolve(None)
+    journal.append("push", "done")
+    events, gap = journal.since(cursor)
+    assert [e["data"] for e in events] == ["done"]
+    assert not gap
+
+
+def test_known_cursor_still_replays():
+    journal = _journal_with_events(5)
+    assert journal.resolve(3) == 3
+    assert [e["id"] for e in journal.since(3)[0]] == [4, 5]
+
+
+def test_longpoll_first_contact_times_out_with_head_id(monkeypatch):
+    monkeypatch.setattr(web_server, "EVENT_JOURNAL", _journal_with_events(5))
+    with web_server.LONGPOLL_COND:
+        since_id = web_server.EVENT_JOURNAL.resolve(None)
+        assert web_server.longpoll_payload_locked(since_id) is None
+        payload = web_server.longpoll_payload_locked(since_id, timed_out=True)
+    assert payload == {"status": "timeout", "id": 5}
+
+
+def test_event_stream_first_contact_sends_head_id_without_backlog(monkeypatch):
+    monkeypatch.setattr(web_server, "EVENT_JOURNAL", _journal_with_events(5))
+    with web_server.LONGPOLL_COND:
+        opening, cursor = web_server.stream_open_frame_locked(None)
+        frames, cursor = web_server.stream_frames_locked(cursor)
+    assert opening == f"retry: {web_server.SSE_RETRY_MS}\nid: 5\n\n".encode()
+    assert (frames, cursor) == (b"", 5)
+
+
+def test_event_between_timeout_and_reconnect_is_delivered(monkeypatch):
+    monkeypatch.setattr(web_server, "EVENT_JOURNAL", EventJournal(capacity=16))
+    since_id, _ = web_server.parse_longpoll_params("/ha-events-longpoll?timeout=25")
+    assert since_id is None
+    with web_server.LONGPOLL_COND:
+        payload = web_server.longpoll_payload_locked(web_server.EVENT_JOURNAL.resolve(since_id), timed_out=True)
+    assert payload == {"status": "timeout", "id": 0}
+
+    # Broadcast while the client is between requests; it reconnects with the id it was given.
+    web_server.EVENT_JOURNAL.append("push", "done")
+    since_id, _ = web_server.parse_longpoll_params(f"/ha-events-longpoll?since={payload['id']}&timeout=25")
+    with web_server.LONGPOLL_COND:
+        payload = web_server.longpoll_payload_locked(web_server.EVENT_JOURNAL.resolve(since_id))
+    assert payload["status"] == "event"
+    assert [e["data"] for e in payload["events"]] == ["done"]
+
+
+def test_event_stream_last_event_id_zero_replays(monkeypatch):
+    monkeypatch.setattr(web_server, "EVENT_JOURNAL", EventJournal(capacity=16))
+    web_server.EVENT_JOURNAL.append("storage", "write")
+    cursor = web_server.parse_stream_cursor("/ha-events-stream", "0")
+    with web_server.LONGPOLL_COND:
+        opening, cursor = web_server.stream_open_frame_locked(cursor)
+        frames, cursor = web_server.stream_frames_locked(cursor)
+    assert opening.endswith(b"id: 0\n\n")
+    assert cursor == 1 and b'"data": "write"' in frames
+
+
+def test_persisted_journal_flushes_coalesced_off_the_append(tmp_path):
+    path = str(tmp_path / "events.json")
+    journal = EventJournal(capacity=16, path=path, flush_delay=60)
+    for index in range(3):
+        journal.append("storage", f"write-{index}")
+    # Appends only mark the journal dirty; the timer writes it later.
+    assert not (tmp_path / "events.json").exists()
+    journal._timer.cancel()
+    assert journal.flush() is True
+    assert journal.flush() is False
+    restored = EventJournal(capacity=16, path=path)
+    assert restored.last_id == 3
+    assert [e["data"] for e in restored.since(0)[0]] == ["write-0", "write-1", "write-2"]
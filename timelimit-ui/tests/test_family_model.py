@@ -0,0 +1,94 @@
+import http.client
+import http.server
+import json
+import threading
+
+import web_server
+from family_model import FamilyIndex
+from pull_status_cache import PullStatusCache
+
+SERVER = "http://127.0.0.1:9"
+
+DOC = {
+    "users": {"version": "u1", "data": [
+        {"id": "parent", "name": "Mam", "type": "parent"},
+        {"id": "kid", "name": "Sam", "type": "child"},
+    ]},
+    "devices": {"version": "d1", "data": [
+        {"deviceId": "dev1", "name": "Tablet", "currentUserId": "kid"},
+        {"deviceId": "dev2", "name": "tablet", "currentUserId": "kid"},
+        {"deviceId": "dash", "name": "DashboardControl", "currentUserId": "parent"},
+    ]},
+    "categoryBase": [
+        {"categoryId": "games", "title": "Games", "childId": "kid", "sort": 1},
+        {"categoryId": "allowed", "title": "allowed", "childId": "kid", "sort": 0},
+        {"categoryId": "Bonus", "title": "Bonus", "childId": "kid", "sort": 0},
+        {"categoryId": "minecraft", "title": "Minecraft", "childId": "kid", "parentCategoryId": "games"},
+        {"categoryId": "lost", "title": "Lost", "childId": "kid", "parentCategoryId": "deleted"},
+    ],
+    "categoryApp": [{"categoryId": "minecraft", "apps": ["com.mojang.minecraftpe"]}],
+    "rules": [{"categoryId": "games", "rules": [{"maxTime": 3600000}]}],
+    "usedTimes": [],
+}
+
+
+def _cache_with(doc, token="tok"):
+    cache = PullStatusCache()
+    request = json.dumps({"deviceAuthToken": token, "status": {"devices": "0", "users": "0"}}).encode()
+    context, _ = cache.prepare(SERVER, request)
+    cache.complete(context, 200, json.dumps(doc).encode())
+    return cache
+
+
+def test_roots_follow_tree_js_order_and_orphans_are_roots():
+    family = FamilyIndex(DOC)
+    # sort first, then case-insensitive title, like compareCategoryOrder.
+    assert [c["categoryId"] for c in family.children()] == ["allowed", "Bonus", "lost", "games"]
+    assert [c["categoryId"] for c in family.children("games")] == ["minecraft"]
+    assert family.children("unknown") is None
+
+
+def test_device_lookup_by_name_is_case_insensitive():
+    family = FamilyIndex(DOC)
+    assert [d["deviceId"] for d in family.device(name="TABLET")] == ["dev1", "dev2"]
+    assert family.device(device_id="dash")[0]["name"] == "DashboardControl"
+    assert family.device(name="phone") == []
+
+
+def test_family_model_query(monkeypatch):
+    monkeypatch.setattr(web_server, "SELECTED_SERVER", SERVER)
+    monkeypatch.setattr(web_server, "PULL_STATUS_CACHE", _cache_with(DOC))
+    status, payload = web_server.family_model_query({"deviceAuthToken": "tok", "query": "app",
+                                                     "packageName": "com.mojang.minecraftpe"})
+    assert status == 200
+    assert [c["categoryId"] for c in payload["result"]] == ["minecraft"]
+    assert web_server.family_model_query({"deviceAuthToken": "tok", "query": "colour"})[0] == 400
+    assert web_server.family_model_query({"deviceAuthToken": "tok", "query": "user", "userId": "x"})[0] == 404
+
+
+def test_family_model_query_without_cache(monkeypatch):
+    monkeypatch.setattr(web_server, "SELECTED_SERVER", SERVER)
+    monkeypatch.setattr(web_server, "PULL_STATUS_CACHE", PullStatusCache())
+    status, payload = web_server.family_model_query({"deviceAuthToken": "tok"})
+    assert status == 404 and "error" in payload
+
+
+def test_token_device_is_answered_from_the_cache(monkeypatch):
+    # SERVER refuses connections: any upstream call would turn into an error answer.
+    monkeypatch.setattr(web_server, "SELECTED_SERVER", SERVER)
+    monkeypatch.setattr(web_server, "PULL_STATUS_CACHE", _cache_with(DOC))
+    server = http.server.HTTPServer(("127.0.0.1", 0), web_server.TimeLimitHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=5)
+        conn.request("POST", "/get-token-device", json.dumps({"deviceAuthToken": "tok"}),
+                     {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        payload = json.loads(response.read())
+        conn.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert response.status == 200
+    assert payload["deviceId"] == "dash"
+    assert len(payload["allDevices"]) == 3
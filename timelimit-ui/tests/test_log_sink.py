@@ -0,0 +1,22 @@
+import log_sink
+import web_server
+from log_sink import LogSink
+
+
+def test_private_lines_stay_out_of_the_ring():
+    sink = LogSink()
+    sink.write("[INFO] public")
+    sink.write("[DEBUG] Payload preview (first 500 bytes): {\"password\": \"geheim\"}", private=True)
+    entries, last_seq = sink.lines()
+    assert [line.split("] ", 1)[1] for _, line in entries] == ["[INFO] public"]
+    assert last_seq == 1
+    assert sink.stats()["private"] == 1
+
+
+def test_verbose_payload_previews_are_not_served_by_logs(monkeypatch):
+    sink = LogSink()
+    monkeypatch.setattr(log_sink, "SINK", sink)
+    monkeypatch.setattr(web_server, "LOGGING_MODE", "verbose")
+    web_server.private_log("[DEBUG-INT] Regenerated secondHash: %s", "$2a$12$secret")
+    web_server.log("[DEBUG] API Response status: %s", 200)
+    assert [line.split("] ", 1)[1] for _, line in sink.lines()[0]] == ["[DEBUG] API Response status: 200"]
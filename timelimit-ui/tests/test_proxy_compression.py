@@ -0,0 +1,44 @@
+import gzip
+
+from proxy_compression import ProxyCompression
+
+BODY = b'{"devices":[' + b'{"id":"abc","name":"tablet"},' * 200 + b'{}]}'
+
+
+def _stream(encoder, body, size=100):
+    out = b"".join(
+        data for i in range(0, len(body), size) for data in encoder.feed(memoryview(body)[i:i + size], 256)
+    )
+    return out + encoder.finish()
+
+
+def test_stream_gzips_identity_upstream_for_gzip_client():
+    compression = ProxyCompression()
+    encoder = compression.stream_encoder(None, True, len(BODY))
+    assert encoder.content_encoding == "gzip" and not encoder.keeps_length
+    wire = _stream(encoder, BODY)
+    assert gzip.decompress(wire) == BODY
+    stats = compression.stats()
+    assert stats["compressed"] == 1
+    assert (stats["bytesRaw"], stats["bytesWire"]) == (len(BODY), len(wire))
+
+
+def test_stream_inflates_gzip_upstream_for_plain_client():
+    compression = ProxyCompression()
+    encoder = compression.stream_encoder("gzip", False)
+    assert encoder.content_encoding is None
+    assert _stream(encoder, gzip.compress(BODY)) == BODY
+    assert compression.stats()["decompressed"] == 1
+
+
+def test_stream_passes_small_and_gzip_bodies_on():
+    compression = ProxyCompression()
+    small = compression.stream_encoder(None, True, 100)
+    assert small.keeps_length and _stream(small, BODY[:100]) == BODY[:100]
+    packed = gzip.compress(BODY)
+    passthrough = compression.stream_encoder("gzip", True, len(packed))
+    assert passthrough.content_encoding == "gzip"
+    assert _stream(passthrough, packed) == packed
+    stats = compression.stats()
+    assert (stats["identity"], stats["passthrough"]) == (1, 1)
+    assert stats["bytesRaw"] == 100 + len(BODY)
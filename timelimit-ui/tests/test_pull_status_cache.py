@@ -0,0 +1,82 @@
+import json
+
+from pull_status_cache import PullStatusCache, build_client_status, merge_pull_status
+
+
+def _cached():
+    return {
+        "apiLevel": 7,
+        "devices": {"version": "d1", "data": [{"deviceId": "dev1"}]},
+        "users": {"version": "u1", "data": [{"id": "parent"}]},
+        "apps": [{"deviceId": "dev1", "version": "a1", "apps": ["com.game"]}],
+        "devices2": [{"deviceId": "dev1", "version": "x1"}],
+        "categoryBase": [
+            {"categoryId": "games", "version": "b1", "title": "Games"},
+            {"categoryId": "school", "version": "b1", "title": "School"},
+        ],
+        "categoryApp": [{"categoryId": "games", "version": "p1"}, {"categoryId": "school", "version": "p1"}],
+        "rules": [{"categoryId": "games", "version": "r1"}, {"categoryId": "school", "version": "r1"}],
+        "usedTimes": [{"categoryId": "games", "version": "t1"}, {"categoryId": "school", "version": "t1"}],
+    }
+
+
+def test_removed_category_disappears_from_every_section():
+    merged = merge_pull_status(_cached(), {"apiLevel": 8, "rmCategories": ["school"]})
+    for section in ("categoryBase", "categoryApp", "rules", "usedTimes"):
+        assert [item["categoryId"] for item in merged[section]] == ["games"]
+    assert merged["apiLevel"] == 8
+    assert "rmCategories" not in merged
+
+
+def test_partial_category_update_replaces_only_that_category():
+    merged = merge_pull_status(_cached(), {"rules": [{"categoryId": "games", "version": "r2", "rules": [1]}]})
+    assert merged["rules"] == [
+        {"categoryId": "games", "version": "r2", "rules": [1]},
+        {"categoryId": "school", "version": "r1"},
+    ]
+    assert merged["categoryBase"] == _cached()["categoryBase"]
+    assert merged["users"] == _cached()["users"]
+
+
+def test_devices_and_users_version_bump_replaces_the_section():
+    partial = {
+        "devices": {"version": "d2", "data": [{"deviceId": "dev1"}, {"deviceId": "dev2"}]},
+        "users": {"version": "u2", "data": [{"id": "parent"}, {"id": "child"}]},
+        "apps": [{"deviceId": "dev2", "version": "a1", "apps": []}],
+        "devices2": [{"deviceId": "dev1", "version": "x2"}],
+    }
+    merged = merge_pull_status(_cached(), partial)
+    assert merged["devices"] == partial["devices"]
+    assert merged["users"] == partial["users"]
+    assert [item["deviceId"] for item in merged["apps"]] == ["dev1", "dev2"]
+    assert merged["devices2"] == [{"deviceId": "dev1", "version": "x2"}]
+
+
+def test_client_status_reports_cached_versions():
+    status = build_client_status(_cached(), {"clientLevel": 8, "devices": "0", "users": "0"})
+    assert status["clientLevel"] == 8
+    assert (status["devices"], status["users"]) == ("d1", "u1")
+    assert status["apps"] == {"dev1": "a1"}
+    assert status["categories"]["games"] == {"base": "b1", "apps": "p1", "rules": "r1", "usedTime": "t1"}
+
+
+def test_client_status_requests_missing_category_sections_from_scratch():
+    cached = _cached()
+    cached["usedTimes"] = [{"categoryId": "games", "version": "t1"}]
+    status = build_client_status(cached, {})
+    assert status["categories"]["school"]["usedTime"] == "0"
+    assert "tasks" not in status["categories"]["school"]
+
+
+def test_second_full_pull_asks_upstream_for_changes_only():
+    cache = PullStatusCache()
+    request = json.dumps({"deviceAuthToken": "tok", "status": {"devices": "0", "users": "0"}}).encode()
+    context, upstream = cache.prepare("http://upstream", request)
+    assert upstream == request
+    cache.complete(context, 200, json.dumps(_cached()).encode())
+
+    context, upstream = cache.prepare("http://upstream", request)
+    assert json.loads(upstream)["status"]["devices"] == "d1"
+    full_body, delta_body = cache.complete(context, 200, b'{"rmCategories": ["school"]}')
+    assert [item["categoryId"] for item in json.loads(full_body)["rules"]] == ["games"]
+    assert delta_body == b'{"rmCategories": ["school"]}'
@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+from push_outbox import PushOutbox
+
+
+def _outbox(tmp_path):
+    return PushOutbox(str(tmp_path / "outbox.json"), lambda *args: (200, b"{}"))
+
+
+def test_bad_action_leaves_outbox_unchanged(tmp_path):
+    outbox = _outbox(tmp_path)
+    assert outbox.enqueue("http://upstream", "token", [{"sequenceNumber": 1, "integrity": "a"}]) == (1, 0)
+    with open(outbox.path, 'rb') as f:
+        stored = f.read()
+    with pytest.raises(ValueError):
+        outbox.enqueue("http://upstream", "token", [{"sequenceNumber": 2, "integrity": "b"}, {"integrity": "c"}])
+    assert outbox.depth() == 1
+    assert outbox.stats()["enqueued"] == 1
+    with open(outbox.path, 'rb') as f:
+        assert f.read() == stored
+
+
+def test_bad_first_batch_creates_no_queue(tmp_path):
+    outbox = _outbox(tmp_path)
+    with pytest.raises(ValueError):
+        outbox.enqueue("http://upstream", "token", [{"sequenceNumber": 1}, "not an action"])
+    assert outbox.depth() == 0
+    assert not os.path.exists(outbox.path)
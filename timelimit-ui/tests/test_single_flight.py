@@ -0,0 +1,25 @@
+import threading
+
+from single_flight import SingleFlight
+
+
+def test_invalidate_detaches_a_flight_in_progress():
+    flights = SingleFlight(ttl=10)
+    started, release = threading.Event(), threading.Event()
+    results = []
+
+    def before_push():
+        started.set()
+        release.wait(5)
+        return "before"
+
+    thread = threading.Thread(target=lambda: results.append(flights.do(("srv", "tok", "a"), before_push)))
+    thread.start()
+    started.wait(5)
+    flights.invalidate("srv", "tok")
+    # A call after the invalidation does not join the older flight.
+    assert flights.do(("srv", "tok", "a"), lambda: "after") == ("after", "leader")
+    release.set()
+    thread.join(5)
+    assert results == [("before", "leader")]
+    assert flights.do(("srv", "tok", "a"), lambda: "again") == ("after", "cached")
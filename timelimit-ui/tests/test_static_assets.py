@@ -0,0 +1,22 @@
+from static_assets import StaticAsset
+
+
+def _asset():
+    return StaticAsset("app.js", b"console.log('timelimit');\n" * 200, "text/javascript; charset=utf-8")
+
+
+def test_gzip_selected_when_accepted():
+    body, etag, encoding = _asset().select("gzip, deflate, br")
+    assert encoding == "gzip"
+    assert etag.endswith('-gz"')
+
+
+def test_gzip_refused_with_q_zero():
+    asset = _asset()
+    assert asset.select("gzip;q=0, identity") == (asset.body, asset.etag, None)
+    assert asset.select("gzip; q=0.0") == (asset.body, asset.etag, None)
+
+
+def test_identity_without_accept_encoding():
+    asset = _asset()
+    assert asset.select(None) == (asset.body, asset.etag, None)
@@ -0,0 +1,60 @@
+import json
+import os
+import time
+
+import storage_engine
+from storage_engine import StorageEngine
+
+
+def _wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def test_failed_flush_is_retried_without_another_write(tmp_path, monkeypatch):
+    path = tmp_path / "storage.json"
+    engine = StorageEngine(str(path), flush_delay=0.01)
+    real_replace = os.replace
+    calls = []
+
+    def failing_once(src, dst):
+        calls.append(dst)
+        if len(calls) == 1:
+            raise OSError("disk full")
+        return real_replace(src, dst)
+
+    monkeypatch.setattr(storage_engine.os, "replace", failing_once)
+    engine.replace({"rules": [1, 2, 3]})
+
+    assert _wait_for(lambda: engine.stats()["flushes"] == 1)
+    stats = engine.stats()
+    assert stats["flushFailures"] == 1
+    assert not stats["dirty"]
+    with open(path) as f:
+        assert json.load(f)["rules"] == [1, 2, 3]
+
+
+def test_retry_delay_backs_off(tmp_path, monkeypatch):
+    engine = StorageEngine(str(tmp_path / "storage.json"), flush_delay=0.5)
+    delays = []
+
+    class FakeTimer:
+        def __init__(self, delay, fn):
+            delays.append(delay)
+            self.daemon = False
+
+        def start(self):
+            pass
+
+    monkeypatch.setattr(storage_engine.threading, "Timer", FakeTimer)
+    monkeypatch.setattr(storage_engine.os, "replace", lambda src, dst: (_ for _ in ()).throw(OSError("read-only")))
+    engine.replace({"a": 1})
+    for _ in range(8):
+        assert engine.flush() is False
+    assert delays[:4] == [0.5, 1.0, 2.0, 4.0]
+    assert delays[-1] == storage_engine.FLUSH_RETRY_MAX_S
+    assert engine.stats()["dirty"]
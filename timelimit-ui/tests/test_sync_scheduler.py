@@ -0,0 +1,34 @@
+from sync_scheduler import SyncScheduler, body_digest
+
+
+def test_digest_ignores_key_order():
+    assert body_digest(b'{"users":{"a":1},"devices":[1,2]}') == body_digest(b'{"devices": [1, 2], "users": {"a": 1}}')
+    assert body_digest(b'{"devices":[1,2]}') != body_digest(b'{"devices":[2,1]}')
+
+
+def test_reordered_body_is_not_a_change():
+    changes = []
+    scheduler = SyncScheduler(lambda *args: (None, None), lambda *args: changes.append(args), lambda: True)
+    scheduler.touch("http://upstream", "token", b"{}")
+    first = scheduler.record("http://upstream", "token", b'{"apiLevel":8,"users":{"data":[]}}')
+    second = scheduler.record("http://upstream", "token", b'{"users":{"data":[]},"apiLevel":8}')
+    assert first == second
+    assert changes == []
+    scheduler.record("http://upstream", "token", b'{"users":{"data":[1]},"apiLevel":8}')
+    assert len(changes) == 1
+
+
+def test_pull_started_before_a_push_is_not_stored():
+    scheduler = SyncScheduler(lambda *args: (None, None), lambda *args: None, lambda: True)
+    scheduler.touch("http://upstream", "token", b"{}")
+    pushes = scheduler.push_generation("http://upstream", "token")
+    scheduler.boost("http://upstream", "token")
+    scheduler.record("http://upstream", "token", b'{"apiLevel":8}', pushes)
+    assert scheduler.latest("http://upstream", "token") is None
+    # The boosted pull is still due now.
+    with scheduler._cond:
+        schedule, wait = scheduler._next_due_locked()
+    assert schedule is not None and wait == 0
+
+    scheduler.record("http://upstream", "token", b'{"apiLevel":8}', scheduler.push_generation("http://upstream", "token"))
+    assert scheduler.latest("http://upstream", "token") is not None
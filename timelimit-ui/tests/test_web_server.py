@@ -0,0 +1,12 @@
+from web_server import fairness_client
+
+
+def test_fairness_client_uses_the_ingress_hop():
+    assert fairness_client("1.2.3.4, 192.168.1.20", "172.30.32.2") == "192.168.1.20"
+    # A browser rotating its own X-Forwarded-For still maps to the address the ingress added.
+    assert fairness_client("9.9.9.9, 192.168.1.20", "172.30.32.2") == "192.168.1.20"
+
+
+def test_fairness_client_falls_back_to_peer():
+    assert fairness_client(None, "192.168.1.30") == "192.168.1.30"
+    assert fairness_client(" , ", "192.168.1.30") == "192.168.1.30"
@@ -0,0 +1,65 @@
+import http.client
+import http.server
+import socket
+import threading
+
+from worker_pool import PooledHTTPServer
+
+STREAMS = 24
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    release = threading.Event()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if self.path == "/stream" else "text/plain")
+        if self.path == "/stream":
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(b"retry: 1000\n\n")
+            self.wfile.flush()
+            self.release.wait(10)
+            self.close_connection = True
+            return
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+
+def _lane_for(method, path):
+    return "longpoll" if path == "/stream" else "static"
+
+
+def test_event_streams_do_not_hold_pool_workers():
+    server = PooledHTTPServer(("127.0.0.1", 0), _Handler, lane_for=_lane_for, workers=4)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    streams = []
+    try:
+        for _ in range(STREAMS):
+            sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+            sock.sendall(b"GET /stream HTTP/1.1\r\nHost: test\r\n\r\n")
+            streams.append(sock)
+        for sock in streams:
+            assert sock.makefile("rb").readline().startswith(b"HTTP/1.1 200")
+
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        conn.request("GET", "/index.html")
+        response = conn.getresponse()
+        assert (response.status, response.read()) == (200, b"ok")
+        conn.close()
+
+        stats = server.stats()
+        assert stats["lanes"]["longpoll"]["active"] == STREAMS
+        assert stats["pool"]["workers"] == 4
+    finally:
+        _Handler.release.set()
+        for sock in streams:
+            sock.close()
+        server.shutdown()
+        server.server_close()